@@ -11,6 +11,7 @@ from keyboards import (
     create_period_selection_keyboard
 )
 from utils import format_price, format_date
+from database import day_range
 from localization import t
 
 logger = logging.getLogger(__name__)
@@ -25,6 +26,9 @@ class AdminHandler:
     def is_admin(self, telegram_id):
         """Проверка прав администратора"""
         try:
+            context = self.db.current_context()
+            if context is not None and context.telegram_id == telegram_id and not context.user_stale:
+                return context.is_admin
             user = self.db.get_user_by_telegram_id(telegram_id)
             return user and user[0][6] == 1  # is_admin поле
         except Exception as e:
@@ -79,8 +83,8 @@ class AdminHandler:
                     COALESCE(SUM(total_amount), 0) as revenue_today,
                     COUNT(DISTINCT user_id) as customers_today
                 FROM orders 
-                WHERE DATE(created_at) = ?
-            ''', (today,))
+                WHERE created_at >= ? AND created_at < ?
+            ''', day_range(today))
             
             if stats:
                 orders_today, revenue_today, customers_today = stats[0]
@@ -301,15 +305,15 @@ class AdminHandler:
             # Получаем сегментацию клиентов
             from crm import CRMManager
             crm = CRMManager(self.db)
-            segments = crm.segment_customers()
+            segments = crm.get_segment_summary()
             
             crm_text = f"👥 <b>CRM - Управление клиентами</b>\n\n"
-            crm_text += f"🏆 Чемпионы: {len(segments.get('champions', []))}\n"
-            crm_text += f"💎 Лояльные: {len(segments.get('loyal', []))}\n"
-            crm_text += f"🌟 Потенциальные: {len(segments.get('potential', []))}\n"
-            crm_text += f"🆕 Новые: {len(segments.get('new', []))}\n"
-            crm_text += f"⚠️ Требуют внимания: {len(segments.get('need_attention', []))}\n"
-            crm_text += f"🚨 В зоне риска: {len(segments.get('at_risk', []))}\n\n"
+            crm_text += f"🏆 Чемпионы: {segments['champions']['customers']}\n"
+            crm_text += f"💎 Лояльные: {segments['loyal']['customers']}\n"
+            crm_text += f"🌟 Потенциальные: {segments['potential']['customers']}\n"
+            crm_text += f"🆕 Новые: {segments['new']['customers']}\n"
+            crm_text += f"⚠️ Требуют внимания: {segments['need_attention']['customers']}\n"
+            crm_text += f"🚨 В зоне риска: {segments['at_risk']['customers']}\n\n"
             crm_text += f"📊 Подробная аналитика в веб-панели"
             
             self.bot.send_message(chat_id, crm_text, create_admin_keyboard())
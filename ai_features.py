@@ -5,6 +5,8 @@ AI функции для телеграм-бота
 import re
 from datetime import datetime
 from collections import Counter
+from customer_scores import CustomerScores
+from item_similarity import ItemSimilarityIndex
 
 class AIRecommendationEngine:
     def __init__(self, db):
@@ -80,50 +82,10 @@ class AIRecommendationEngine:
         ''', (limit,))
     
     def get_collaborative_recommendations(self, user_id, limit=5):
-        """Коллаборативная фильтрация - "Покупатели также покупали" """
-        # Находим похожих пользователей
-        similar_users = self.db.execute_query('''
-            SELECT DISTINCT o2.user_id, COUNT(*) as common_products
-            FROM order_items oi1
-            JOIN orders o1 ON oi1.order_id = o1.id
-            JOIN order_items oi2 ON oi1.product_id = oi2.product_id
-            JOIN orders o2 ON oi2.order_id = o2.id
-            WHERE o1.user_id = ? AND o2.user_id != ? 
-            AND o1.status != 'cancelled' AND o2.status != 'cancelled'
-            GROUP BY o2.user_id
-            HAVING common_products >= 2
-            ORDER BY common_products DESC
-            LIMIT 10
-        ''', (user_id, user_id))
-        
-        if not similar_users:
+        """Коллаборативная фильтрация - "Покупатели также покупали" (индекс совместных покупок)"""
+        recommendations = ItemSimilarityIndex(self.db).recommend_for_user(user_id, limit)
+        if not recommendations:
             return self.get_trending_products(limit)
-        
-        # Получаем товары, которые покупали похожие пользователи
-        similar_user_ids = [user[0] for user in similar_users]
-        placeholders = ','.join('?' * len(similar_user_ids))
-        
-        recommendations = self.db.execute_query(f'''
-            SELECT p.*, c.name as category_name,
-                   COUNT(*) as recommendation_score
-            FROM products p
-            JOIN categories c ON p.category_id = c.id
-            JOIN order_items oi ON p.id = oi.product_id
-            JOIN orders o ON oi.order_id = o.id
-            WHERE p.is_active = 1
-            AND o.user_id IN ({placeholders})
-            AND o.status != 'cancelled'
-            AND p.id NOT IN (
-                SELECT DISTINCT oi2.product_id
-                FROM order_items oi2
-                JOIN orders o2 ON oi2.order_id = o2.id
-                WHERE o2.user_id = ?
-            )
-            GROUP BY p.id
-            ORDER BY recommendation_score DESC, p.views DESC
-            LIMIT ?
-        ''', (*similar_user_ids, user_id, limit))
-        
         return recommendations
     
     def analyze_search_intent(self, search_query):
@@ -584,6 +546,11 @@ class SmartNotificationAI:
     
     def predict_user_churn_risk(self, user_id):
         """Прогноз риска ухода клиента"""
+        # Свежая оценка из пакетного пересчета
+        scores = CustomerScores(self.db).get(user_id)
+        if scores:
+            return CustomerScores.churn_risk(scores)
+        
         # Анализируем активность пользователя
         user_stats = self.db.execute_query('''
             SELECT 
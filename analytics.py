@@ -2,6 +2,8 @@
 """Аналитика: сводные метрики, топы, временные ряды."""
 from datetime import datetime
 
+from database import day_range
+
 def get_sales_report(db, start_date, end_date):
     """Сводные метрики за период: кол-во заказов, выручка, средний чек, уникальные клиенты, топ-товары и топ-клиенты."""
     sales = db.execute_query('''
@@ -11,9 +13,9 @@ def get_sales_report(db, start_date, end_date):
             IFNULL(AVG(total_amount), 0) as avg_order_value,
             COUNT(DISTINCT user_id) as unique_customers
         FROM orders
-        WHERE DATE(created_at) BETWEEN ? AND ?
+        WHERE created_at >= ? AND created_at < ?
           AND status != 'cancelled'
-    ''', (start_date, end_date)) or [(0,0,0,0)]
+    ''', day_range(start_date, end_date)) or [(0,0,0,0)]
     sales_row = sales[0]
 
     top_products = db.execute_query('''
@@ -23,12 +25,12 @@ def get_sales_report(db, start_date, end_date):
         FROM order_items oi
         JOIN products p ON p.id = oi.product_id
         JOIN orders o ON o.id = oi.order_id
-        WHERE DATE(o.created_at) BETWEEN ? AND ?
+        WHERE o.created_at >= ? AND o.created_at < ?
           AND o.status != 'cancelled'
         GROUP BY p.id, p.name
         ORDER BY revenue DESC
         LIMIT 10
-    ''', (start_date, end_date)) or []
+    ''', day_range(start_date, end_date)) or []
 
     top_users = db.execute_query('''
         SELECT u.id, u.name,
@@ -36,12 +38,12 @@ def get_sales_report(db, start_date, end_date):
                COUNT(o.id) as orders
         FROM users u
         JOIN orders o ON o.user_id = u.id
-        WHERE DATE(o.created_at) BETWEEN ? AND ?
+        WHERE o.created_at >= ? AND o.created_at < ?
           AND o.status != 'cancelled'
         GROUP BY u.id, u.name
         ORDER BY spent DESC
         LIMIT 10
-    ''', (start_date, end_date)) or []
+    ''', day_range(start_date, end_date)) or []
 
     return type('SalesReport', (), {'sales_data':[sales_row], 'top_products': top_products, 'top_users': top_users})
 
@@ -59,9 +61,9 @@ def get_timeseries(db, start_date, end_date, group='daily'):
                IFNULL(SUM(total_amount), 0) as revenue,
                COUNT(DISTINCT user_id) as customers
         FROM orders
-        WHERE DATE(created_at) BETWEEN ? AND ?
+        WHERE created_at >= ? AND created_at < ?
           AND status != 'cancelled'
         GROUP BY bucket
         ORDER BY bucket
-    ''', (start_date, end_date)) or []
+    ''', day_range(start_date, end_date)) or []
     return rows
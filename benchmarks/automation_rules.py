@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк проверки правил автоматизации: агрегат по заказам на каждое правило
+против одной общей сводки пользователей для всех правил типа триггера
+
+Полный прогон (первый запуск правил) и инкрементальный — после нескольких новых заказов.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+import marketing_automation
+
+
+class Notifications:
+    def send_instant_push(self, *args, **kwargs):
+        pass
+
+
+def make_manager(db):
+    """Менеджер без фонового потока: прогоны вызываем сами"""
+    manager = object.__new__(marketing_automation.MarketingAutomationManager)
+    manager.db = db
+    manager.notification_manager = Notifications()
+    manager.automation_rules = {}
+    manager._compiled = {}
+    manager._wake = threading.Event()
+    manager.stats = {'runs': 0, 'full_runs': 0, 'compiled': 0, 'candidates': 0, 'executions': 0, 'last_run_ms': 0}
+    manager.personalize_message = lambda user_id, template: template
+    return manager
+
+
+def fill(db, users, orders):
+    random.seed(1)
+    db.execute_many('INSERT INTO users (telegram_id, name) VALUES (?, ?)',
+                    [(10 ** 6 + i, f'user{i}') for i in range(users)])
+    user_ids = [row[0] for row in db.execute_query('SELECT id FROM users')]
+    db.execute_many('''
+        INSERT INTO orders (user_id, total_amount, status, created_at)
+        VALUES (?, ?, ?, datetime('now', ?))
+    ''', [(random.choice(user_ids), round(random.uniform(5, 300), 2),
+           random.choice(['pending', 'confirmed', 'delivered', 'cancelled']),
+           f'-{random.randint(2, 365 * 24)} hours') for _ in range(orders)])
+    return user_ids
+
+
+def per_rule(db, thresholds):
+    """Прежний способ: отдельный GROUP BY по всем заказам для каждого правила"""
+    matched = 0
+    for threshold in thresholds:
+        matched += len(db.execute_query('''
+            SELECT user_id, SUM(total_amount) FROM orders
+            WHERE status != 'cancelled'
+            GROUP BY user_id
+            HAVING SUM(total_amount) >= ?
+        ''', (threshold,)))
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--rules', type=int, nargs='+', default=[1, 5, 20])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'bench.db'))
+        user_ids = fill(db, args.users, args.orders)
+        print(f"пользователей {args.users}, заказов {args.orders}")
+        print(f"{'правил':>6} {'по правилу, мс':>15} {'общая сводка, мс':>17} {'инкремент, мс':>14}")
+        for count in args.rules:
+            db.execute_query('DELETE FROM automation_rules')
+            db.execute_query('DELETE FROM automation_watermarks')
+            db.execute_query('DELETE FROM automation_executions')
+            thresholds = [500 + 250 * i for i in range(count)]
+            manager = make_manager(db)
+            for threshold in thresholds:
+                manager.create_automation_rule(
+                    f'spend {threshold}', 'customer_milestone',
+                    {'milestone_type': 'spending_threshold', 'spending_amount': threshold},
+                    [{'type': 'send_notification', 'message_template': 'vip'}]
+                )
+
+            started = time.perf_counter()
+            per_rule(db, thresholds)
+            legacy_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            manager.process_automation_rules()
+            full_ms = (time.perf_counter() - started) * 1000
+
+            # Несколько новых заказов: проверяются только их покупатели
+            db.execute_many('INSERT INTO orders (user_id, total_amount, status) VALUES (?, ?, ?)',
+                            [(random.choice(user_ids), 400, 'pending') for _ in range(20)])
+            started = time.perf_counter()
+            manager.process_automation_rules()
+            incremental_ms = (time.perf_counter() - started) * 1000
+            print(f"{count:>6} {legacy_ms:>15.1f} {full_ms:>17.1f} {incremental_ms:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
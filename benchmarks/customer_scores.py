@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк оценок клиентов: predict_user_churn_risk и get_customer_lifetime_value_prediction
+по каждому клиенту против пакетного пересчета customer_scores (NumPy, если установлен)
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+import customer_scores
+from customer_scores import CustomerScores
+
+
+def fill(db, users, orders):
+    random.seed(1)
+    db.execute_many('INSERT INTO users (telegram_id, name) VALUES (?, ?)',
+                    [(10 ** 6 + i, f'user{i}') for i in range(users)])
+    user_ids = [row[0] for row in db.execute_query('SELECT id FROM users WHERE is_admin = 0')]
+    db.execute_many('''
+        INSERT INTO orders (user_id, total_amount, status, created_at)
+        VALUES (?, ?, ?, datetime('now', ?))
+    ''', [(random.choice(user_ids), round(random.uniform(5, 300), 2),
+           random.choice(['pending', 'confirmed', 'delivered', 'cancelled']),
+           f'-{random.randint(2, 365 * 24)} hours') for _ in range(orders)])
+    return user_ids
+
+
+def per_user(db, user_ids):
+    """Прежний способ: два набора запросов на каждого клиента"""
+    for user_id in user_ids:
+        db.execute_query('''
+            SELECT COUNT(o.id), MAX(o.created_at), AVG(o.total_amount),
+                   julianday('now') - julianday(MAX(o.created_at))
+            FROM orders o
+            WHERE o.user_id = ? AND o.status != 'cancelled'
+        ''', (user_id,))
+        db.execute_query('''
+            SELECT total_amount, created_at FROM orders
+            WHERE user_id = ? AND status != 'cancelled'
+            ORDER BY created_at
+        ''', (user_id,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--orders-per-user', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"NumPy: {'да' if customer_scores.np is not None else 'нет (цикл на Python)'}")
+    print(f"{'клиентов':>8} {'по клиенту, мс':>15} {'пакетно, мс':>12} {'чтение оценки, мкс':>19}")
+    for users in args.users:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManager(os.path.join(tmp, 'bench.db'))
+            user_ids = fill(db, users, users * args.orders_per_user)
+
+            started = time.perf_counter()
+            per_user(db, user_ids)
+            legacy_ms = (time.perf_counter() - started) * 1000
+
+            scores = CustomerScores(db)
+            started = time.perf_counter()
+            scores.score_all()
+            batch_ms = (time.perf_counter() - started) * 1000
+
+            sample = random.sample(user_ids, min(1000, len(user_ids)))
+            started = time.perf_counter()
+            for user_id in sample:
+                scores.get(user_id)
+            lookup_us = (time.perf_counter() - started) / len(sample) * 10 ** 6
+            print(f"{users:>8} {legacy_ms:>15.1f} {batch_ms:>12.1f} {lookup_us:>19.1f}")
+
+
+if __name__ == '__main__':
+    main()
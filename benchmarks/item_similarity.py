@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк рекомендаций «покупатели также покупали»: прежнее самосоединение
+order_items/orders на каждый запрос против индекса совместных покупок item_neighbors
+
+Синтетическая история: популярность товаров по закону Ципфа, покупатели тяготеют
+к «своей» категории. Проверяется, что инкрементальное обновление с отменами дает тот же
+индекс, что и полное построение (после пересчета соседей).
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+from item_similarity import ItemSimilarityIndex
+
+
+def fill(db, users, products, orders, categories=6):
+    random.seed(1)
+    category_ids = [row[0] for row in db.execute_query('SELECT id FROM categories')][:categories]
+    db.execute_many('''
+        INSERT INTO products (name, price, category_id, stock, is_active) VALUES (?, ?, ?, 100, 1)
+    ''', [(f'bench{i}', round(random.uniform(5, 300), 2), category_ids[i % len(category_ids)]) for i in range(products)])
+    product_rows = db.execute_query("SELECT id, category_id FROM products WHERE name LIKE 'bench%'")
+    by_category = {}
+    for product_id, category_id in product_rows:
+        by_category.setdefault(category_id, []).append(product_id)
+    weights = {cid: [1 / (rank + 1) for rank in range(len(ids))] for cid, ids in by_category.items()}
+
+    db.execute_many('INSERT INTO users (telegram_id, name) VALUES (?, ?)',
+                    [(10 ** 6 + i, f'user{i}') for i in range(users)])
+    user_ids = [row[0] for row in db.execute_query('SELECT id FROM users WHERE is_admin = 0')]
+    favorite = {user_id: random.choice(category_ids) for user_id in user_ids}
+    add_orders(db, user_ids, favorite, by_category, weights, orders)
+    return user_ids, favorite, by_category, weights
+
+
+def add_orders(db, user_ids, favorite, by_category, weights, count):
+    with db.transaction():
+        for _ in range(count):
+            user_id = random.choice(user_ids)
+            order_id = db.execute_query(
+                'INSERT INTO orders (user_id, total_amount, status) VALUES (?, ?, ?)',
+                (user_id, 0, random.choice(['pending', 'delivered', 'delivered', 'cancelled']))
+            )
+            items = set()
+            for _ in range(random.randint(1, 5)):
+                category_id = favorite[user_id] if random.random() < 0.7 else random.choice(list(by_category))
+                items.add(random.choices(by_category[category_id], weights[category_id])[0])
+            db.execute_many('INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, 1, 10)',
+                            [(order_id, product_id) for product_id in items])
+
+
+def legacy_collaborative(db, user_id, limit=5):
+    """Прежний get_collaborative_recommendations: похожие покупатели самосоединением"""
+    similar_users = db.execute_query('''
+        SELECT DISTINCT o2.user_id, COUNT(*) as common_products
+        FROM order_items oi1
+        JOIN orders o1 ON oi1.order_id = o1.id
+        JOIN order_items oi2 ON oi1.product_id = oi2.product_id
+        JOIN orders o2 ON oi2.order_id = o2.id
+        WHERE o1.user_id = ? AND o2.user_id != ?
+        AND o1.status != 'cancelled' AND o2.status != 'cancelled'
+        GROUP BY o2.user_id
+        HAVING common_products >= 2
+        ORDER BY common_products DESC
+        LIMIT 10
+    ''', (user_id, user_id))
+    if not similar_users:
+        return []
+    placeholders = ','.join('?' * len(similar_users))
+    return db.execute_query(f'''
+        SELECT p.id, COUNT(*) as recommendation_score
+        FROM products p
+        JOIN order_items oi ON p.id = oi.product_id
+        JOIN orders o ON oi.order_id = o.id
+        WHERE p.is_active = 1 AND o.user_id IN ({placeholders}) AND o.status != 'cancelled'
+        AND p.id NOT IN (
+            SELECT DISTINCT oi2.product_id FROM order_items oi2
+            JOIN orders o2 ON oi2.order_id = o2.id WHERE o2.user_id = ?
+        )
+        GROUP BY p.id
+        ORDER BY recommendation_score DESC
+        LIMIT ?
+    ''', (*[row[0] for row in similar_users], user_id, limit))
+
+
+def timed(func, args_list):
+    samples = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def snapshot(db):
+    return (db.execute_query('SELECT * FROM item_counts ORDER BY 1'),
+            db.execute_query('SELECT * FROM item_pairs ORDER BY 1, 2'),
+            db.execute_query('SELECT product_id, neighbor_id, round(score, 9) FROM item_neighbors ORDER BY 1, 2'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--orders', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--samples', type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"покупателей {args.users}, товаров {args.products}")
+    print(f"{'заказов':>8} {'построение, мс':>15} {'+100 заказов и 20 отмен, мс':>28} "
+          f"{'самосоединение, мс (медиана/макс)':>34} {'индекс, мс':>11} {'на товар, мс':>13}")
+    for orders in args.orders:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManager(os.path.join(tmp, 'bench.db'))
+            user_ids, favorite, by_category, weights = fill(db, args.users, args.products, orders)
+            index = ItemSimilarityIndex(db)
+
+            started = time.perf_counter()
+            index.update()
+            build_ms = (time.perf_counter() - started) * 1000
+
+            add_orders(db, user_ids, favorite, by_category, weights, 100)
+            db.execute_query('''
+                UPDATE orders SET status = CASE status WHEN 'cancelled' THEN 'delivered' ELSE 'cancelled' END
+                WHERE id IN (SELECT id FROM orders ORDER BY RANDOM() LIMIT 20)
+            ''')
+            started = time.perf_counter()
+            index.update()
+            incremental_ms = (time.perf_counter() - started) * 1000
+
+            # Инкрементальное обновление должно совпасть с построением с нуля
+            # (соседи товаров не из новых заказов догоняют при суточном пересчете)
+            index.refresh_neighbors()
+            incremental = snapshot(db)
+            index.rebuild()
+            assert snapshot(db) == incremental, 'инкрементальный индекс расходится с полным построением'
+
+            users = [(user_id,) for user_id in random.sample(user_ids, args.samples)]
+            products = [(row[0],) for row in db.execute_query(
+                'SELECT product_id FROM item_counts ORDER BY RANDOM() LIMIT ?', (args.samples,))]
+            legacy_median, legacy_max = timed(lambda user_id: legacy_collaborative(db, user_id), users)
+            index_median, _ = timed(lambda user_id: index.recommend_for_user(user_id), users)
+            product_median, _ = timed(lambda product_id: index.also_bought(product_id), products)
+            print(f"{orders:>8} {build_ms:>15.0f} {incremental_ms:>28.1f} "
+                  f"{f'{legacy_median:.1f} / {legacy_max:.1f}':>34} {index_median:>11.2f} {product_median:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
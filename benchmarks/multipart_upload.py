@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Загрузка фото через multipart: прежнее тело в памяти против потокового MultipartBody
+
+Локальный HTTP-сервер вместо Telegram принимает sendPhoto и проверяет тело.
+Пиковая память Python-аллокаций меряется tracemalloc (страницы mmap в нее не входят —
+они не копируются в кучу процесса).
+"""
+
+import argparse
+import email.parser
+import email.policy
+import json
+import mimetypes
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram_api import MultipartBody, TelegramAPI
+
+
+def encode_in_memory(fields, files):
+    """Прежний способ: все тело собирается в BytesIO, файл читается целиком"""
+    boundary = "----WebKitFormBoundary" + uuid.uuid4().hex
+    body_io = BytesIO()
+    for name, value in fields.items():
+        body_io.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filepath in files.items():
+        filename = os.path.basename(filepath)
+        ctype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        body_io.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'.encode())
+        body_io.write(f"Content-Type: {ctype}\r\n\r\n".encode())
+        with open(filepath, "rb") as f:
+            body_io.write(f.read())
+        body_io.write(b"\r\n")
+    body_io.write(f"--{boundary}--\r\n".encode())
+    return f"multipart/form-data; boundary={boundary}", body_io.getvalue()
+
+
+def check_body(fields, path):
+    """Тело MultipartBody разбирается стандартным парсером MIME и совпадает с файлом"""
+    body = MultipartBody(fields, {'photo': path})
+    raw = b''.join(bytes(chunk) for chunk in body)
+    assert len(raw) == body.content_length
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {body.content_type}\r\n\r\n".encode() + raw
+    )
+    parts = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+    with open(path, 'rb') as f:
+        same_file = parts['photo'].get_payload(decode=True) == f.read()
+    same_fields = all(parts[name].get_payload(decode=True).decode('utf-8') == str(value) for name, value in fields.items())
+    return same_file and same_fields
+
+
+def start_server(expected_size):
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            remaining = int(self.headers['Content-Length'])
+            total = 0
+            while remaining:
+                chunk = self.rfile.read(min(remaining, 64 * 1024))
+                remaining -= len(chunk)
+                total += len(chunk)
+            received.append(total)
+            ok = total > expected_size
+            response = json.dumps({'ok': ok, 'result': {'message_id': 1, 'photo': [{'file_id': 'x'}]}}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, received
+
+
+def measure(label, api, build, repeat):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        content_type, body = build()
+        # Без chat_id: лимит 1 сообщение/с на чат здесь не нужен
+        result = api.request('sendPhoto', body=body, content_type=content_type)
+        assert result.get('ok'), result
+        del body
+    elapsed = (time.perf_counter() - started) / repeat
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<12} {elapsed * 1000:8.1f} мс/загрузка   пик памяти {peak / 1024 / 1024:7.2f} МБ")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=float, default=16, help='размер изображения (MAX_FILE_SIZE веб-панели — 16 МБ)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+        f.write(os.urandom(size))
+        path = f.name
+    server, received = start_server(size)
+    api = TelegramAPI('benchmark', base_url=f"http://127.0.0.1:{server.server_address[1]}")
+    fields = {'chat_id': 1, 'caption': 'Фото товара', 'parse_mode': 'HTML'}
+    try:
+        print(f"файл {args.size_mb} МБ, {args.repeat} загрузок; тело корректно: {check_body(fields, path)}")
+        measure('в памяти', api, lambda: encode_in_memory(fields, {'photo': path}), args.repeat)
+        measure('потоком', api, lambda: (lambda body: (body.content_type, body))(MultipartBody(fields, {'photo': path})),
+                args.repeat)
+    finally:
+        server.shutdown()
+        os.unlink(path)
+    print(f"получено тел: {len(received)}")
+
+
+if __name__ == '__main__':
+    main()
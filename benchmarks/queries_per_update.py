@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Число SQL-запросов на один Telegram update: без контекста update и с db.update_context()
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admin import AdminHandler
+from database import DatabaseManager
+from handlers import MessageHandler
+
+TELEGRAM_ID = 555000111
+
+
+class FakeBot:
+    """Заглушка Bot API: ответы бота не отправляются"""
+
+    def send_message(self, *args, **kwargs):
+        return {'ok': True, 'result': {'message_id': 1}}
+
+    def send_photo(self, *args, **kwargs):
+        return {'ok': True, 'result': {'message_id': 1}}
+
+    def edit_message_reply_markup(self, *args, **kwargs):
+        return {'ok': True}
+
+
+def make_updates(db):
+    """Типичная сессия покупателя: меню, каталог, категория, подкатегория, корзина, заказы, оформление"""
+    category = db.execute_query('SELECT name, emoji FROM categories WHERE is_active = 1 ORDER BY id LIMIT 1')[0]
+    subcategory = db.execute_query('SELECT name, emoji FROM subcategories WHERE is_active = 1 ORDER BY id LIMIT 1')[0]
+    product_id = db.execute_query('SELECT id FROM products WHERE is_active = 1 ORDER BY id LIMIT 1')[0][0]
+    texts = [
+        '🏠 Главная',
+        '🛍 Каталог',
+        f'{category[1] or "📦"} {category[0]}',
+        f'{subcategory[1] or "🏷"} {subcategory[0]}',
+        '🛒 Корзина',
+        '📋 Мои заказы',
+        '👤 Профиль',
+        'ℹ️ Помощь',
+        '/admin',
+    ]
+    updates = [{'message': {'text': text, 'chat': {'id': TELEGRAM_ID}, 'from': {'id': TELEGRAM_ID}}} for text in texts]
+    updates.append({'callback_query': {
+        'id': '1', 'data': f'add_to_cart_{product_id}', 'from': {'id': TELEGRAM_ID},
+        'message': {'message_id': 1, 'chat': {'id': TELEGRAM_ID}}
+    }})
+    # С товаром в корзине: промокод и начало оформления заказа
+    updates += [{'message': {'text': text, 'chat': {'id': TELEGRAM_ID}, 'from': {'id': TELEGRAM_ID}}}
+                for text in ('/promo_WELCOME10', '👤 Профиль', '📦 Оформить заказ')]
+    return updates
+
+
+def dispatch(message_handler, admin_handler, update):
+    if 'message' in update:
+        message = update['message']
+        if message['text'].startswith('/admin'):
+            admin_handler.handle_admin_command(message)
+        else:
+            message_handler.handle_message(message)
+    else:
+        message_handler.handle_callback_query(update['callback_query'])
+
+
+def run(db, updates, with_context):
+    """Запросов на каждый update"""
+    bot = FakeBot()
+    message_handler = MessageHandler(bot, db)
+    admin_handler = AdminHandler(bot, db)
+    counts = []
+    for update in updates:
+        before = db.get_query_stats()['total_queries']
+        if with_context:
+            with db.update_context(TELEGRAM_ID):
+                dispatch(message_handler, admin_handler, update)
+        else:
+            dispatch(message_handler, admin_handler, update)
+        counts.append(db.get_query_stats()['total_queries'] - before)
+    return counts
+
+
+def main():
+    db_path = os.path.join(tempfile.mkdtemp(prefix='bench_updates_'), 'bench.db')
+    db = DatabaseManager(db_path)
+    db.add_user(TELEGRAM_ID, 'Bench User')
+    db.execute_query("UPDATE users SET is_admin = 1, phone = '+998900000000' WHERE telegram_id = ?", (TELEGRAM_ID,))
+    updates = make_updates(db)
+
+    before = run(db, updates, with_context=False)
+    db.execute_query('DELETE FROM cart')
+    after = run(db, updates, with_context=True)
+
+    print(f"{'update':40s} {'до':>5s} {'после':>6s}")
+    for update, b, a in zip(updates, before, after):
+        label = update['message']['text'] if 'message' in update else update['callback_query']['data']
+        print(f"{label:40s} {b:5d} {a:6d}")
+    print(f"{'в среднем':40s} {sum(before) / len(before):5.1f} {sum(after) / len(after):6.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк отчетов по периоду: DATE(created_at) BETWEEN без индексов против
+полуоткрытого диапазона created_at >= ? AND created_at < ? с индексами
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import get_sales_report, get_timeseries
+from database import DatabaseManager, day_range
+
+REPORT_INDEXES = [
+    'idx_orders_created_at',
+    'idx_orders_status_created_at',
+    'idx_order_items_order',
+    'idx_order_items_product',
+]
+
+# Запросы отчета в прежнем виде (обертка колонки в DATE())
+LEGACY_QUERIES = [
+    '''
+    SELECT COUNT(*), IFNULL(SUM(total_amount), 0), IFNULL(AVG(total_amount), 0), COUNT(DISTINCT user_id)
+    FROM orders
+    WHERE DATE(created_at) BETWEEN ? AND ?
+      AND status != 'cancelled'
+    ''',
+    '''
+    SELECT p.id, p.name, IFNULL(SUM(oi.quantity), 0) as qty,
+           IFNULL(SUM(oi.quantity * COALESCE(oi.price,0)), 0) as revenue
+    FROM order_items oi
+    JOIN products p ON p.id = oi.product_id
+    JOIN orders o ON o.id = oi.order_id
+    WHERE DATE(o.created_at) BETWEEN ? AND ?
+      AND o.status != 'cancelled'
+    GROUP BY p.id, p.name
+    ORDER BY revenue DESC
+    LIMIT 10
+    ''',
+    '''
+    SELECT u.id, u.name, IFNULL(SUM(o.total_amount), 0) as spent, COUNT(o.id) as orders
+    FROM users u
+    JOIN orders o ON o.user_id = u.id
+    WHERE DATE(o.created_at) BETWEEN ? AND ?
+      AND o.status != 'cancelled'
+    GROUP BY u.id, u.name
+    ORDER BY spent DESC
+    LIMIT 10
+    ''',
+    '''
+    SELECT strftime('%Y-%m-%d', created_at) as bucket, COUNT(*), IFNULL(SUM(total_amount), 0),
+           COUNT(DISTINCT user_id)
+    FROM orders
+    WHERE DATE(created_at) BETWEEN ? AND ?
+      AND status != 'cancelled'
+    GROUP BY bucket
+    ORDER BY bucket
+    ''',
+]
+
+
+def populate(db_path, orders, users=20000, days=365, seed=42):
+    """Синтетические заказы, равномерно распределенные по последним days дням"""
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous = OFF')
+    product_ids = [row[0] for row in conn.execute('SELECT id FROM products')]
+    conn.executemany(
+        'INSERT INTO users (telegram_id, name) VALUES (?, ?)',
+        ((10_000_000 + i, f'User {i}') for i in range(users))
+    )
+    user_ids = [row[0] for row in conn.execute('SELECT id FROM users')]
+    now = datetime.now()
+    statuses = ['delivered'] * 6 + ['confirmed', 'shipped', 'pending', 'cancelled']
+
+    # Как в живой базе: id растет вместе с created_at
+    offsets = sorted((rnd.randrange(days * 86400) for _ in range(orders)), reverse=True)
+
+    batch = 50000
+    order_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM orders').fetchone()[0]
+    for offset in range(0, orders, batch):
+        order_rows = []
+        item_rows = []
+        for seconds_ago in offsets[offset:offset + batch]:
+            order_id += 1
+            created = now - timedelta(seconds=seconds_ago)
+            amount = round(rnd.uniform(5, 500), 2)
+            order_rows.append((order_id, rnd.choice(user_ids), amount, rnd.choice(statuses),
+                               created.strftime('%Y-%m-%d %H:%M:%S')))
+            item_rows.append((order_id, rnd.choice(product_ids), rnd.randint(1, 3), amount))
+        conn.executemany(
+            'INSERT INTO orders (id, user_id, total_amount, status, created_at) VALUES (?, ?, ?, ?, ?)',
+            order_rows
+        )
+        conn.executemany(
+            'INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)',
+            item_rows
+        )
+        conn.commit()
+    conn.close()
+
+
+def timed(fn, repeats):
+    """Медиана времени выполнения fn, мс"""
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=1_000_000, help='количество синтетических заказов')
+    parser.add_argument('--days', type=int, default=30, help='длина отчетного периода, дней')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_reports_')
+    db_path = os.path.join(workdir, 'bench.db')
+    db = DatabaseManager(db_path)
+    started = time.perf_counter()
+    populate(db_path, args.orders)
+    print(f"База: {db_path}, заказов: {args.orders}, наполнение {time.perf_counter() - started:.1f}s")
+
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.now() - timedelta(days=args.days - 1)).strftime('%Y-%m-%d')
+
+    # До: индексов под отчеты нет, колонка обернута в DATE()
+    for name in REPORT_INDEXES:
+        db.execute_query(f'DROP INDEX IF EXISTS {name}')
+    db.execute_query('ANALYZE')
+
+    def legacy_report():
+        for sql in LEGACY_QUERIES:
+            db.execute_query(sql, (start_date, end_date))
+
+    before = timed(legacy_report, args.repeats)
+
+    # После: полуоткрытый диапазон и индексы
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+        db.create_indexes(cursor)
+        db._create_report_indexes(cursor)
+
+    def sargable_report():
+        get_sales_report(db, start_date, end_date)
+        get_timeseries(db, start_date, end_date)
+
+    after = timed(sargable_report, args.repeats)
+
+    conn = db.pool.acquire()
+    try:
+        plan = [row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM orders WHERE created_at >= ? AND created_at < ? "
+            "AND status != 'cancelled'", day_range(start_date, end_date)
+        )]
+    finally:
+        db.pool.release(conn)
+
+    print(f"Период: {start_date} .. {end_date} ({args.days} дн.), медиана из {args.repeats}")
+    print(f"DATE() BETWEEN, без индексов:   {before:9.1f} мс")
+    print(f"полуоткрытый диапазон + индексы: {after:9.1f} мс")
+    print(f"Ускорение: x{before / after:.1f}")
+    print(f"План: {'; '.join(plan)}")
+
+
+if __name__ == '__main__':
+    main()
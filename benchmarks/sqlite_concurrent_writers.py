@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк конкурентной записи в SQLite: бот + два воркера веб-панели
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DATABASE_CONFIG
+from database import DatabaseManager
+
+# Профиль «как было»: журнал отката и полная синхронизация
+LEGACY_PRAGMAS = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL'
+}
+
+
+def writer(db_path, pragmas, role, writes, results):
+    """Процесс-писатель: имитирует бота или воркер gunicorn"""
+    db = DatabaseManager(db_path, pragmas=pragmas)
+    user_id = db.add_user(100000 + os.getpid(), role)
+    ok = 0
+    failed = 0
+    started = time.perf_counter()
+    for i in range(writes):
+        if role == 'bot':
+            result = db.execute_query(
+                'INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)',
+                (user_id, 1 + i % 5, 1)
+            )
+        else:
+            result = db.execute_query(
+                'UPDATE products SET views = views + 1 WHERE id = ?',
+                (1 + i % 5,)
+            )
+        if result is None:
+            failed += 1
+        else:
+            ok += 1
+    results.put((role, ok, failed, time.perf_counter() - started))
+
+
+def run_profile(name, pragmas, writes):
+    """Запуск трех конкурентных писателей на свежей базе"""
+    workdir = tempfile.mkdtemp(prefix='bench_sqlite_')
+    db_path = os.path.join(workdir, 'bench.db')
+    DatabaseManager(db_path, pragmas=pragmas)
+
+    results = multiprocessing.Queue()
+    roles = ['bot', 'web-1', 'web-2']
+    started = time.perf_counter()
+    procs = [
+        multiprocessing.Process(target=writer, args=(db_path, pragmas, role, writes, results))
+        for role in roles
+    ]
+    for proc in procs:
+        proc.start()
+    rows = [results.get() for _ in roles]
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - started
+
+    total_ok = sum(row[1] for row in rows)
+    total_failed = sum(row[2] for row in rows)
+    print(f"{name:8s} {total_ok:7d} ok {total_failed:5d} failed "
+          f"{elapsed:7.2f}s {total_ok / elapsed:9.1f} writes/s")
+    return total_ok / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writes', type=int, default=2000, help='записей на процесс')
+    args = parser.parse_args()
+
+    legacy = run_profile('legacy', LEGACY_PRAGMAS, args.writes)
+    tuned = run_profile('tuned', DATABASE_CONFIG['pragmas'], args.writes)
+    print(f"Ускорение записи: x{tuned / legacy:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Задержка sendMessage: urllib (новое соединение на каждый запрос) против TelegramAPI (пул keep-alive)
+
+Запросы идут в локальный поддельный Bot API. Параметр --handshake-ms добавляет задержку
+при установке каждого нового соединения — грубая модель TCP+TLS рукопожатия до api.telegram.org.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram_api import TelegramAPI
+
+TOKEN = '123:bench'
+
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """Отвечает на любой метод как sendMessage; поддерживает keep-alive и gzip"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    handshake_delay = 0.0
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        FakeBotAPI.connections += 1
+        if self.handshake_delay:
+            time.sleep(self.handshake_delay)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        fields = urllib.parse.parse_qs(self.rfile.read(length).decode())
+        body = json.dumps({'ok': True, 'result': {
+            'message_id': 1,
+            'chat': {'id': int(fields.get('chat_id', ['0'])[0])},
+            'text': fields.get('text', [''])[0] * 4,
+        }}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def send_urllib(base_url, chat_id, text):
+    data = urllib.parse.urlencode({'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}).encode()
+    req = urllib.request.Request(f"{base_url}/bot{TOKEN}/sendMessage", data=data, method='POST')
+    with urllib.request.urlopen(req) as response:
+        return json.loads(response.read().decode())
+
+
+def measure(send, count):
+    timings = []
+    for i in range(count):
+        started = time.perf_counter()
+        result = send(1000 + i, 'Тестовое сообщение ' * 10)
+        timings.append((time.perf_counter() - started) * 1000)
+        assert result.get('ok'), result
+    timings.sort()
+    return sum(timings) / len(timings), timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--handshake-ms', type=float, nargs='*', default=[0, 20])
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"{'рукопожатие':>12s} {'клиент':>12s} {'среднее, мс':>12s} {'p50, мс':>8s} {'p95, мс':>8s} {'соединений':>11s}")
+    for handshake_ms in args.handshake_ms:
+        FakeBotAPI.handshake_delay = handshake_ms / 1000
+        for name, send in (
+            ('urllib', lambda chat_id, text: send_urllib(base_url, chat_id, text)),
+            ('TelegramAPI', TelegramAPI(TOKEN, base_url=base_url).send_message),
+        ):
+            FakeBotAPI.connections = 0
+            mean, p50, p95 = measure(send, args.messages)
+            print(f"{handshake_ms:10.0f}мс {name:>12s} {mean:12.2f} {p50:8.2f} {p95:8.2f} {FakeBotAPI.connections:11d}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
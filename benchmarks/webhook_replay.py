@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Повтор сохраненных update через вебхук: время ответа Telegram и время до обработки
+
+По умолчанию поднимает локальную замену HTTP-сервера бота (WebhookReceiver + UpdateDispatcher
+с обработчиком, имитирующим работу). С --url отправляет update в запущенный бот
+(BOT_UPDATES_MODE=webhook), секрет берется из --secret.
+
+Файл update: JSON-массив или JSONL с объектами update из getUpdates/вебхука.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from update_dispatcher import UpdateDispatcher, chat_key
+from webhook_receiver import SECRET_HEADER, WebhookReceiver
+
+WEBHOOK_PATH = '/telegram/webhook'
+
+
+def load_updates(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read().strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def synthetic_updates(count, chats):
+    updates = []
+    for i in range(count):
+        chat_id = 100000 + i % chats
+        if i % 3:
+            updates.append({'update_id': i + 1, 'message': {
+                'message_id': i, 'text': '🛍 Каталог', 'chat': {'id': chat_id}, 'from': {'id': chat_id}
+            }})
+        else:
+            updates.append({'update_id': i + 1, 'callback_query': {
+                'id': str(i), 'data': 'add_to_cart_1', 'from': {'id': chat_id},
+                'message': {'message_id': i, 'chat': {'id': chat_id}}
+            }})
+    return updates
+
+
+def start_stand_in(secret, work_ms, workers):
+    """Локальная замена бота: тот же WebhookReceiver и UpdateDispatcher"""
+    processed = {}
+    lock = threading.Lock()
+
+    def handle_update(update):
+        time.sleep(work_ms / 1000)
+        with lock:
+            processed.setdefault(chat_key(update), []).append((update['update_id'], time.perf_counter()))
+
+    dispatcher = UpdateDispatcher(handle_update, workers=workers, queue_size=100)
+    dispatcher.start()
+    receiver = WebhookReceiver(dispatcher, secret)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            status, payload = receiver.handle(self.headers, body) if self.path == WEBHOOK_PATH else (404, {})
+            response = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, dispatcher, receiver, processed
+
+
+def post(url, secret, update):
+    req = urllib.request.Request(url, data=json.dumps(update).encode(), method='POST',
+                                 headers={'Content-Type': 'application/json', SECRET_HEADER: secret})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, started, time.perf_counter()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('updates', nargs='?', help='файл с update (JSON или JSONL)')
+    parser.add_argument('--url', help='вебхук запущенного бота, например http://127.0.0.1:8080' + WEBHOOK_PATH)
+    parser.add_argument('--secret', default='replay-secret')
+    parser.add_argument('--count', type=int, default=300, help='синтетических update, если файл не задан')
+    parser.add_argument('--chats', type=int, default=30)
+    parser.add_argument('--concurrency', type=int, default=20, help='параллельных соединений, как max_connections у Telegram')
+    parser.add_argument('--work-ms', type=float, default=50, help='имитация обработки одного update в локальной замене')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.count, args.chats)
+    stand_in = None
+    url = args.url
+    if not url:
+        stand_in = start_stand_in(args.secret, args.work_ms, args.workers)
+        url = f"http://127.0.0.1:{stand_in[0].server_address[1]}{WEBHOOK_PATH}"
+
+    # Update одного чата отправляются по очереди, как это делает Telegram
+    by_chat = {}
+    for update in updates:
+        by_chat.setdefault(chat_key(update), []).append(update)
+    sent_at = {}
+    acks = []
+    statuses = {}
+
+    def send_chat(chat_updates):
+        for update in chat_updates:
+            status, started, finished = post(url, args.secret, update)
+            sent_at[update['update_id']] = started
+            acks.append((finished - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(send_chat, by_chat.values()))
+    sent_seconds = time.perf_counter() - started
+
+    print(f"update: {len(updates)}, чатов: {len(by_chat)}, отправлено за {sent_seconds:.2f}с, ответы: {statuses}")
+    print(f"ответ вебхука, мс: p50={percentile(acks, 0.5):.2f} p95={percentile(acks, 0.95):.2f} p99={percentile(acks, 0.99):.2f}")
+
+    if stand_in:
+        server, dispatcher, receiver, processed = stand_in
+        # Повтор доставки и чужой секрет
+        duplicate = post(url, args.secret, updates[0])[0]
+        forged = post(url, 'wrong', updates[0])[0]
+        dispatcher.shutdown(timeout=60)
+        server.shutdown()
+        done = [finished - sent_at[update_id] for items in processed.values() for update_id, finished in items]
+        ordered = all([u for u, _ in items] == sorted(u for u, _ in items) for items in processed.values())
+        print(f"до обработки, мс: p50={percentile(done, 0.5) * 1000:.1f} p95={percentile(done, 0.95) * 1000:.1f}")
+        print(f"обработано: {len(done)}, порядок в чатах сохранен: {ordered}, "
+              f"повтор -> {duplicate}, чужой секрет -> {forged}")
+        print(f"получатель: {receiver.get_stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+Рассылки как задания в SQLite
+
+Веб-панель и планировщик автопостов создают задание: список получателей пишется
+в broadcast_recipients одним INSERT ... SELECT, без выборки пользователей в память.
+Отправляет BroadcastEngine в процессе бота: пачками берет еще не обработанных
+получателей, шлет их пулом потоков с приоритетом BULK и сохраняет статус каждого.
+После перезапуска бота задание продолжается с того же места, а пауза, продолжение
+и отмена — это просто смена status в broadcast_jobs.
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_governor import BULK, outbound_priority
+
+try:
+    from config import BROADCAST_CONFIG
+except Exception:
+    BROADCAST_CONFIG = {}
+
+STATUS_LABELS = {
+    'pending': 'В очереди',
+    'running': 'Отправляется',
+    'paused': 'Пауза',
+    'cancelled': 'Отменена',
+    'completed': 'Завершена',
+}
+
+# Получатели по аудитории (telegram_id), те же выборки, что в автопостах
+AUDIENCES = {
+    'all': 'SELECT telegram_id FROM users WHERE is_admin = 0',
+    'active': '''
+        SELECT DISTINCT u.telegram_id FROM users u
+        JOIN orders o ON u.id = o.user_id
+        WHERE u.is_admin = 0 AND o.created_at >= datetime('now', '-30 days')
+    ''',
+    'inactive': '''
+        SELECT u.telegram_id FROM users u
+        LEFT JOIN orders o ON u.id = o.user_id AND o.created_at >= datetime('now', '-30 days')
+        WHERE u.is_admin = 0 AND o.id IS NULL
+    ''',
+    'vip': '''
+        SELECT u.telegram_id FROM users u
+        JOIN orders o ON u.id = o.user_id
+        WHERE u.is_admin = 0
+        GROUP BY u.id
+        HAVING SUM(o.total_amount) >= 500
+    ''',
+    'new': "SELECT telegram_id FROM users WHERE is_admin = 0 AND created_at >= datetime('now', '-7 days')",
+}
+
+# Допустимые переходы: действие -> (из каких статусов, в какой)
+TRANSITIONS = {
+    'pause': (('pending', 'running'), 'paused'),
+    'resume': (('paused',), 'pending'),
+    'cancel': (('pending', 'running', 'paused'), 'cancelled'),
+}
+
+
+def create_broadcast_job(db, message_text, target_audience, image_url=None, reply_markup=None,
+                         title=None, post_id=None, time_period=None):
+    """Создать задание рассылки; возвращает (job_id, число получателей) или (None, 0)"""
+    audience_query = AUDIENCES.get(target_audience)
+    if not audience_query:
+        return None, 0
+    with db.transaction():
+        job_id = db.execute_query('''
+            INSERT INTO broadcast_jobs (title, message_text, image_url, reply_markup, target_audience, post_id, time_period)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (title, message_text, image_url, json.dumps(reply_markup) if reply_markup else None,
+              target_audience, post_id, time_period))
+        db.execute_query(f'''
+            INSERT OR IGNORE INTO broadcast_recipients (job_id, telegram_id)
+            SELECT ?, telegram_id FROM ({audience_query}) WHERE telegram_id IS NOT NULL
+        ''', (job_id,))
+        total = db.execute_query(
+            'SELECT COUNT(*) FROM broadcast_recipients WHERE job_id = ?', (job_id,)
+        )[0][0]
+        db.execute_query('UPDATE broadcast_jobs SET total_count = ? WHERE id = ?', (total, job_id))
+    logging.info(f"Рассылка {job_id} ({target_audience}): получателей {total}")
+    return job_id, total
+
+
+def change_broadcast_status(db, job_id, action):
+    """Пауза/продолжение/отмена задания; True, если статус изменен"""
+    if action not in TRANSITIONS:
+        return False
+    allowed, status = TRANSITIONS[action]
+    placeholders = ','.join('?' * len(allowed))
+    finished = ", finished_at = CURRENT_TIMESTAMP" if status == 'cancelled' else ''
+    changed = db.execute_query(
+        f'UPDATE broadcast_jobs SET status = ?{finished} WHERE id = ? AND status IN ({placeholders})',
+        (status, job_id, *allowed)
+    )
+    return bool(changed)
+
+
+def get_broadcast_jobs(db, limit=50):
+    """Последние задания с прогрессом"""
+    return db.execute_query('''
+        SELECT id, title, target_audience, status, total_count, sent_count, error_count,
+               last_error, created_at, started_at, finished_at
+        FROM broadcast_jobs
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (limit,)) or []
+
+
+class BroadcastEngine:
+    """Отправка заданий рассылки в процессе бота"""
+
+    def __init__(self, db, bot, workers=None, batch_size=None, poll_interval=None):
+        self.db = db
+        self.bot = bot
+        self.workers = workers or BROADCAST_CONFIG.get('workers', 8)
+        self.batch_size = batch_size or BROADCAST_CONFIG.get('batch_size', 100)
+        self.poll_interval = poll_interval or BROADCAST_CONFIG.get('poll_interval', 30)
+        self.running = False
+        self.current_job = None
+        self._wake = threading.Event()
+        # Пауза/отмена текущего задания: недоставленные получатели остаются pending
+        self._halt = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def start(self):
+        self.running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='broadcast')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logging.info(f"Рассылки: {self.workers} потоков, пачка {self.batch_size}")
+
+    def stop(self, timeout=10):
+        """Остановка: текущая пачка дописывается, остальное продолжится после перезапуска"""
+        self.running = False
+        self._halt.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+    def wake(self):
+        self._wake.set()
+
+    def on_jobs_changed(self, entities, events):
+        """Подписчик канала изменений: новое задание или смена статуса"""
+        for _event_id, _entity, job_id, status in events:
+            if job_id == self.current_job and status in ('paused', 'cancelled'):
+                self._halt.set()
+        self._wake.set()
+
+    def _run(self):
+        while self.running:
+            try:
+                job = self._next_job()
+                if job:
+                    self.run_job(job)
+                    continue
+            except Exception as e:
+                logging.error(f"Ошибка обработки рассылок: {e}", exc_info=True)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _next_job(self):
+        rows = self.db.execute_query('''
+            SELECT id, message_text, image_url, reply_markup, post_id, time_period
+            FROM broadcast_jobs
+            WHERE status IN ('running', 'pending')
+            ORDER BY id
+            LIMIT 1
+        ''')
+        return rows[0] if rows else None
+
+    def _job_status(self, job_id):
+        rows = self.db.execute_query('SELECT status FROM broadcast_jobs WHERE id = ?', (job_id,))
+        return rows[0][0] if rows else None
+
+    def run_job(self, job):
+        """Отправка задания пачками до завершения, паузы, отмены или остановки бота"""
+        job_id, message_text, image_url, reply_markup, post_id, time_period = job
+        reply_markup = json.loads(reply_markup) if reply_markup else None
+        self.db.execute_query('''
+            UPDATE broadcast_jobs SET status = 'running', started_at = IFNULL(started_at, CURRENT_TIMESTAMP)
+            WHERE id = ? AND status IN ('pending', 'running')
+        ''', (job_id,))
+        self.current_job = job_id
+        self._halt.clear()
+        logging.info(f"📢 Рассылка {job_id}: отправка")
+        try:
+            while self.running and self._job_status(job_id) == 'running':
+                # Индекс (job_id, status, telegram_id) сразу ведет к необработанным получателям
+                batch = self.db.execute_query('''
+                    SELECT telegram_id FROM broadcast_recipients
+                    WHERE job_id = ? AND status = 'pending'
+                    ORDER BY telegram_id
+                    LIMIT ?
+                ''', (job_id, self.batch_size))
+                if batch is None:
+                    return
+                if not batch:
+                    self._finish(job_id, post_id, time_period)
+                    return
+                results = list(self._executor.map(
+                    lambda row: self._send(row[0], message_text, image_url, reply_markup), batch
+                ))
+                self._save_results(job_id, batch, results)
+        finally:
+            self.current_job = None
+
+    @outbound_priority(BULK)
+    def _send(self, telegram_id, message_text, image_url, reply_markup):
+        """Отправка одному получателю: ('sent'|'failed', ошибка) или None, если задание остановлено"""
+        if self._halt.is_set():
+            return None
+        try:
+            if image_url and len(message_text) <= 1024:
+                result = self.bot.send_photo(telegram_id, image_url, message_text, reply_markup)
+            elif image_url:
+                self.bot.send_photo(telegram_id, image_url, '', None)
+                result = self.bot.send_message(telegram_id, message_text, reply_markup)
+            else:
+                result = self.bot.send_message(telegram_id, message_text, reply_markup)
+        except Exception as e:
+            return 'failed', str(e)
+        if result and result.get('ok'):
+            return 'sent', None
+        return 'failed', str((result or {}).get('description') or (result or {}).get('error') or 'нет ответа')[:200]
+
+    def _save_results(self, job_id, batch, results):
+        done = []
+        for row, result in zip(batch, results):
+            if result:
+                status, error = result
+                done.append((status, error, job_id, row[0]))
+        if not done:
+            return
+        sent = sum(1 for item in done if item[0] == 'sent')
+        failed = len(done) - sent
+        last_error = next((item[1] for item in reversed(done) if item[1]), None)
+        with self.db.transaction():
+            self.db.execute_many('''
+                UPDATE broadcast_recipients SET status = ?, error = ?, sent_at = CURRENT_TIMESTAMP
+                WHERE job_id = ? AND telegram_id = ?
+            ''', done)
+            self.db.execute_query('''
+                UPDATE broadcast_jobs
+                SET sent_count = sent_count + ?, error_count = error_count + ?, last_error = IFNULL(?, last_error)
+                WHERE id = ?
+            ''', (sent, failed, last_error, job_id))
+
+    def _finish(self, job_id, post_id, time_period):
+        self.db.execute_query('''
+            UPDATE broadcast_jobs SET status = 'completed', finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'running'
+        ''', (job_id,))
+        counts = self.db.execute_query(
+            'SELECT sent_count, error_count FROM broadcast_jobs WHERE id = ?', (job_id,)
+        )
+        sent, failed = counts[0] if counts else (0, 0)
+        if post_id:
+            self.db.execute_query('''
+                INSERT INTO post_statistics (post_id, time_period, sent_count, error_count, sent_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (post_id, time_period, sent, failed, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())))
+        logging.info(f"📊 Рассылка {job_id} завершена: отправлено {sent}, ошибок {failed}")
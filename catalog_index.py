@@ -0,0 +1,123 @@
+"""
+Индекс каталога в памяти: категории, подкатегории, подписи кнопок и количество товаров
+"""
+
+import logging
+import threading
+
+
+def catalog_label(emoji, name):
+    """Подпись кнопки категории/подкатегории (как в keyboards.py)"""
+    return f"{emoji} {name}"
+
+
+class CatalogIndex:
+    """Снимок каталога для маршрутизации по подписям кнопок без обращений к БД.
+
+    Снимок собирается целиком и подменяется одной ссылкой, поэтому читатели
+    всегда видят согласованные данные, а refresh() не блокирует обработку сообщений.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._refresh_lock = threading.Lock()
+        self._data = self._empty()
+        self.refresh()
+
+    @staticmethod
+    def _empty():
+        return {
+            'categories': [],
+            'category_by_id': {},
+            'category_by_name': {},
+            'subcategory_by_id': {},
+            'subcategory_by_name': {},
+            'subcategories': {},
+            'category_products': {},
+            'version': 0
+        }
+
+    def refresh(self):
+        """Перечитать каталог и атомарно заменить снимок"""
+        with self._refresh_lock:
+            categories = self.db.execute_query(
+                'SELECT * FROM categories WHERE is_active = 1 ORDER BY name'
+            )
+            subcategories = self.db.execute_query('''
+                SELECT s.id, s.name, s.emoji, s.category_id, COUNT(p.id) as products_count
+                FROM subcategories s
+                LEFT JOIN products p ON s.id = p.subcategory_id AND p.is_active = 1
+                WHERE s.is_active = 1
+                GROUP BY s.id, s.name, s.emoji, s.category_id
+                ORDER BY s.name
+            ''')
+            category_products = self.db.execute_query('''
+                SELECT category_id, COUNT(*) FROM products
+                WHERE is_active = 1
+                GROUP BY category_id
+            ''')
+            if categories is None or subcategories is None or category_products is None:
+                logging.info("Индекс каталога не обновлен: ошибка чтения из БД")
+                return False
+
+            data = self._empty()
+            data['categories'] = categories
+            for row in categories:
+                data['category_by_id'][row[0]] = row
+                data['category_by_name'].setdefault(row[1], row[0])
+                data['category_by_name'].setdefault(catalog_label(row[3], row[1]), row[0])
+            for sub_id, name, emoji, category_id, products_count in subcategories:
+                data['subcategory_by_id'][sub_id] = (sub_id, name, emoji, category_id, products_count)
+                data['subcategory_by_name'].setdefault(name, sub_id)
+                data['subcategory_by_name'].setdefault(catalog_label(emoji, name), sub_id)
+                if products_count > 0:
+                    # Формат строк как у DatabaseManager.get_products_by_category
+                    data['subcategories'].setdefault(category_id, []).append(
+                        (sub_id, name, emoji, products_count)
+                    )
+            data['category_products'] = dict(category_products)
+            data['version'] = self._data['version'] + 1
+
+            self._data = data
+            return True
+
+    @property
+    def version(self):
+        return self._data['version']
+
+    def categories(self):
+        """Активные категории (строки таблицы categories, по имени)"""
+        return self._data['categories']
+
+    def category_id(self, label):
+        """id категории по подписи кнопки или названию"""
+        data = self._data
+        if label in data['category_by_name']:
+            return data['category_by_name'][label]
+        return data['category_by_name'].get(label.split(' ', 1)[-1].strip())
+
+    def category_name(self, category_id):
+        row = self._data['category_by_id'].get(category_id)
+        return row[1] if row else None
+
+    def subcategory_id(self, label):
+        """id подкатегории по подписи кнопки или названию"""
+        data = self._data
+        if label in data['subcategory_by_name']:
+            return data['subcategory_by_name'][label]
+        return data['subcategory_by_name'].get(label.split(' ', 1)[-1].strip())
+
+    def subcategory_name(self, subcategory_id):
+        row = self._data['subcategory_by_id'].get(subcategory_id)
+        return row[1] if row else None
+
+    def subcategories(self, category_id):
+        """Подкатегории категории, в которых есть активные товары"""
+        return self._data['subcategories'].get(category_id, [])
+
+    def product_count(self, category_id=None, subcategory_id=None):
+        """Количество активных товаров в категории или подкатегории"""
+        if subcategory_id is not None:
+            row = self._data['subcategory_by_id'].get(subcategory_id)
+            return row[4] if row else 0
+        return self._data['category_products'].get(category_id, 0)
@@ -0,0 +1,178 @@
+"""
+Канал изменений данных между веб-панелью и ботом
+
+Изменения каталога и автопостов пишутся триггерами SQLite в таблицу change_events
+(миграция 7), поэтому не теряются, даже если бот был недоступен. Бот следит за
+PRAGMA data_version своего соединения и читает только новые события; веб-панель
+дополнительно будит его датаграммой в Unix-сокет, чтобы изменения применялись сразу.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+try:
+    from config import DATABASE_CONFIG
+except Exception:
+    DATABASE_CONFIG = {}
+
+# Сущность без записей в change_events: полная перезагрузка по кнопке в веб-панели
+ALL_ENTITIES = 'all'
+
+
+def _socket_path(socket_path=None):
+    return socket_path or DATABASE_CONFIG.get('change_socket')
+
+
+def notify_change(entities=None, socket_path=None):
+    """Разбудить бота: entities — список изменившихся сущностей (для 'all' обязателен)"""
+    path = _socket_path(socket_path)
+    if not path or not hasattr(socket, 'AF_UNIX'):
+        return False
+    payload = json.dumps({'entities': list(entities or [])}).encode()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(payload, path)
+        return True
+    except OSError:
+        # Бот не запущен: изменения уже лежат в change_events и применятся при старте
+        return False
+    finally:
+        sock.close()
+
+
+class ChangeFeed:
+    """Получатель изменений на стороне бота"""
+
+    def __init__(self, db, socket_path=None, poll_interval=None, retention_hours=24):
+        self.db = db
+        self.socket_path = _socket_path(socket_path)
+        self.poll_interval = poll_interval or DATABASE_CONFIG.get('change_poll_interval', 2)
+        self.retention_hours = retention_hours
+        self.running = False
+        self.last_event_id = 0
+        self.stats = {'wakeups': 0, 'events': 0, 'dispatches': 0}
+        self._subscribers = []
+        self._conn = None
+        self._sock = None
+        self._data_version = None
+        self._last_prune = 0
+
+    def subscribe(self, entities, callback):
+        """callback(entities: set, events: list) для изменений указанных сущностей"""
+        self._subscribers.append((set(entities), callback))
+
+    def start(self):
+        """Запуск фонового потока получения изменений"""
+        self._conn = sqlite3.connect(self.db.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA busy_timeout = 5000')
+        # Изменения до старта уже учтены при инициализации бота
+        row = self._conn.execute('SELECT IFNULL(MAX(id), 0) FROM change_events').fetchone()
+        self.last_event_id = row[0]
+        self._data_version = self._read_data_version()
+        self._sock = self._open_socket()
+        self.running = True
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        logging.info(f"Канал изменений данных запущен (сокет: {self.socket_path if self._sock else 'нет'}, "
+                     f"data_version каждые {self.poll_interval}с)")
+
+    def stop(self):
+        self.running = False
+        if self._sock is not None:
+            try:
+                self._sock.close()
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    def _open_socket(self):
+        if not self.socket_path or not hasattr(socket, 'AF_UNIX'):
+            return None
+        try:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self.socket_path)
+            sock.settimeout(self.poll_interval)
+            return sock
+        except OSError as e:
+            logging.info(f"Unix-сокет изменений недоступен, только data_version: {e}")
+            return None
+
+    def _read_data_version(self):
+        return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _wait(self):
+        """Ждем датаграмму от веб-панели или истечения poll_interval; возвращает явно переданные сущности"""
+        if self._sock is None:
+            time.sleep(self.poll_interval)
+            return set()
+        try:
+            payload = self._sock.recv(65536)
+        except socket.timeout:
+            return set()
+        except OSError:
+            time.sleep(self.poll_interval)
+            return set()
+        self.stats['wakeups'] += 1
+        try:
+            return set(json.loads(payload.decode()).get('entities') or [])
+        except (ValueError, AttributeError):
+            return set()
+
+    def _run(self):
+        while self.running:
+            try:
+                requested = self._wait()
+                self.poll(requested)
+            except Exception as e:
+                logging.info(f"Ошибка канала изменений: {e}")
+                time.sleep(self.poll_interval)
+
+    def poll(self, requested=()):
+        """Проверка data_version и разбор новых событий"""
+        entities = set(requested) & {ALL_ENTITIES}
+        events = []
+        version = self._read_data_version()
+        if version != self._data_version:
+            self._data_version = version
+            events = self._conn.execute('''
+                SELECT id, entity, entity_id, action FROM change_events
+                WHERE id > ? ORDER BY id
+            ''', (self.last_event_id,)).fetchall()
+            if events:
+                self.last_event_id = events[-1][0]
+                self.stats['events'] += len(events)
+                entities.update(event[1] for event in events)
+        if entities:
+            self._dispatch(entities, events)
+        self._prune()
+
+    def _dispatch(self, entities, events):
+        for wanted, callback in self._subscribers:
+            # 'all' получают только подписчики на полную перезагрузку
+            matched = entities & wanted
+            if not matched:
+                continue
+            self.stats['dispatches'] += 1
+            try:
+                callback(matched, [event for event in events if event[1] in matched or ALL_ENTITIES in matched])
+            except Exception as e:
+                logging.info(f"Ошибка обработчика изменений {sorted(matched)}: {e}")
+
+    def _prune(self):
+        """Удаление старых событий раз в час"""
+        now = time.time()
+        if now - self._last_prune < 3600:
+            return
+        self._last_prune = now
+        self._conn.execute(
+            "DELETE FROM change_events WHERE created_at < datetime('now', ?)",
+            (f'-{int(self.retention_hours)} hours',)
+        )
+        self._conn.commit()
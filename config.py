@@ -16,7 +16,22 @@ DEBUG = ENVIRONMENT == 'development'
 DATABASE_CONFIG = {
     'path': os.getenv('DATABASE_PATH', 'shop_bot.db'),
     'backup_interval': 3600,  # Резервное копирование каждый час
-    'max_connections': 10
+    'max_connections': 10,
+    # Порог журнала медленных запросов (мс), для них сохраняется EXPLAIN QUERY PLAN
+    'slow_query_ms': int(os.getenv('SQLITE_SLOW_QUERY_MS', '100')),
+    # Канал изменений веб-панель -> бот: Unix-сокет для пробуждения и интервал проверки PRAGMA data_version (с)
+    'change_socket': os.getenv('CHANGE_FEED_SOCKET', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_changes.sock')),
+    'change_poll_interval': float(os.getenv('CHANGE_FEED_POLL_INTERVAL', '2')),
+    # Профиль производительности SQLite, применяется к каждому соединению
+    'pragmas': {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000')),  # мс
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024))),
+        'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', '-16000')),  # ~16MB
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': int(os.getenv('SQLITE_WAL_AUTOCHECKPOINT', '1000'))  # страниц
+    }
 }
 
 # Настройки безопасности
@@ -50,7 +65,12 @@ MONITORING_CONFIG = {
     'health_check_interval': 60,
     'metrics_enabled': True,
     'sentry_dsn': os.getenv('SENTRY_DSN'),
-    'prometheus_port': int(os.getenv('PROMETHEUS_PORT', '8000'))
+    'prometheus_port': int(os.getenv('PROMETHEUS_PORT', '8000')),
+    # HTTP-сервер бота: /health и прием вебхука Telegram
+    'http_host': os.getenv('HEALTH_HOST', '0.0.0.0'),
+    'http_port': int(os.getenv('HEALTH_PORT', '8080')),
+    # Токен для /query_stats (текст SQL и планы для веб-панели); без него доступны только счетчики /health
+    'stats_token': os.getenv('HEALTH_STATS_TOKEN')
 }
 
 # Настройки бота
@@ -67,7 +87,88 @@ BOT_CONFIG = {
     'request_timeout': 30,
     'admin_telegram_id': os.getenv('ADMIN_TELEGRAM_ID', '5720497431'),
     'admin_name': 'Safar',
-    'post_channel_id': '-1002566537425'
+    'post_channel_id': '-1002566537425',
+    # Чат для предзагрузки изображений товаров (получение file_id); сообщение сразу удаляется
+    'file_cache_chat_id': os.getenv('FILE_CACHE_CHAT_ID') or os.getenv('ADMIN_TELEGRAM_ID', '5720497431')
+}
+
+# Клиент Telegram Bot API (telegram_api.py): пул keep-alive соединений и повторы
+TELEGRAM_API_CONFIG = {
+    'base_url': os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org'),
+    'timeout': int(os.getenv('TELEGRAM_API_TIMEOUT', '10')),  # с, для getUpdates добавляется к long-poll
+    'max_connections': int(os.getenv('TELEGRAM_API_MAX_CONNECTIONS', '8')),
+    'retries': 3,
+    'max_retry_after': 30,  # с; при большем retry_after ответ 429 возвращается вызывающему
+    # Лимиты исходящих сообщений (rate_governor.py)
+    'rate_limits': {
+        'global_per_second': float(os.getenv('TELEGRAM_GLOBAL_RATE', '30')),
+        'private_chat_per_second': 1,
+        'group_chat_per_minute': 20,
+        'min_global_per_second': 5  # нижняя граница снижения скорости после 429
+    }
+}
+
+# Получение и обработка update (update_dispatcher.py)
+UPDATES_CONFIG = {
+    # polling — getUpdates; webhook — Telegram шлет update на BOT_CONFIG['webhook_url'],
+    # который проксируется на webhook_path HTTP-сервера мониторинга
+    'mode': os.getenv('BOT_UPDATES_MODE', 'polling'),
+    'webhook_path': os.getenv('WEBHOOK_PATH', '/telegram/webhook'),
+    'webhook_max_connections': int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40')),
+    'workers': int(os.getenv('BOT_WORKERS', '8')),  # потоков; update одного чата всегда в одном потоке
+    'queue_size': int(os.getenv('BOT_WORKER_QUEUE_SIZE', '100')),  # update на поток, дальше getUpdates ждет
+    'drain_timeout': int(os.getenv('BOT_DRAIN_TIMEOUT', '30')),  # с на дообработку очередей при остановке
+    'poll_timeout': int(os.getenv('BOT_POLL_TIMEOUT', '50')),  # с, long polling getUpdates
+    'poll_limit': 100,  # максимум, который допускает Bot API
+    'allowed_updates': ['message', 'callback_query']
+}
+
+# Рассылки-задания (broadcasts.py): потоки отправки в процессе бота и размер пачки
+BROADCAST_CONFIG = {
+    'workers': int(os.getenv('BROADCAST_WORKERS', '8')),
+    'batch_size': int(os.getenv('BROADCAST_BATCH_SIZE', '100')),
+    'poll_interval': 30  # с; новые задания обычно приходят через канал изменений сразу
+}
+
+# Push-уведомления (notifications.py): потоки отправки и повторы с экспоненциальной задержкой
+NOTIFICATIONS_CONFIG = {
+    'push_workers': int(os.getenv('PUSH_WORKERS', '4')),
+    'max_attempts': 3,
+    'retry_delay': 30  # с; далее 60, 120...
+}
+
+# Постоянная очередь заданий (job_queue.py): аренда и повторы
+JOBS_CONFIG = {
+    'workers': int(os.getenv('JOB_WORKERS', '4')),
+    'batch_size': 20,
+    'lease_seconds': 120,  # задание недоступно другим исполнителям, пока идет аренда
+    'poll_interval': 5,  # с; задания из других процессов замечаются не позже
+    'max_attempts': 5,
+    'retry_delay': 30,  # с; далее 60, 120...
+    'keep_days': 7  # сколько хранить выполненные задания
+}
+
+# Маркетинговая автоматизация (marketing_automation.py)
+AUTOMATION_CONFIG = {
+    'interval': 300,  # с; заказы и поступления будят движок раньше через канал изменений
+    'min_interval': 10  # с; события за это время обрабатываются одним прогоном
+}
+
+# CRM (crm.py): RFM-сегменты обновляются триггерами, давность — ночным пересчетом
+CRM_CONFIG = {
+    'rfm_decay_hour': int(os.getenv('RFM_DECAY_HOUR', '3')),  # местное время ночного пересчета
+    'scores_interval_hours': int(os.getenv('CUSTOMER_SCORES_INTERVAL_HOURS', '24'))  # оценки оттока и CLV (customer_scores.py)
+}
+
+# Рекомендации «с этим товаром покупают» (item_similarity.py)
+RECOMMENDATIONS_CONFIG = {
+    'top_k': int(os.getenv('RECOMMENDATIONS_TOP_K', '20')),  # соседей на товар
+    'min_pair_count': 1,  # минимум совместных заказов для соседа
+    'max_order_items': 50,  # заказы крупнее не дают пар
+    'batch_orders': 5000,  # заказов за одну транзакцию обновления
+    'update_delay': 10,  # с; новые заказы за это время обрабатываются одним прогоном
+    'refresh_hours': 24,  # полный пересчет соседей
+    'product_page_limit': 3  # товаров в блоке на карточке товара
 }
 
 # Контактная информация
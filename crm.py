@@ -2,115 +2,88 @@
 CRM модуль для управления клиентами
 """
 
-from datetime import datetime
+import logging
+from datetime import datetime, timedelta
 from utils import format_price, format_date
+from customer_scores import CustomerScores
+
+try:
+    from config import CRM_CONFIG
+except Exception:
+    CRM_CONFIG = {}
+
+# Сегменты RFM в порядке убывания ценности
+SEGMENTS = ('champions', 'loyal', 'potential', 'new', 'promising',
+            'need_attention', 'at_risk', 'hibernating', 'lost')
 
 class CRMManager:
     def __init__(self, db):
         self.db = db
     
+    def use_job_queue(self, jobs):
+        """Ночной пересчет давности RFM — заданием постоянной очереди"""
+        self.jobs = jobs
+        jobs.register('rfm_decay', self.run_rfm_decay)
+        self.schedule_rfm_decay()
+    
+    def schedule_rfm_decay(self):
+        """Поставить ближайший ночной пересчет (ключ по дате — одно задание на ночь)"""
+        now = datetime.now()
+        run_at = now.replace(hour=CRM_CONFIG.get('rfm_decay_hour', 3), minute=0, second=0, microsecond=0)
+        if run_at <= now:
+            run_at += timedelta(days=1)
+        self.jobs.enqueue('rfm_decay', delay=(run_at - now).total_seconds(),
+                          idempotency_key=f"rfm_decay:{run_at.date().isoformat()}")
+    
+    def run_rfm_decay(self, payload=None):
+        """Задание очереди: пересчет давности и сегментов, затем следующая ночь"""
+        self.schedule_rfm_decay()
+        count = self.db.refresh_customer_rfm()
+        logging.info(f"RFM-сегменты пересчитаны: {count} клиентов")
+    
     def segment_customers(self):
-        """Сегментация клиентов по RFM анализу"""
-        customers = self.db.execute_query('''
-            SELECT 
-                u.id,
-                u.name,
-                u.telegram_id,
-                u.created_at,
-                COUNT(o.id) as total_orders,
-                SUM(o.total_amount) as total_spent,
-                AVG(o.total_amount) as avg_order_value,
-                MAX(o.created_at) as last_order_date,
-                julianday('now') - julianday(MAX(o.created_at)) as days_since_last_order
-            FROM users u
-            LEFT JOIN orders o ON u.id = o.user_id AND o.status != 'cancelled'
-            WHERE u.is_admin = 0
-            GROUP BY u.id, u.name, u.telegram_id, u.created_at
-        ''')
-        
-        segments = {
-            'champions': [],      # Лучшие клиенты
-            'loyal': [],          # Лояльные клиенты
-            'potential': [],      # Потенциально лояльные
-            'new': [],           # Новые клиенты
-            'promising': [],     # Перспективные
-            'need_attention': [], # Требуют внимания
-            'at_risk': [],       # В зоне риска
-            'hibernating': [],   # Спящие
-            'lost': []           # Потерянные
-        }
-        
-        for customer in customers:
-            user_id, name, telegram_id, reg_date, orders, spent, avg_order, last_order, days_since = customer
-            
-            # RFM скоринг
-            if orders == 0:
-                segments['new'].append(customer)
-                continue
-            
-            # Recency (дни с последнего заказа)
-            if days_since is None:
-                recency_score = 5
-            elif days_since <= 30:
-                recency_score = 5
-            elif days_since <= 60:
-                recency_score = 4
-            elif days_since <= 90:
-                recency_score = 3
-            elif days_since <= 180:
-                recency_score = 2
-            else:
-                recency_score = 1
-            
-            # Frequency (количество заказов)
-            if orders >= 10:
-                frequency_score = 5
-            elif orders >= 5:
-                frequency_score = 4
-            elif orders >= 3:
-                frequency_score = 3
-            elif orders >= 2:
-                frequency_score = 2
-            else:
-                frequency_score = 1
-            
-            # Monetary (общая сумма покупок)
-            if spent >= 1000:
-                monetary_score = 5
-            elif spent >= 500:
-                monetary_score = 4
-            elif spent >= 200:
-                monetary_score = 3
-            elif spent >= 50:
-                monetary_score = 2
-            else:
-                monetary_score = 1
-            
-            # Определяем сегмент
-            avg_score = (recency_score + frequency_score + monetary_score) / 3
-            
-            if avg_score >= 4.5:
-                segments['champions'].append(customer)
-            elif avg_score >= 4:
-                segments['loyal'].append(customer)
-            elif avg_score >= 3.5:
-                segments['potential'].append(customer)
-            elif avg_score >= 3:
-                if orders == 1:
-                    segments['new'].append(customer)
-                else:
-                    segments['promising'].append(customer)
-            elif avg_score >= 2.5:
-                segments['need_attention'].append(customer)
-            elif avg_score >= 2:
-                segments['at_risk'].append(customer)
-            elif days_since and days_since > 180:
-                segments['hibernating'].append(customer)
-            else:
-                segments['lost'].append(customer)
-        
+        """Сегментация клиентов по RFM анализу (таблица customer_rfm, триггеры на заказах)"""
+        segments = {segment: [] for segment in SEGMENTS}
+        for customer in self._rfm_customers():
+            segments.setdefault(customer[-1], []).append(customer[:-1])
         return segments
     
+    def get_segment(self, segment, limit=None):
+        """Клиенты одного сегмента по индексу, сначала самые ценные"""
+        return [customer[:-1] for customer in self._rfm_customers(segment, limit)]
+    
+    def get_segment_summary(self):
+        """Число клиентов и сумма покупок по сегментам — не зависит от числа клиентов"""
+        summary = {segment: {'customers': 0, 'monetary': 0.0} for segment in SEGMENTS}
+        rows = self.db.execute_query('SELECT segment, customers, monetary FROM customer_segments') or []
+        for segment, customers, monetary in rows:
+            if customers:
+                summary[segment] = {'customers': customers, 'monetary': monetary}
+        return summary
+    
+    def _rfm_customers(self, segment=None, limit=None):
+        """(id, name, telegram_id, created_at, total_orders, total_spent, avg_order_value,
+        last_order_date, days_since_last_order, segment)"""
+        query = '''
+            SELECT u.id, u.name, u.telegram_id, u.created_at,
+                   r.frequency, r.monetary,
+                   CASE WHEN r.frequency > 0 THEN r.monetary / r.frequency END,
+                   r.last_order_at,
+                   julianday('now') - julianday(r.last_order_at),
+                   r.segment
+            FROM customer_rfm r
+            JOIN users u ON u.id = r.user_id
+        '''
+        params = []
+        if segment is not None:
+            query += ' WHERE r.segment = ?'
+            params.append(segment)
+        query += ' ORDER BY r.segment, r.monetary DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return self.db.execute_query(query, params) or []
+    
     def get_customer_profile(self, user_id):
         """Получение полного профиля клиента"""
         # Основная информация
@@ -281,26 +254,29 @@ class CRMManager:
         
         return events
     
-    def get_churn_risk_customers(self):
+    def get_churn_risk_customers(self, limit=None):
         """Получение клиентов с риском оттока"""
-        at_risk_customers = self.db.execute_query('''
+        query = '''
             SELECT 
                 u.id,
                 u.name,
                 u.telegram_id,
-                MAX(o.created_at) as last_order,
-                julianday('now') - julianday(MAX(o.created_at)) as days_since_last_order,
-                COUNT(o.id) as total_orders,
-                SUM(o.total_amount) as total_spent
-            FROM users u
-            JOIN orders o ON u.id = o.user_id
-            WHERE u.is_admin = 0 AND o.status != 'cancelled'
-            GROUP BY u.id, u.name, u.telegram_id
-            HAVING days_since_last_order > 60 AND total_orders >= 2
-            ORDER BY total_spent DESC
-        ''')
-        
-        return at_risk_customers
+                r.last_order_at as last_order,
+                julianday('now') - julianday(r.last_order_at) as days_since_last_order,
+                r.frequency as total_orders,
+                r.monetary as total_spent,
+                s.churn_score,
+                s.predicted_clv
+            FROM customer_rfm r
+            JOIN users u ON u.id = r.user_id
+            LEFT JOIN customer_scores s ON s.user_id = r.user_id AND s.total_orders = r.frequency
+                AND s.last_order_at IS r.last_order_at AND abs(s.total_spent - r.monetary) < 0.005
+            WHERE r.last_order_at < datetime('now', '-60 days') AND r.frequency >= 2
+            ORDER BY r.monetary DESC
+        '''
+        if limit:
+            return self.db.execute_query(query + ' LIMIT ?', (limit,))
+        return self.db.execute_query(query)
     
     def create_win_back_campaign(self, customer_ids):
         """Создание кампании возврата клиентов"""
@@ -495,6 +471,11 @@ class CRMManager:
     
     def get_customer_lifetime_value_prediction(self, user_id):
         """Прогноз жизненной ценности клиента"""
+        # Свежая оценка из пакетного пересчета
+        scores = CustomerScores(self.db).get(user_id)
+        if scores:
+            return CustomerScores.lifetime_value(scores)
+        
         # Получаем историю покупок
         orders = self.db.execute_query('''
             SELECT total_amount, created_at
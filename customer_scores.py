@@ -0,0 +1,207 @@
+"""
+Пакетный расчет риска оттока и прогноза ценности клиентов
+
+Признаки всех клиентов читаются одним запросом по заказам и считаются
+векторно в NumPy (без NumPy — тем же циклом на Python). Результат с временем
+расчета хранится в таблице customer_scores; CRM, автоматизация и уведомления
+читают готовые оценки вместо запросов по каждому клиенту.
+"""
+
+import logging
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from config import CRM_CONFIG
+except Exception:
+    CRM_CONFIG = {}
+
+COLUMNS = ('user_id', 'total_orders', 'total_spent', 'avg_order_value', 'last_order_at',
+           'days_since_last_order', 'churn_score', 'churn_risk', 'avg_interval_days',
+           'predicted_orders_per_year', 'predicted_clv', 'confidence')
+
+# Оценки, рассчитанные по текущим заказам клиента: итоги сверяются с customer_rfm,
+# которую триггеры обновляют при каждом изменении заказов, — после нового заказа
+# или отмены оценка не используется до следующего пересчета
+CURRENT_SCORES = '''
+    customer_scores s
+    JOIN customer_rfm r ON r.user_id = s.user_id AND r.frequency = s.total_orders
+        AND r.last_order_at IS s.last_order_at AND abs(r.monetary - s.total_spent) < 0.005
+'''
+
+CHURN_REASONS = {
+    'high': 'Долго нет заказов, низкая активность',
+    'medium': 'Снижение активности',
+    'low': 'Активный клиент'
+}
+
+
+class CustomerScores:
+    """Оценки клиентов из таблицы customer_scores и их пересчет"""
+
+    def __init__(self, db, interval_hours=None):
+        self.db = db
+        self.interval = (interval_hours or CRM_CONFIG.get('scores_interval_hours', 24)) * 3600
+        self.jobs = None
+
+    # Расчет
+
+    def load_features(self):
+        """Признаки клиентов с заказами одним проходом: по столбцу на признак"""
+        rows = self.db.execute_query('''
+            SELECT user_id,
+                   COUNT(*),
+                   IFNULL(SUM(total_amount), 0),
+                   MAX(created_at),
+                   julianday('now') - julianday(MAX(created_at)),
+                   julianday(MAX(created_at)) - julianday(MIN(created_at))
+            FROM orders
+            WHERE status != 'cancelled'
+            GROUP BY user_id
+        ''') or []
+        if not rows:
+            return None
+        names = ('user_id', 'orders', 'spent', 'last_order_at', 'days', 'span')
+        return dict(zip(names, (list(column) for column in zip(*rows))))
+
+    def score_all(self):
+        """Пересчитать оценки всех клиентов; возвращает число клиентов"""
+        started = time.perf_counter()
+        features = self.load_features()
+        scored = []
+        if features:
+            scored = self._score_numpy(features) if np is not None else self._score_python(features)
+        placeholders = ', '.join('?' * len(COLUMNS))
+        with self.db.transaction():
+            self.db.execute_query('DELETE FROM customer_scores')
+            if scored:
+                self.db.execute_many(f'''
+                    INSERT INTO customer_scores ({', '.join(COLUMNS)}, scored_at)
+                    VALUES ({placeholders}, CURRENT_TIMESTAMP)
+                ''', scored)
+        logging.info(f"Оценки клиентов пересчитаны: {len(scored)} за {time.perf_counter() - started:.2f}с"
+                     f"{'' if np is not None else ' (без NumPy)'}")
+        return len(scored)
+
+    @staticmethod
+    def _score_numpy(features):
+        orders = np.asarray(features['orders'], dtype=np.float64)
+        spent = np.asarray(features['spent'], dtype=np.float64)
+        days = np.nan_to_num(np.asarray(features['days'], dtype=np.float64))
+        span = np.nan_to_num(np.asarray(features['span'], dtype=np.float64))
+        avg_order = spent / orders
+
+        # Риск оттока: давность последнего заказа, число заказов, средний чек
+        churn = (np.select([days > 90, days > 60, days > 30], [40, 25, 10], 0)
+                 + np.select([orders == 1, orders < 3], [20, 10], 0)
+                 + np.where(avg_order < 25, 15, 0))
+        risk = np.select([churn >= 60, churn >= 30], ['high', 'medium'], 'low')
+
+        # Годовая ценность: средний интервал между заказами и средний чек (от двух заказов)
+        repeat = orders >= 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            interval = np.where(repeat, span / (orders - 1), np.nan)
+            per_year = np.where(interval > 0, 365 / interval, 0.0)
+        per_year = np.where(repeat, per_year, np.nan)
+        clv = per_year * avg_order
+        confidence = np.select([orders >= 5, orders >= 3], ['High', 'Medium'], 'Low')
+
+        def column(values):
+            return [None if value != value else value for value in values.tolist()]
+
+        return list(zip(features['user_id'], orders.astype(np.int64).tolist(), spent.tolist(),
+                        avg_order.tolist(), features['last_order_at'], days.tolist(),
+                        churn.tolist(), risk.tolist(), column(interval), column(per_year),
+                        column(clv), np.where(repeat, confidence, None).tolist()))
+
+    @staticmethod
+    def _score_python(features):
+        scored = []
+        for user_id, orders, spent, last_order_at, days, span in zip(
+                features['user_id'], features['orders'], features['spent'],
+                features['last_order_at'], features['days'], features['span']):
+            days, span = days or 0, span or 0
+            avg_order = spent / orders
+            churn = 40 if days > 90 else 25 if days > 60 else 10 if days > 30 else 0
+            churn += 20 if orders == 1 else 10 if orders < 3 else 0
+            churn += 15 if avg_order < 25 else 0
+            risk = 'high' if churn >= 60 else 'medium' if churn >= 30 else 'low'
+            interval = per_year = clv = confidence = None
+            if orders >= 2:
+                interval = span / (orders - 1)
+                per_year = 365 / interval if interval > 0 else 0.0
+                clv = per_year * avg_order
+                confidence = 'High' if orders >= 5 else 'Medium' if orders >= 3 else 'Low'
+            scored.append((user_id, orders, spent, avg_order, last_order_at, days,
+                           churn, risk, interval, per_year, clv, confidence))
+        return scored
+
+    # Чтение
+
+    def get(self, user_id):
+        """Оценки клиента, если они не старше двух интервалов пересчета и заказы с тех пор
+        не менялись; иначе None"""
+        rows = self.db.execute_query(f'''
+            SELECT {', '.join('s.' + column for column in COLUMNS)} FROM {CURRENT_SCORES}
+            WHERE s.user_id = ? AND s.scored_at >= datetime('now', ?)
+        ''', (user_id, f'-{int(self.interval * 2)} seconds'))
+        return dict(zip(COLUMNS, rows[0])) if rows else None
+
+    def is_fresh(self):
+        """Оценки есть и не старше двух интервалов пересчета"""
+        age = self.age()
+        return age is not None and age <= self.interval * 2
+
+    def age(self):
+        """Сколько секунд назад был последний пересчет (None — не было)"""
+        rows = self.db.execute_query(
+            "SELECT strftime('%s', 'now') - strftime('%s', MAX(scored_at)) FROM customer_scores"
+        )
+        return rows[0][0] if rows and rows[0][0] is not None else None
+
+    @staticmethod
+    def churn_risk(scores):
+        """Оценки в формате SmartNotificationAI.predict_user_churn_risk"""
+        return {
+            'risk': scores['churn_risk'],
+            'score': scores['churn_score'],
+            'reason': CHURN_REASONS[scores['churn_risk']],
+            'days_since_last_order': scores['days_since_last_order']
+        }
+
+    @staticmethod
+    def lifetime_value(scores):
+        """Оценки в формате CRMManager.get_customer_lifetime_value_prediction (None — меньше двух заказов)"""
+        if scores['predicted_clv'] is None:
+            return None
+        return {
+            'avg_interval_days': scores['avg_interval_days'],
+            'avg_order_value': scores['avg_order_value'],
+            'predicted_orders_per_year': scores['predicted_orders_per_year'],
+            'predicted_clv': scores['predicted_clv'],
+            'confidence': scores['confidence']
+        }
+
+    # Расписание
+
+    def use_job_queue(self, jobs):
+        """Пересчет — заданием постоянной очереди раз в интервал"""
+        self.jobs = jobs
+        jobs.register('customer_scores', self.run_scoring)
+        self.schedule()
+
+    def schedule(self):
+        """Поставить следующий пересчет; устаревшие оценки пересчитываются сразу"""
+        age = self.age()
+        delay = 0 if age is None else max(0, self.interval - age)
+        slot = int((time.time() + delay) // self.interval)
+        self.jobs.enqueue('customer_scores', delay=delay, idempotency_key=f"customer_scores:{slot}")
+
+    def run_scoring(self, payload=None):
+        """Задание очереди: пересчет и постановка следующего"""
+        self.score_all()
+        self.schedule()
@@ -3,51 +3,556 @@
 """
 import logging
 
+import base64
+import json
+import os
+import re
 import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+try:
+    from config import DATABASE_CONFIG
+except Exception:
+    DATABASE_CONFIG = {}
+
+# Транслитерация для поиска: узбекская латиница <-> кириллица
+_CYR_TO_LAT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ў': "o'", 'қ': 'q',
+    'ғ': "g'", 'ҳ': 'h'
+}
+_LAT_TO_CYR = [
+    ("o'", 'ў'), ("g'", 'ғ'), ('sh', 'ш'), ('ch', 'ч'), ('yo', 'ё'), ('yu', 'ю'),
+    ('ya', 'я'), ('ts', 'ц'), ('a', 'а'), ('b', 'б'), ('c', 'к'), ('d', 'д'),
+    ('e', 'е'), ('f', 'ф'), ('g', 'г'), ('h', 'х'), ('i', 'и'), ('j', 'ж'),
+    ('k', 'к'), ('l', 'л'), ('m', 'м'), ('n', 'н'), ('o', 'о'), ('p', 'п'),
+    ('q', 'к'), ('r', 'р'), ('s', 'с'), ('t', 'т'), ('u', 'у'), ('v', 'в'),
+    ('w', 'в'), ('x', 'х'), ('y', 'й'), ('z', 'з')
+]
+_APOSTROPHES = str.maketrans({c: "'" for c in "ʻʼ’‘`"})
+
+
+def _search_variants(term):
+    """Варианты слова в обеих письменностях"""
+    term = term.lower().translate(_APOSTROPHES)
+    variants = [term]
+    latin = ''.join(_CYR_TO_LAT.get(ch, ch) for ch in term)
+    if latin != term:
+        variants.append(latin)
+    else:
+        cyrillic = term
+        for lat, cyr in _LAT_TO_CYR:
+            cyrillic = cyrillic.replace(lat, cyr)
+        if cyrillic != term:
+            variants.append(cyrillic)
+            # В начале слова латинская e обычно соответствует «э» (elektron -> электрон)
+            if cyrillic.startswith('е'):
+                variants.append('э' + cyrillic[1:])
+    return variants
+
+
+def build_search_query(text):
+    """Строка MATCH для FTS5: все слова обязательны, последнее — префикс (type-ahead)"""
+    terms = re.findall(r"[\w'ʻʼ’‘`]+", text or '')
+    terms = [term.strip("'ʻʼ’‘`") for term in terms]
+    terms = [term for term in terms if term]
+    if not terms:
+        return None
+    parts = []
+    for i, term in enumerate(terms):
+        # Короткие слова ищем как префикс всегда, остальные — только последнее
+        prefix = '*' if i == len(terms) - 1 or len(term) < 3 else ''
+        variants = ['"{}"{}'.format(v.replace('"', ''), prefix) for v in _search_variants(term)]
+        parts.append('(' + ' OR '.join(variants) + ')')
+    return ' AND '.join(parts)
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value).strip()[:10], '%Y-%m-%d').date()
+
+
+def day_range(start_date, end_date=None):
+    """Дни [start_date, end_date] -> полуоткрытый диапазон (start, end + 1 день) для created_at >= ? AND created_at < ?
+
+    В отличие от DATE(created_at) BETWEEN ? AND ? такое условие использует индекс по created_at.
+    Принимает строки 'YYYY-MM-DD' (время отбрасывается), date и datetime; без end_date — один день.
+    """
+    start = _as_date(start_date)
+    end = _as_date(end_date) if end_date is not None else start
+    return start.isoformat(), (end + timedelta(days=1)).isoformat()
+
+
+def encode_cursor(direction, keys):
+    """Токен курсора keyset-пагинации: направление ('n'/'p') и ключи строки"""
+    raw = json.dumps({'d': direction, 'k': list(keys)}, ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Разбор токена курсора; некорректный токен означает первую страницу"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        state = json.loads(raw.decode('utf-8'))
+        if state.get('d') in ('n', 'p') and isinstance(state.get('k'), list):
+            return state
+    except (ValueError, TypeError, AttributeError):
+        pass
+    return None
+
+
+# RFM-сегментация (customer_rfm): source дает user_id, frequency, monetary, last_order_at.
+# Средний балл (R + F + M) / 3 сравнивается с порогами через сумму баллов
+_RFM_ORDERS_SOURCE = '''
+    SELECT u.id AS user_id, COUNT(o.id) AS frequency, IFNULL(SUM(o.total_amount), 0) AS monetary,
+           MAX(o.created_at) AS last_order_at
+    FROM users u
+    LEFT JOIN orders o ON o.user_id = u.id AND o.status != 'cancelled'
+    WHERE u.is_admin = 0 {where}
+    GROUP BY u.id
+'''
+_RFM_UPSERT = '''
+    INSERT INTO customer_rfm (user_id, frequency, monetary, last_order_at, recency_days,
+                              r_score, f_score, m_score, segment, updated_at)
+    SELECT user_id, frequency, monetary, last_order_at, recency_days, r_score, f_score, m_score,
+           CASE
+               WHEN frequency = 0 THEN 'new'
+               WHEN r_score + f_score + m_score >= 14 THEN 'champions'
+               WHEN r_score + f_score + m_score >= 12 THEN 'loyal'
+               WHEN r_score + f_score + m_score >= 11 THEN 'potential'
+               WHEN r_score + f_score + m_score >= 9 THEN CASE WHEN frequency = 1 THEN 'new' ELSE 'promising' END
+               WHEN r_score + f_score + m_score >= 8 THEN 'need_attention'
+               WHEN r_score + f_score + m_score >= 6 THEN 'at_risk'
+               WHEN recency_days > 180 THEN 'hibernating'
+               ELSE 'lost'
+           END,
+           CURRENT_TIMESTAMP
+    FROM (
+        SELECT *,
+               CASE WHEN recency_days IS NULL OR recency_days <= 30 THEN 5
+                    WHEN recency_days <= 60 THEN 4 WHEN recency_days <= 90 THEN 3
+                    WHEN recency_days <= 180 THEN 2 ELSE 1 END AS r_score,
+               CASE WHEN frequency >= 10 THEN 5 WHEN frequency >= 5 THEN 4
+                    WHEN frequency >= 3 THEN 3 WHEN frequency >= 2 THEN 2 ELSE 1 END AS f_score,
+               CASE WHEN monetary >= 1000 THEN 5 WHEN monetary >= 500 THEN 4
+                    WHEN monetary >= 200 THEN 3 WHEN monetary >= 50 THEN 2 ELSE 1 END AS m_score
+        FROM (
+            SELECT user_id, frequency, monetary, last_order_at,
+                   julianday('now') - julianday(last_order_at) AS recency_days
+            FROM ({source})
+        )
+    )
+    WHERE true
+    ON CONFLICT(user_id) DO UPDATE SET
+        frequency = excluded.frequency, monetary = excluded.monetary,
+        last_order_at = excluded.last_order_at, recency_days = excluded.recency_days,
+        r_score = excluded.r_score, f_score = excluded.f_score, m_score = excluded.m_score,
+        segment = excluded.segment, updated_at = excluded.updated_at
+'''
+
+
+class PoolExhaustedError(sqlite3.OperationalError):
+    """Все соединения пула заняты дольше timeout"""
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений SQLite"""
+
+    def __init__(self, db_path, max_connections=10, timeout=30, health_check_after=60, pragmas=None):
+        self.db_path = db_path
+        self.pragmas = dict(pragmas or {})
+        self.max_connections = max(1, int(max_connections or 1))
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        # Свободные соединения (LIFO) и условие, на котором ждут освобождения слота
+        self._idle = []
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._created = 0
+        self._pid = os.getpid()
+        self.stats = {
+            'created': 0,
+            'closed': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'health_check_failures': 0,
+            'wait_time_total': 0.0
+        }
+
+    def _connect(self):
+        """Создание нового соединения"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        self.apply_pragmas(conn, self.pragmas)
+        with self._lock:
+            self.stats['created'] += 1
+        return conn
+
+    @staticmethod
+    def apply_pragmas(conn, pragmas):
+        """Применение профиля PRAGMA к соединению"""
+        # journal_mode первым: остальные настройки зависят от режима журнала
+        for name in sorted(pragmas, key=lambda n: n != 'journal_mode'):
+            value = pragmas[name]
+            if value is None:
+                continue
+            try:
+                conn.execute(f'PRAGMA {name} = {value}').fetchall()
+            except sqlite3.Error as e:
+                logging.info(f"Не удалось применить PRAGMA {name}={value}: {e}")
+
+    def _free_slot(self):
+        """Освобождение слота и пробуждение ожидающего потока"""
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    def _discard(self, conn):
+        """Закрытие соединения и освобождение слота"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._available:
+            self._created -= 1
+            self.stats['closed'] += 1
+            self._available.notify()
+
+    def _reset_after_fork(self):
+        """Сброс пула в дочернем процессе (gunicorn и т.п.)"""
+        with self._lock:
+            self._idle = []
+            self._created = 0
+            self._pid = os.getpid()
+
+    def _checkout(self):
+        """Свободное соединение или None, если можно создать новое; ждет освобождения слота"""
+        with self._available:
+            self.stats['checkouts'] += 1
+            if not self._idle and self._created >= self.max_connections:
+                # Пул исчерпан — ждем возврата или закрытия соединения
+                self.stats['waits'] += 1
+                started = time.monotonic()
+                ready = self._available.wait_for(
+                    lambda: self._idle or self._created < self.max_connections, self.timeout
+                )
+                self.stats['wait_time_total'] += time.monotonic() - started
+                if not ready:
+                    raise PoolExhaustedError(
+                        f"Пул соединений исчерпан: все {self.max_connections} соединений заняты дольше {self.timeout} с"
+                    )
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+            return None
+
+    def acquire(self):
+        """Получение соединения из пула"""
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+
+        while True:
+            idle = self._checkout()
+            if idle is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._free_slot()
+                    raise
+            conn, released_at = idle
+
+            # Проверяем соединения, долго лежавшие без дела
+            if time.monotonic() - released_at > self.health_check_after:
+                try:
+                    conn.execute('SELECT 1').fetchone()
+                except Exception:
+                    with self._lock:
+                        self.stats['health_check_failures'] += 1
+                    self._discard(conn)
+                    continue
+            return conn
+
+    def release(self, conn):
+        """Возврат соединения в пул"""
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._available:
+            self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def close_all(self):
+        """Закрытие всех свободных соединений"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def get_stats(self):
+        """Статистика пула"""
+        with self._lock:
+            created = self._created
+            idle = len(self._idle)
+            stats = dict(self.stats)
+        stats.update({
+            'max_connections': self.max_connections,
+            'open': created,
+            'idle': idle,
+            'in_use': max(0, created - idle)
+        })
+        return stats
+
+
+_FP_STRING = re.compile(r"'(?:[^']|'')*'")
+_FP_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_FP_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_FP_SPACES = re.compile(r"\s+")
+
+
+def fingerprint_query(query):
+    """Нормализованный отпечаток SQL: литералы -> ?, списки IN (?, ?, ...) -> (?+), без лишних пробелов"""
+    fp = _FP_STRING.sub('?', query)
+    fp = _FP_NUMBER.sub('?', fp)
+    fp = _FP_IN_LIST.sub('(?+)', fp)
+    return _FP_SPACES.sub(' ', fp).strip()
+
+
+class QueryStats:
+    """Статистика запросов по отпечаткам и журнал медленных запросов с EXPLAIN QUERY PLAN"""
+
+    def __init__(self, slow_query_ms=100, samples=512, slow_log_size=100, explain_interval=60):
+        self.slow_query_ms = slow_query_ms
+        self.samples = samples
+        self.explain_interval = explain_interval
+        self._lock = threading.Lock()
+        self._queries = {}
+        self._explained_at = {}
+        self.slow_log = deque(maxlen=slow_log_size)
+
+    def record(self, query, elapsed, rows=0, conn=None, params=None):
+        """Учет выполненного запроса; elapsed в секундах"""
+        fp = fingerprint_query(query)
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            entry = self._queries.get(fp)
+            if entry is None:
+                entry = self._queries[fp] = {
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0,
+                    'latencies': deque(maxlen=self.samples)
+                }
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['rows'] += rows or 0
+            entry['latencies'].append(elapsed_ms)
+
+            if elapsed_ms < self.slow_query_ms:
+                return
+            # План одного и того же запроса снимаем не чаще раза в explain_interval
+            now = time.monotonic()
+            explained_at, plan = self._explained_at.get(fp, (None, None))
+            need_plan = conn is not None and (explained_at is None or now - explained_at >= self.explain_interval)
+            if need_plan:
+                self._explained_at[fp] = (now, plan)
+
+        if need_plan:
+            plan = self.explain(conn, query, params)
+            with self._lock:
+                self._explained_at[fp] = (now, plan)
+        self.slow_log.append({
+            'fingerprint': fp,
+            'sql': query.strip(),
+            'elapsed_ms': round(elapsed_ms, 2),
+            'rows': rows or 0,
+            'plan': plan,
+            'at': time.strftime('%Y-%m-%d %H:%M:%S')
+        })
+        logging.info(f"Медленный запрос ({elapsed_ms:.1f} мс): {fp}" + (f"\nПлан: {'; '.join(plan)}" if plan else ''))
+
+    @staticmethod
+    def explain(conn, query, params=None):
+        """EXPLAIN QUERY PLAN для запроса (список строк плана)"""
+        try:
+            rows = conn.execute(f'EXPLAIN QUERY PLAN {query}', params or ()).fetchall()
+            return [row[-1] for row in rows]
+        except Exception as e:
+            return [f'EXPLAIN недоступен: {e}']
+
+    @staticmethod
+    def _percentile(sorted_values, pct):
+        if not sorted_values:
+            return 0.0
+        index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+        return sorted_values[index]
+
+    def snapshot(self, limit=20, order_by='total_ms'):
+        """Топ отпечатков (по умолчанию по суммарному времени) и последние медленные запросы"""
+        with self._lock:
+            items = [(fp, dict(entry, latencies=sorted(entry['latencies']))) for fp, entry in self._queries.items()]
+        queries = []
+        for fp, entry in items:
+            latencies = entry['latencies']
+            queries.append({
+                'fingerprint': fp,
+                'count': entry['count'],
+                'total_ms': round(entry['total_ms'], 2),
+                'avg_ms': round(entry['total_ms'] / entry['count'], 3) if entry['count'] else 0,
+                'p50_ms': round(self._percentile(latencies, 50), 3),
+                'p99_ms': round(self._percentile(latencies, 99), 3),
+                'max_ms': round(entry['max_ms'], 3),
+                'rows': entry['rows']
+            })
+        queries.sort(key=lambda q: q.get(order_by, 0), reverse=True)
+        return {
+            'slow_query_ms': self.slow_query_ms,
+            'fingerprints': len(queries),
+            'total_queries': sum(q['count'] for q in queries),
+            'queries': queries[:limit],
+            'slow_queries': list(self.slow_log)[-limit:][::-1]
+        }
+
+    def reset(self):
+        """Сброс накопленной статистики"""
+        with self._lock:
+            self._queries.clear()
+            self._explained_at.clear()
+            self.slow_log.clear()
+
+
+class UpdateContext:
+    """Данные пользователя на время обработки одного update: строка users, язык, админ, сводка корзины"""
+
+    def __init__(self, telegram_id, user=None, cart_items=0, cart_total=0):
+        self.telegram_id = telegram_id
+        self.user = user
+        self.cart_items = cart_items or 0
+        self.cart_total = cart_total or 0
+        # Кэш действителен, пока в рамках update не было записи в users/cart
+        self.user_stale = False
+        self.cart_stale = False
+        self.queries = 0
+
+    @property
+    def user_id(self):
+        return self.user[0] if self.user else None
+
+    @property
+    def language(self):
+        return (self.user[5] if self.user else None) or 'ru'
+
+    @property
+    def is_admin(self):
+        return bool(self.user and self.user[6] == 1)
+
 
 class DatabaseManager:
-    def __init__(self, db_path='shop_bot.db'):
+    def __init__(self, db_path='shop_bot.db', pragmas=None):
         self.db_path = db_path
+        self.pool = ConnectionPool(
+            db_path,
+            max_connections=DATABASE_CONFIG.get('max_connections', 10),
+            pragmas=DATABASE_CONFIG.get('pragmas', {}) if pragmas is None else pragmas
+        )
+        # Соединение активной транзакции текущего потока
+        self._local = threading.local()
+        self.fts_enabled = False
+        # Кэш COUNT(*) для подсчета страниц
+        self._count_cache = {}
+        self._count_lock = threading.Lock()
+        # Латентность запросов по отпечаткам и журнал медленных запросов
+        self.query_stats = QueryStats(slow_query_ms=DATABASE_CONFIG.get('slow_query_ms', 100))
+        # Число запросов на один Telegram update (см. update_context)
+        self.update_stats = {'updates': 0, 'queries': 0, 'max_queries': 0}
         self.init_database()
     
+    # Версионные миграции схемы: (номер, описание, метод). Номер пишется в PRAGMA user_version,
+    # поэтому уже обновленная база открывается одним чтением. Новые изменения схемы —
+    # только новой миграцией в конце списка, старые не редактируются.
+    MIGRATIONS = (
+        (1, 'Базовая схема', 'create_tables'),
+        (2, 'Недостающие колонки старых баз (users.role, orders.*)', '_migrate_legacy_columns'),
+        (3, 'Индексы', 'create_indexes'),
+        (4, 'Полнотекстовый индекс товаров', '_create_search_index'),
+        (5, 'Тестовые данные для пустой базы', '_seed_test_data'),
+        (6, 'Индексы для отчетов по периодам', '_create_report_indexes'),
+        (7, 'Журнал изменений каталога и автопостов для бота', '_create_change_events'),
+        (8, 'Задания рассылок с прогрессом по получателям', '_create_broadcast_jobs'),
+        (9, 'Кэш file_id загруженных в Telegram изображений', '_create_telegram_files'),
+        (10, 'Постоянная очередь заданий (отложенные уведомления)', '_create_job_queue'),
+        (11, 'События заказов и склада для инкрементальной автоматизации', '_create_automation_events'),
+        (12, 'RFM-сегменты клиентов, обновляемые триггерами', '_create_customer_rfm'),
+        (13, 'Пакетные оценки оттока и ценности клиентов', '_create_customer_scores'),
+        (14, 'Индекс совместных покупок товаров', '_create_item_similarity'),
+        (15, 'Отмененные заказы, не учтенные в индексе совместных покупок', '_create_item_excluded_orders'),
+        (16, 'Индекс списка клиентов по сумме покупок', '_create_customer_list_index'),
+    )
+    
     def init_database(self):
-        # Обновление схемы: роль пользователя
+        """Инициализация базы данных: применяет недостающие миграции"""
+        conn = None
         try:
-            conn_alter = sqlite3.connect(self.db_path)
-            cur_alter = conn_alter.cursor()
-            cur_alter.execute("ALTER TABLE users ADD COLUMN role TEXT")
-            conn_alter.commit()
-        except Exception:
-            pass
+            conn = self.pool.acquire()
+            latest = self.MIGRATIONS[-1][0]
+            version, self.fts_enabled = conn.execute(
+                "SELECT (SELECT user_version FROM pragma_user_version), "
+                "EXISTS(SELECT 1 FROM sqlite_master WHERE name = 'products_fts')"
+            ).fetchone()
+            if version < latest:
+                self.migrate(conn)
+                self.fts_enabled = bool(conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'"
+                ).fetchone())
+            else:
+                self.fts_enabled = bool(self.fts_enabled)
+        except Exception as e:
+            # Без миграций бот работал бы на неполной схеме и падал позже — останавливаем запуск
+            logging.error(f"Ошибка инициализации базы данных: {e}")
+            raise
         finally:
+            if conn is not None:
+                self.pool.release(conn)
+    
+    def get_schema_version(self):
+        """Текущая версия схемы (PRAGMA user_version)"""
+        result = self.execute_query('SELECT user_version FROM pragma_user_version')
+        return result[0][0] if result else 0
+    
+    def migrate(self, conn):
+        """Применяет миграции новее user_version, каждую в своей транзакции"""
+        for number, description, method in self.MIGRATIONS:
+            # BEGIN IMMEDIATE сериализует миграции между процессами (бот и веб-админка):
+            # версию перечитываем уже под блокировкой записи
+            conn.execute('BEGIN IMMEDIATE')
             try:
-                conn_alter.close()
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version >= number:
+                    conn.rollback()
+                    continue
+                cursor = conn.cursor()
+                getattr(self, method)(cursor)
+                cursor.execute(f'PRAGMA user_version = {int(number)}')
+                conn.commit()
+                logging.info(f"Миграция {number} применена: {description}")
             except Exception:
-                pass
-
-        """Инициализация базы данных"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Создаем все таблицы
-            self.create_tables(cursor)
-            # Миграция таблицы orders (добаляем недостающие колонки)
-            self._migrate_orders_table(cursor)
-            
-            # Создаем тестовые данные если база пустая
-            if self.is_database_empty(cursor):
-                self.create_test_data(cursor)
-            
-            conn.commit()
-            
-        except Exception as e:
-            logging.info(f"Ошибка инициализации базы данных: {e}")
-            if 'conn' in locals():
                 conn.rollback()
-        finally:
-            if 'conn' in locals():
-                conn.close()
+                logging.error(f"Ошибка миграции {number}: {description}")
+                raise
     
     def create_tables(self, cursor):
         """Создание всех таблиц"""
@@ -540,15 +1045,14 @@ CREATE TABLE IF NOT EXISTS post_statistics (
     FOREIGN KEY (post_id) REFERENCES scheduled_posts (id)
 )
         ''')
-        
-        # Создаем индексы для оптимизации
-        self.create_indexes(cursor)
     
     def create_indexes(self, cursor):
         """Создание индексов для оптимизации"""
         indexes = [
             'CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id)',
             'CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id)',
+            'CREATE INDEX IF NOT EXISTS idx_products_subcategory_name ON products(subcategory_id, name, id)',
+            'CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at, id)',
             'CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)',
             'CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)',
             'CREATE INDEX IF NOT EXISTS idx_cart_user ON cart(user_id)',
@@ -565,6 +1069,349 @@ CREATE TABLE IF NOT EXISTS post_statistics (
             except Exception as e:
                 logging.info(f"Ошибка создания индекса: {e}")
     
+    def _create_report_indexes(self, cursor):
+        """Составные индексы под фильтры отчетов created_at >= ? AND created_at < ?"""
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status_created_at ON orders(status, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items(product_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)')
+        cursor.execute('ANALYZE')
+
+    def _create_change_events(self, cursor):
+        """Таблица change_events и триггеры, фиксирующие изменения каталога и автопостов"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                entity TEXT NOT NULL,
+                entity_id INTEGER,
+                action TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_events_created_at ON change_events(created_at)')
+        # Для товаров учитываем только поля, видимые в каталоге: просмотры, продажи и остатки меняются постоянно
+        watched = {
+            'categories': '',
+            'subcategories': '',
+            'products': ' OF name, description, price, original_price, image_url, is_active, category_id, subcategory_id',
+            'scheduled_posts': ''
+        }
+        for table, update_columns in watched.items():
+            for suffix, event, row, action in (
+                ('ai', 'INSERT', 'new', 'insert'),
+                ('au', f'UPDATE{update_columns}', 'new', 'update'),
+                ('ad', 'DELETE', 'old', 'delete')
+            ):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS change_{table}_{suffix} AFTER {event} ON {table} BEGIN
+                        INSERT INTO change_events (entity, entity_id, action) VALUES ('{table}', {row}.id, '{action}');
+                    END
+                ''')
+
+    def _create_broadcast_jobs(self, cursor):
+        """Задания рассылок и статус доставки по каждому получателю"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT,
+                message_text TEXT NOT NULL,
+                image_url TEXT,
+                reply_markup TEXT,
+                target_audience TEXT NOT NULL,
+                post_id INTEGER,
+                time_period TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                total_count INTEGER DEFAULT 0,
+                sent_count INTEGER DEFAULT 0,
+                error_count INTEGER DEFAULT 0,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                job_id INTEGER NOT NULL,
+                telegram_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                sent_at TIMESTAMP,
+                PRIMARY KEY (job_id, telegram_id),
+                FOREIGN KEY (job_id) REFERENCES broadcast_jobs (id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients(job_id, status, telegram_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs(status)')
+        # Бот узнает о новых заданиях и паузе/отмене через change_events; счетчики прогресса событий не создают
+        for suffix, event in (('ai', 'INSERT'), ('au', 'UPDATE OF status')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS change_broadcast_jobs_{suffix} AFTER {event} ON broadcast_jobs BEGIN
+                    INSERT INTO change_events (entity, entity_id, action) VALUES ('broadcast_jobs', new.id, new.status);
+                END
+            ''')
+
+    def _create_telegram_files(self, cursor):
+        """file_id Telegram по URL изображения или хэшу содержимого локального файла"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS telegram_files (
+                cache_key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT,
+                source TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+    def _create_job_queue(self, cursor):
+        """Задания с арендой: у арендованного run_at — срок аренды, так что готовые ищутся одним индексом"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'queued',
+                run_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 5,
+                lease_owner TEXT,
+                idempotency_key TEXT UNIQUE,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, run_at)')
+
+    def _create_automation_events(self, cursor):
+        """События для правил автоматизации и отметки правил о последнем прогоне"""
+        # Для заказов entity_id — пользователь: правилам нужны клиенты, чьи заказы изменились
+        for suffix, event, action in (('ai', 'INSERT', "'insert'"), ('au', 'UPDATE OF status, total_amount', 'new.status')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS change_orders_{suffix} AFTER {event} ON orders BEGIN
+                    INSERT INTO change_events (entity, entity_id, action) VALUES ('orders', new.user_id, {action});
+                END
+            ''')
+        # Для поступлений на склад entity_id — товар
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS change_inventory_movements_ai AFTER INSERT ON inventory_movements
+            WHEN new.movement_type = 'inbound' BEGIN
+                INSERT INTO change_events (entity, entity_id, action) VALUES ('inventory_movements', new.product_id, 'inbound');
+            END
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS automation_watermarks (
+                rule_id INTEGER PRIMARY KEY,
+                last_event_id INTEGER NOT NULL DEFAULT 0,
+                last_run_at TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cart_created_at ON cart(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_automation_executions_rule_user ON automation_executions(rule_id, user_id, executed_at)')
+
+    def _create_customer_rfm(self, cursor):
+        """Таблица RFM-сегментов и итоги по сегментам; триггеры пересчитывают клиента при изменении его заказов"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customer_rfm (
+                user_id INTEGER PRIMARY KEY,
+                frequency INTEGER NOT NULL DEFAULT 0,
+                monetary REAL NOT NULL DEFAULT 0,
+                last_order_at TIMESTAMP,
+                recency_days REAL,
+                r_score INTEGER,
+                f_score INTEGER,
+                m_score INTEGER,
+                segment TEXT NOT NULL,
+                updated_at TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_rfm_segment ON customer_rfm(segment, monetary DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_rfm_last_order ON customer_rfm(last_order_at)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customer_segments (
+                segment TEXT PRIMARY KEY,
+                customers INTEGER NOT NULL DEFAULT 0,
+                monetary REAL NOT NULL DEFAULT 0
+            )
+        ''')
+
+        # Итоги по сегментам: страница CRM читает несколько строк вместо всех клиентов
+        add_segment = '''
+            INSERT INTO customer_segments (segment, customers, monetary) VALUES (new.segment, 1, new.monetary)
+            ON CONFLICT(segment) DO UPDATE SET customers = customers + 1, monetary = monetary + excluded.monetary;
+        '''
+        remove_segment = '''
+            UPDATE customer_segments SET customers = customers - 1, monetary = monetary - old.monetary
+            WHERE segment = old.segment;
+        '''
+        refresh_user = _RFM_UPSERT.format(source=_RFM_ORDERS_SOURCE.format(where='AND u.id = {user}'))
+        triggers = [
+            f'''CREATE TRIGGER IF NOT EXISTS customer_rfm_ai AFTER INSERT ON customer_rfm BEGIN
+                {add_segment}
+            END''',
+            f'''CREATE TRIGGER IF NOT EXISTS customer_rfm_au AFTER UPDATE OF segment, monetary ON customer_rfm BEGIN
+                {remove_segment}
+                {add_segment}
+            END''',
+            f'''CREATE TRIGGER IF NOT EXISTS customer_rfm_ad AFTER DELETE ON customer_rfm BEGIN
+                {remove_segment}
+            END''',
+            # Заказ создан, сменил статус или сумму, удален — пересчитываем только его клиента
+            f'''CREATE TRIGGER IF NOT EXISTS rfm_orders_ai AFTER INSERT ON orders BEGIN
+                {refresh_user.format(user='new.user_id')};
+            END''',
+            f'''CREATE TRIGGER IF NOT EXISTS rfm_orders_au AFTER UPDATE OF status, total_amount, created_at ON orders BEGIN
+                {refresh_user.format(user='new.user_id')};
+            END''',
+            f'''CREATE TRIGGER IF NOT EXISTS rfm_orders_ad AFTER DELETE ON orders BEGIN
+                {refresh_user.format(user='old.user_id')};
+            END''',
+            # Новый клиент сразу попадает в сегмент 'new'; администраторы в сегменты не входят
+            f'''CREATE TRIGGER IF NOT EXISTS rfm_users_ai AFTER INSERT ON users BEGIN
+                {refresh_user.format(user='new.id')};
+            END''',
+            f'''CREATE TRIGGER IF NOT EXISTS rfm_users_au AFTER UPDATE OF is_admin ON users BEGIN
+                DELETE FROM customer_rfm WHERE user_id = new.id AND new.is_admin != 0;
+                {refresh_user.format(user='new.id')};
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS rfm_users_ad AFTER DELETE ON users BEGIN
+                DELETE FROM customer_rfm WHERE user_id = old.id;
+            END''',
+        ]
+        for trigger_sql in triggers:
+            cursor.execute(trigger_sql)
+        cursor.execute(_RFM_UPSERT.format(source=_RFM_ORDERS_SOURCE.format(where='')))
+
+    def _create_customer_scores(self, cursor):
+        """Оценки оттока и ценности клиентов, пересчитываемые пакетно (customer_scores.py)"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customer_scores (
+                user_id INTEGER PRIMARY KEY,
+                total_orders INTEGER NOT NULL,
+                total_spent REAL NOT NULL,
+                avg_order_value REAL,
+                last_order_at TIMESTAMP,
+                days_since_last_order REAL,
+                churn_score INTEGER NOT NULL,
+                churn_risk TEXT NOT NULL,
+                avg_interval_days REAL,
+                predicted_orders_per_year REAL,
+                predicted_clv REAL,
+                confidence TEXT,
+                scored_at TIMESTAMP NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_scores_last_order ON customer_scores(last_order_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_scores_churn ON customer_scores(churn_risk, predicted_clv DESC)')
+
+    def _create_item_similarity(self, cursor):
+        """Индекс совместных покупок: счетчики пар, top-K соседей товара и отметка обработанных заказов"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS item_counts (
+                product_id INTEGER PRIMARY KEY,
+                order_count INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS item_pairs (
+                product_id INTEGER NOT NULL,
+                other_id INTEGER NOT NULL,
+                pair_count INTEGER NOT NULL,
+                PRIMARY KEY (product_id, other_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS item_neighbors (
+                product_id INTEGER NOT NULL,
+                neighbor_id INTEGER NOT NULL,
+                score REAL NOT NULL,
+                pair_count INTEGER NOT NULL,
+                PRIMARY KEY (product_id, neighbor_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_item_neighbors_score ON item_neighbors(product_id, score DESC)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS item_similarity_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_order_id INTEGER NOT NULL DEFAULT 0,
+                refreshed_at REAL
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO item_similarity_state (id) VALUES (1)')
+
+    def _create_item_excluded_orders(self, cursor):
+        """Заказы до отметки индекса, не учтенные в нем как отмененные; индекс строится заново"""
+        cursor.execute('CREATE TABLE IF NOT EXISTS item_excluded_orders (order_id INTEGER PRIMARY KEY)')
+        # В уже построенном индексе неизвестно, какие заказы были отменены на момент учета
+        for table in ('item_pairs', 'item_counts', 'item_neighbors'):
+            cursor.execute(f'DELETE FROM {table}')
+        cursor.execute('UPDATE item_similarity_state SET last_order_id = 0, refreshed_at = NULL WHERE id = 1')
+
+    def _create_customer_list_index(self, cursor):
+        """Список клиентов в админке листается по (monetary, user_id) из customer_rfm"""
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_rfm_monetary ON customer_rfm(monetary)')
+
+    def _create_search_index(self, cursor):
+        """Полнотекстовый индекс FTS5 по товарам с триггерами синхронизации"""
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                    name, description, category, subcategory,
+                    tokenize = "unicode61 remove_diacritics 2 separators 'ʻʼ’‘`'"
+                )
+            ''')
+        except sqlite3.Error as e:
+            logging.info(f"FTS5 недоступен, поиск через LIKE: {e}")
+            return False
+
+        # Строка индекса для товара: название, описание, названия категории и подкатегории
+        fts_row = '''
+            INSERT INTO products_fts (rowid, name, description, category, subcategory)
+            SELECT p.id, p.name, IFNULL(p.description, ''),
+                   IFNULL((SELECT name FROM categories WHERE id = p.category_id), ''),
+                   IFNULL((SELECT name FROM subcategories WHERE id = p.subcategory_id), '')
+            FROM products p
+        '''
+        triggers = [
+            f'''CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+                {fts_row} WHERE p.id = new.id;
+            END''',
+            f'''CREATE TRIGGER IF NOT EXISTS products_fts_au
+                AFTER UPDATE OF name, description, category_id, subcategory_id ON products BEGIN
+                DELETE FROM products_fts WHERE rowid = old.id;
+                {fts_row} WHERE p.id = new.id;
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+                DELETE FROM products_fts WHERE rowid = old.id;
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS categories_fts_au AFTER UPDATE OF name ON categories BEGIN
+                UPDATE products_fts SET category = new.name
+                WHERE rowid IN (SELECT id FROM products WHERE category_id = new.id);
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS subcategories_fts_au AFTER UPDATE OF name ON subcategories BEGIN
+                UPDATE products_fts SET subcategory = new.name
+                WHERE rowid IN (SELECT id FROM products WHERE subcategory_id = new.id);
+            END'''
+        ]
+        for trigger_sql in triggers:
+            cursor.execute(trigger_sql)
+
+        # BM25: совпадение в названии важнее категории, категория важнее описания
+        cursor.execute("INSERT INTO products_fts (products_fts, rank) VALUES ('rank', 'bm25(10.0, 2.0, 4.0, 4.0)')")
+
+        # Первичное наполнение (или восстановление) индекса
+        cursor.execute('SELECT (SELECT COUNT(*) FROM products), (SELECT COUNT(*) FROM products_fts)')
+        products_count, indexed_count = cursor.fetchone()
+        if products_count != indexed_count:
+            cursor.execute('DELETE FROM products_fts')
+            cursor.execute(fts_row)
+        return True
+
+    def _seed_test_data(self, cursor):
+        """Тестовые данные только для новой (пустой) базы"""
+        if self.is_database_empty(cursor):
+            self.create_test_data(cursor)
+
     def is_database_empty(self, cursor):
         """Проверка пустоты базы данных"""
         cursor.execute('SELECT COUNT(*) FROM categories')
@@ -677,10 +1524,18 @@ CREATE TABLE IF NOT EXISTS post_statistics (
         SELECT -> list[tuple]
         INSERT -> lastrowid (int)
         UPDATE/DELETE -> rowcount (int)
+        Внутри db.transaction() запрос выполняется на соединении транзакции
+        без отдельного commit, а ошибка пробрасывается и откатывает транзакцию.
         """
+        tx_conn = getattr(self._local, 'conn', None)
+        context = getattr(self._local, 'update_context', None)
+        conn = None
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = tx_conn or self.pool.acquire()
             cursor = conn.cursor()
+            started = time.perf_counter()
+            if context is not None:
+                context.queries += 1
             if params:
                 cursor.execute(query, params)
             else:
@@ -688,27 +1543,274 @@ CREATE TABLE IF NOT EXISTS post_statistics (
             q = query.strip().upper()
             if q.startswith('SELECT'):
                 result = cursor.fetchall()
+                rows = len(result)
             else:
-                conn.commit()
+                if tx_conn is None:
+                    conn.commit()
+                if context is not None:
+                    self._invalidate_update_context(context, q)
                 op = q.split()[0]
                 if op == 'INSERT':
                     result = cursor.lastrowid
                 else:
                     result = cursor.rowcount
+                rows = max(cursor.rowcount, 0)
+            self.query_stats.record(query, time.perf_counter() - started, rows, conn, params)
             return result
         except Exception as e:
             logging.info(f"Ошибка выполнения запроса: {e}")
+            if tx_conn is not None:
+                raise
+            return None
+        finally:
+            if conn is not None and tx_conn is None:
+                self.pool.release(conn)
+
+    def execute_many(self, query, seq_of_params):
+        """Пакетное выполнение запроса (executemany), возвращает rowcount"""
+        tx_conn = getattr(self._local, 'conn', None)
+        conn = None
+        try:
+            conn = tx_conn or self.pool.acquire()
+            started = time.perf_counter()
+            cursor = conn.executemany(query, seq_of_params)
+            if tx_conn is None:
+                conn.commit()
+            self.query_stats.record(query, time.perf_counter() - started, max(cursor.rowcount, 0))
+            return cursor.rowcount
+        except Exception as e:
+            logging.info(f"Ошибка пакетного выполнения запроса: {e}")
+            if tx_conn is not None:
+                raise
+            return None
+        finally:
+            if conn is not None and tx_conn is None:
+                self.pool.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Единица работы: все запросы внутри блока фиксируются одним commit.
+
+        with db.transaction():
+            order_id = db.create_order(...)
+            db.add_order_items(order_id, items)
+
+        Вложенные блоки присоединяются к внешней транзакции.
+        """
+        if getattr(self._local, 'conn', None) is not None:
+            yield self._local.conn
+            return
+
+        conn = self.pool.acquire()
+        self._local.conn = conn
+        try:
+            # Сразу берем блокировку записи, чтобы не упереться в SQLITE_BUSY при повышении
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception as e:
+                logging.info(f"Ошибка отката транзакции: {e}")
+            raise
+        finally:
+            self._local.conn = None
+            self.pool.release(conn)
+
+    def paginate(self, query, params=(), order_by=(('id', 'DESC'),), limit=20, cursor=None, offset=0):
+        """Keyset-пагинация (seek) по произвольному SELECT.
+
+        query — запрос без ORDER BY/LIMIT, order_by — колонки его результата
+        с общим направлением, последняя должна быть уникальной (обычно id).
+        Возвращает {'rows', 'next_cursor', 'prev_cursor'}; курсор — непрозрачный токен.
+        offset используется только для перехода на произвольную страницу без курсора.
+        """
+        directions = {direction.upper() for _, direction in order_by}
+        if len(directions) != 1 or not directions <= {'ASC', 'DESC'}:
+            raise ValueError("Keyset-пагинация требует одного направления сортировки")
+        columns = [column for column, _ in order_by]
+
+        state = decode_cursor(cursor)
+        backwards = bool(state and state['d'] == 'p')
+        scan_desc = (directions.pop() == 'DESC') != backwards
+
+        key_list = ', '.join(columns)
+        sql = f'SELECT page.*, {key_list} FROM ({query}) AS page'
+        args = list(params or ())
+        if state:
+            op = '<' if scan_desc else '>'
+            sql += f" WHERE ({key_list}) {op} ({', '.join('?' * len(columns))})"
+            args.extend(state['k'])
+        scan = 'DESC' if scan_desc else 'ASC'
+        sql += ' ORDER BY ' + ', '.join(f'{column} {scan}' for column in columns) + ' LIMIT ?'
+        args.append(limit + 1)
+        if not state and offset:
+            sql += ' OFFSET ?'
+            args.append(offset)
+
+        rows = self.execute_query(sql, tuple(args)) or []
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+
+        width = len(columns)
+        keys = [list(row[-width:]) for row in rows]
+        rows = [tuple(row[:-width]) for row in rows]
+
+        has_next = has_more if not backwards else True
+        has_prev = has_more if backwards else bool(state or offset)
+        return {
+            'rows': rows,
+            'next_cursor': encode_cursor('n', keys[-1]) if rows and has_next else None,
+            'prev_cursor': encode_cursor('p', keys[0]) if rows and has_prev else None
+        }
+
+    def count_cached(self, query, params=(), ttl=30):
+        """COUNT(*) с кэшированием на ttl секунд (для подсчета страниц)"""
+        key = (query, tuple(params or ()))
+        now = time.monotonic()
+        with self._count_lock:
+            cached = self._count_cache.get(key)
+            if cached and now - cached[1] < ttl:
+                return cached[0]
+        result = self.execute_query(query, tuple(params or ()))
+        total = result[0][0] if result else 0
+        with self._count_lock:
+            if len(self._count_cache) > 256:
+                self._count_cache.clear()
+            self._count_cache[key] = (total, now)
+        return total
+
+    def checkpoint(self, mode='PASSIVE'):
+        """Перенос WAL-журнала в основной файл базы (PASSIVE, FULL, RESTART, TRUNCATE)"""
+        if mode.upper() not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+            raise ValueError(f"Неизвестный режим checkpoint: {mode}")
+        conn = None
+        try:
+            conn = self.pool.acquire()
+            return conn.execute(f'PRAGMA wal_checkpoint({mode.upper()})').fetchone()
+        except Exception as e:
+            logging.info(f"Ошибка checkpoint WAL: {e}")
             return None
         finally:
-            if 'conn' in locals():
-                conn.close()
+            if conn is not None:
+                self.pool.release(conn)
+
+    def refresh_customer_rfm(self, full=False):
+        """Ночной пересчет RFM: давность и сегменты стареют без новых заказов.
+        full=True пересобирает таблицу из заказов. Возвращает число клиентов"""
+        if full:
+            source = _RFM_ORDERS_SOURCE.format(where='')
+        else:
+            source = 'SELECT user_id, frequency, monetary, last_order_at FROM customer_rfm WHERE frequency > 0'
+        with self.transaction():
+            if full:
+                self.execute_query('''
+                    DELETE FROM customer_rfm
+                    WHERE user_id NOT IN (SELECT id FROM users WHERE is_admin = 0)
+                ''')
+            self.execute_query(_RFM_UPSERT.format(source=source))
+            # Итоги по сегментам собираем заново: накопленная погрешность сумм не растет
+            self.execute_query('DELETE FROM customer_segments')
+            self.execute_query('''
+                INSERT INTO customer_segments (segment, customers, monetary)
+                SELECT segment, COUNT(*), SUM(monetary) FROM customer_rfm GROUP BY segment
+            ''')
+            rows = self.execute_query('SELECT COUNT(*) FROM customer_rfm')
+        return rows[0][0]
+
+    def load_update_context(self, telegram_id):
+        """Пользователь и сводка его корзины одним запросом"""
+        rows = self.execute_query('''
+            SELECT u.*,
+                   (SELECT IFNULL(SUM(c.quantity), 0)
+                    FROM cart c JOIN products p ON p.id = c.product_id
+                    WHERE c.user_id = u.id),
+                   (SELECT IFNULL(SUM(c.quantity * p.price), 0)
+                    FROM cart c JOIN products p ON p.id = c.product_id
+                    WHERE c.user_id = u.id)
+            FROM users u
+            WHERE u.telegram_id = ?
+        ''', (telegram_id,))
+        if not rows:
+            return UpdateContext(telegram_id)
+        row = rows[0]
+        return UpdateContext(telegram_id, tuple(row[:-2]), row[-2], row[-1])
+
+    @contextmanager
+    def update_context(self, telegram_id):
+        """Контекст одного update: повторные get_user_by_telegram_id в этом потоке берутся из него
+
+        with db.update_context(telegram_id) as context:
+            handler.handle_message(message)
+        """
+        context = self.load_update_context(telegram_id) if telegram_id else UpdateContext(None)
+        previous = getattr(self._local, 'update_context', None)
+        self._local.update_context = context
+        try:
+            yield context
+        finally:
+            self._local.update_context = previous
+            self.update_stats['updates'] += 1
+            self.update_stats['queries'] += context.queries
+            self.update_stats['max_queries'] = max(self.update_stats['max_queries'], context.queries)
+
+    def current_context(self):
+        """Контекст update, обрабатываемого в текущем потоке (или None)"""
+        return getattr(self._local, 'update_context', None)
+
+    def _invalidate_update_context(self, context, query_upper):
+        """Сброс закэшированных данных после записи в users/cart в рамках update"""
+        if re.search(r'\bUSERS\b', query_upper):
+            context.user_stale = True
+        if re.search(r'\bCART\b', query_upper):
+            context.cart_stale = True
+
+    def get_cart_summary(self, user_id):
+        """(количество товаров, сумма) корзины; внутри update — из контекста"""
+        context = self.current_context()
+        if context is not None and context.user_id == user_id and not context.cart_stale:
+            return context.cart_items, context.cart_total
+        result = self.execute_query('''
+            SELECT IFNULL(SUM(c.quantity), 0), IFNULL(SUM(c.quantity * p.price), 0)
+            FROM cart c JOIN products p ON p.id = c.product_id
+            WHERE c.user_id = ?
+        ''', (user_id,))
+        summary = tuple(result[0]) if result else (0, 0)
+        if context is not None and context.user_id == user_id:
+            context.cart_items, context.cart_total = summary
+            context.cart_stale = False
+        return summary
+
+    def get_update_stats(self):
+        """Среднее и максимальное число SQL-запросов на update"""
+        stats = dict(self.update_stats)
+        stats['queries_per_update'] = round(stats['queries'] / stats['updates'], 2) if stats['updates'] else 0
+        return stats
+
+    def get_query_stats(self, limit=20):
+        """Статистика запросов: count/p50/p99/rows по отпечаткам и последние медленные запросы"""
+        return self.query_stats.snapshot(limit=limit)
+
+    def get_pool_stats(self):
+        """Статистика пула соединений"""
+        return self.pool.get_stats()
 
     def get_user_by_telegram_id(self, telegram_id):
-        """Получение пользователя по telegram_id"""
-        return self.execute_query(
+        """Получение пользователя по telegram_id (внутри update_context — без запроса к БД)"""
+        context = self.current_context()
+        if context is not None and context.telegram_id == telegram_id and not context.user_stale:
+            return [context.user] if context.user else []
+        result = self.execute_query(
             'SELECT * FROM users WHERE telegram_id = ?',
             (telegram_id,)
         )
+        if context is not None and context.telegram_id == telegram_id and result is not None:
+            context.user = tuple(result[0]) if result else None
+            context.user_stale = False
+        return result
     
     def add_user(self, telegram_id, name, phone=None, email=None, language='ru'):
         """Добавление нового пользователя"""
@@ -754,12 +1856,21 @@ CREATE TABLE IF NOT EXISTS post_statistics (
         
         return subcategories
     
-    def get_products_by_subcategory(self, subcategory_id, limit=10, offset=0):
-        """Получение товаров по подкатегории"""
+    def get_products_by_subcategory(self, subcategory_id, limit=10, offset=0, after=None):
+        """Получение товаров по подкатегории (after — keyset-курсор: (name, id) последнего показанного товара)"""
+        if after:
+            after_name, after_id = after
+            return self.execute_query('''
+                SELECT * FROM products 
+                WHERE subcategory_id = ? AND is_active = 1
+                  AND (name, id) > (?, ?)
+                ORDER BY name, id 
+                LIMIT ?
+            ''', (subcategory_id, after_name, after_id, limit))
         return self.execute_query('''
             SELECT * FROM products 
             WHERE subcategory_id = ? AND is_active = 1 
-            ORDER BY name 
+            ORDER BY name, id 
             LIMIT ? OFFSET ?
         ''', (subcategory_id, limit, offset))
     
@@ -835,13 +1946,13 @@ CREATE TABLE IF NOT EXISTS post_statistics (
             # основной вариант (таблица cart)
             self.execute_query('DELETE FROM cart WHERE user_id = ?', (user_id,))
             # на всякий случай, если используется cart_items
-            try:
+            if self.execute_query("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cart_items'"):
                 self.execute_query('DELETE FROM cart_items WHERE user_id = ?', (user_id,))
-            except Exception:
-                pass
             return 1
         except Exception as e:
             logging.info(f"Ошибка очистки корзины: {e}")
+            if getattr(self._local, 'conn', None) is not None:
+                raise
             return None
 
     def create_order(self, user_id, total_amount, delivery_address, payment_method, latitude=None, longitude=None):
@@ -852,11 +1963,10 @@ CREATE TABLE IF NOT EXISTS post_statistics (
     
     def add_order_items(self, order_id, cart_items):
         """Добавление товаров в заказ"""
-        for item in cart_items:
-            self.execute_query('''
-                INSERT INTO order_items (order_id, product_id, quantity, price)
-                VALUES (?, ?, ?, ?)
-            ''', (order_id, item[5], item[3], item[2]))  # product_id, quantity, price
+        return self.execute_many('''
+            INSERT INTO order_items (order_id, product_id, quantity, price)
+            VALUES (?, ?, ?, ?)
+        ''', [(order_id, item[5], item[3], item[2]) for item in cart_items])  # product_id, quantity, price
     
     def get_user_orders(self, user_id):
         """Получение заказов пользователя"""
@@ -895,7 +2005,18 @@ CREATE TABLE IF NOT EXISTS post_statistics (
         )
     
     def search_products(self, query, limit=10):
-        """Поиск товаров"""
+        """Поиск товаров (FTS5, ранжирование BM25, префиксы, кириллица/латиница)"""
+        match = build_search_query(query)
+        if not match:
+            return []
+        if self.fts_enabled:
+            return self.execute_query('''
+                SELECT p.* FROM products_fts
+                JOIN products p ON p.id = products_fts.rowid
+                WHERE products_fts MATCH ? AND p.is_active = 1
+                ORDER BY products_fts.rank
+                LIMIT ?
+            ''', (match, limit))
         return self.execute_query('''
             SELECT * FROM products 
             WHERE (name LIKE ? OR description LIKE ?) AND is_active = 1
@@ -1043,24 +2164,35 @@ CREATE TABLE IF NOT EXISTS post_statistics (
         )
 
 
-    def _migrate_orders_table(self, cursor):
-        """Добавляет в таблицу orders недостающие колонки, если их нет (совместимость со старыми БД)."""
-        try:
-            cursor.execute("PRAGMA table_info(orders)")
-            cols = [row[1] for row in cursor.fetchall()]
-            # Обязательные поля новой схемы
-            want = [
+    def _migrate_legacy_columns(self, cursor):
+        """Добавляет колонки, которых нет в базах, созданных старыми версиями схемы"""
+        wanted = {
+            'users': [
+                ("role", "TEXT"),
+                ("created_at", "TIMESTAMP")
+            ],
+            'orders': [
                 ("payment_method", "TEXT"),
                 ("payment_status", "TEXT DEFAULT 'pending'"),
                 ("promo_discount", "REAL DEFAULT 0"),
                 ("delivery_cost", "REAL DEFAULT 0"),
-                ("created_at", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+                # SQLite не добавляет колонку с DEFAULT CURRENT_TIMESTAMP в непустую таблицу:
+                # добавляем без значения по умолчанию и заполняем существующие строки
+                ("created_at", "TIMESTAMP")
             ]
-            for col, ddl in want:
-                if col not in cols:
-                    cursor.execute(f"ALTER TABLE orders ADD COLUMN {col} {ddl}")
-        except Exception as e:
-            logging.info(f"orders migrate warn: {e}")
+        }
+        backfill = {
+            (table, 'created_at'): f"UPDATE {table} SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL"
+            for table in wanted
+        }
+        for table, columns in wanted.items():
+            cursor.execute(f"PRAGMA table_info({table})")
+            existing = {row[1] for row in cursor.fetchall()}
+            for col, ddl in columns:
+                if col not in existing:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {col} {ddl}")
+                    if (table, col) in backfill:
+                        cursor.execute(backfill[(table, col)])
 
     def update_user_phone_by_telegram_id(self, telegram_id, phone):
         """Обновляет номер телефона пользователя по telegram_id"""
@@ -42,15 +42,17 @@ class DatabaseBackup:
         backup_path = os.path.join(self.backup_dir, backup_filename)
         
         try:
-            # Создаем резервную копию с блокировкой
+            # Онлайн-бэкап SQLite: согласованный снимок вместе с еще не перенесенными
+            # из -wal страницами, без ручного копирования файла под записью
             source_conn = sqlite3.connect(self.db_path)
-            source_conn.execute('BEGIN IMMEDIATE;')
-            
-            # Копируем базу данных
-            shutil.copy2(self.db_path, backup_path)
-            
-            source_conn.rollback()
-            source_conn.close()
+            backup_conn = sqlite3.connect(backup_path)
+            try:
+                source_conn.backup(backup_conn)
+                # Копия — самостоятельный файл без -wal рядом
+                backup_conn.execute('PRAGMA journal_mode = DELETE').fetchall()
+            finally:
+                backup_conn.close()
+                source_conn.close()
             
             # Сжимаем резервную копию
             compressed_path = f"{backup_path}.gz"
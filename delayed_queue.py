@@ -0,0 +1,70 @@
+"""
+Очередь с отложенной выдачей
+
+Элементы хранятся в куче по времени готовности; get() спит на условной
+переменной до ближайшего срока, а не перебирает очередь по кругу.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class DelayedQueue:
+    """Потокобезопасная очередь: элемент выдается не раньше своего срока"""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def put(self, item, delay=0):
+        due = time.monotonic() + max(0, delay)
+        with self._cond:
+            seq = next(self._seq)
+            heapq.heappush(self._heap, (due, seq, item))
+            # Остальные потоки и так ждут до срока головы очереди — будим, только если она сменилась
+            if self._heap[0][1] == seq:
+                self._cond.notify()
+
+    def get(self, timeout=None):
+        """(элемент, опоздание в секундах) или None после close()/по таймауту"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self.closed:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    due, _seq, item = heapq.heappop(self._heap)
+                    if self._heap and self._heap[0][0] <= now:
+                        self._cond.notify()  # готов еще один — пусть заберет другой поток
+                    return item, now - due
+                wait = self._heap[0][0] - now if self._heap else None
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._cond.wait(wait)
+            return None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap)
+
+    def get_stats(self):
+        """Глубина очереди, сколько уже просрочено и максимальное опоздание ожидающих"""
+        with self._cond:
+            now = time.monotonic()
+            overdue = [now - due for due, _seq, _item in self._heap if due <= now]
+            return {
+                'depth': len(self._heap),
+                'due': len(overdue),
+                'oldest_due_lag': round(max(overdue), 3) if overdue else 0,
+                'next_in': round(max(0.0, self._heap[0][0] - now), 3) if self._heap else None,
+            }
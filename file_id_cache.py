@@ -0,0 +1,168 @@
+"""
+Кэш file_id изображений, уже загруженных в Telegram
+
+После первой успешной отправки фото Telegram возвращает file_id, по которому
+то же изображение можно отправлять без повторной загрузки. Ключ кэша — URL
+изображения, а для локальных файлов — SHA-256 содержимого (замена файла
+под тем же именем дает новый ключ).
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from urllib.parse import unquote, urlparse
+
+# Ответы Telegram, после которых сохраненный file_id больше не годится
+INVALID_FILE_ID_ERRORS = ('wrong file identifier', 'file_id', 'wrong remote file', 'file reference')
+
+
+def photo_file_id(result):
+    """file_id и file_unique_id самого большого размера фото из ответа sendPhoto"""
+    try:
+        photo = result['result']['photo'][-1]
+        return photo['file_id'], photo.get('file_unique_id')
+    except (KeyError, IndexError, TypeError):
+        return None, None
+
+
+def is_invalid_file_id(result):
+    description = str((result or {}).get('description', '')).lower()
+    return any(marker in description for marker in INVALID_FILE_ID_ERRORS)
+
+
+def is_private_url(url):
+    """Путь без схемы или адрес локальной сети: Telegram сам его не скачает"""
+    try:
+        p = urlparse(url)
+        host = (p.hostname or "").lower()
+        if not p.scheme:
+            return True
+        if host in ("localhost", "127.0.0.1"):
+            return True
+        if host.startswith("192.168.") or host.startswith("10."):
+            return True
+        if host.startswith("172."):
+            parts = host.split(".")
+            try:
+                second = int(parts[1])
+                if 16 <= second <= 31:
+                    return True
+            except Exception:
+                pass
+        return False
+    except Exception:
+        return True
+
+
+def local_photo_path(url_or_path):
+    """Преобразует URL вида http://<lan>/static/uploads/xxx.png в локальный путь web_admin/static/uploads/xxx.png"""
+    if not url_or_path:
+        return None
+    # If already an existing file path
+    if os.path.exists(url_or_path):
+        return url_or_path
+    try:
+        p = urlparse(url_or_path)
+        path = p.path if p.scheme else url_or_path
+        path = unquote(path.lstrip("/"))
+    except Exception:
+        path = url_or_path.lstrip("/")
+    # Candidates
+    here = os.path.dirname(os.path.abspath(__file__))
+    candidates = [
+        os.path.join(here, "web_admin", path),
+        os.path.join(here, path),
+        os.path.join(os.path.dirname(here), path),
+    ]
+    for c in candidates:
+        c = os.path.normpath(c)
+        if os.path.exists(c):
+            return c
+    return None
+
+
+class FileIdCache:
+    """file_id по ключу: память процесса поверх таблицы telegram_files"""
+
+    def __init__(self, db):
+        self.db = db
+        self._memory = {}
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'invalidated': 0}
+
+    def key_for(self, source, local_path=None):
+        """Ключ кэша: хэш содержимого локального файла или сам URL"""
+        if local_path:
+            digest = self._file_hash(local_path)
+            if digest:
+                return f"sha256:{digest}"
+        return str(source)
+
+    def photo_key(self, photo_url):
+        """Ключ кэша фото для бота и веб-панели: хэш локального/приватного файла или URL"""
+        source = str(photo_url)
+        is_http = source.lower().startswith(("http://", "https://"))
+        local_path = local_photo_path(source) if (not is_http or is_private_url(source)) else None
+        return self.key_for(source, local_path)
+
+    def _file_hash(self, path):
+        """SHA-256 файла, пересчитывается только при изменении mtime/размера"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        self._hashes[path] = (signature, digest.hexdigest())
+        return self._hashes[path][1]
+
+    def get(self, key):
+        file_id = self._memory.get(key)
+        if file_id is None:
+            rows = self.db.execute_query('SELECT file_id FROM telegram_files WHERE cache_key = ?', (key,))
+            if rows:
+                file_id = self._memory[key] = rows[0][0]
+        with self._lock:
+            self.stats['hits' if file_id else 'misses'] += 1
+        return file_id
+
+    def put(self, key, file_id, file_unique_id=None, source=None):
+        if not file_id or self._memory.get(key) == file_id:
+            return
+        self._memory[key] = file_id
+        self.db.execute_query('''
+            INSERT INTO telegram_files (cache_key, file_id, file_unique_id, source)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET
+                file_id = excluded.file_id, file_unique_id = excluded.file_unique_id, created_at = CURRENT_TIMESTAMP
+        ''', (key, file_id, file_unique_id, source))
+        with self._lock:
+            self.stats['stored'] += 1
+
+    def remember(self, key, result, source=None):
+        """Сохранить file_id из успешного ответа sendPhoto"""
+        file_id, file_unique_id = photo_file_id(result)
+        if file_id:
+            self.put(key, file_id, file_unique_id, source)
+        return file_id
+
+    def invalidate(self, key):
+        self._memory.pop(key, None)
+        self.db.execute_query('DELETE FROM telegram_files WHERE cache_key = ?', (key,))
+        with self._lock:
+            self.stats['invalidated'] += 1
+        logging.info(f"file_id для {key} устарел и удален из кэша")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['cached'] = len(self._memory)
+        return stats
@@ -4,6 +4,7 @@
 
 from datetime import datetime, timedelta
 from utils import format_price
+from database import day_range
 
 class FinancialReportsManager:
     def __init__(self, db):
@@ -26,9 +27,9 @@ class FinancialReportsManager:
                 COUNT(*) as orders_count,
                 SUM(delivery_cost) as delivery_revenue
             FROM orders 
-            WHERE DATE(created_at) BETWEEN ? AND ?
+            WHERE created_at >= ? AND created_at < ?
             AND status IN ('confirmed', 'shipped', 'delivered')
-        ''', (start_date, end_date))
+        ''', day_range(start_date, end_date))
         
         # Себестоимость товаров
         cogs_data = self.db.execute_query('''
@@ -36,9 +37,9 @@ class FinancialReportsManager:
             FROM order_items oi
             JOIN products p ON oi.product_id = p.id
             JOIN orders o ON oi.order_id = o.id
-            WHERE DATE(o.created_at) BETWEEN ? AND ?
+            WHERE o.created_at >= ? AND o.created_at < ?
             AND o.status IN ('confirmed', 'shipped', 'delivered')
-        ''', (start_date, end_date))
+        ''', day_range(start_date, end_date))
         
         # Операционные расходы
         expenses_data = self.db.execute_query('''
@@ -92,11 +93,11 @@ class FinancialReportsManager:
                 DATE(created_at) as date,
                 SUM(total_amount - COALESCE(promo_discount, 0)) as daily_revenue
             FROM orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+            WHERE created_at >= ? AND created_at < ?
             AND payment_status = 'paid'
             GROUP BY DATE(created_at)
             ORDER BY date
-        ''', (start_date, end_date))
+        ''', day_range(start_date, end_date))
         
         # Расходы
         cash_outflows = self.db.execute_query('''
@@ -115,11 +116,11 @@ class FinancialReportsManager:
                 DATE(created_at) as date,
                 SUM(total_amount) as daily_purchases
             FROM purchase_orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+            WHERE created_at >= ? AND created_at < ?
             AND status = 'paid'
             GROUP BY DATE(created_at)
             ORDER BY date
-        ''', (start_date, end_date))
+        ''', day_range(start_date, end_date))
         
         # Объединяем данные по дням
         daily_cash_flow = {}
@@ -172,9 +173,9 @@ class FinancialReportsManager:
                 SUM(total_amount - COALESCE(promo_discount, 0)) as net_revenue,
                 SUM(total_amount - COALESCE(promo_discount, 0)) * ? as vat_amount
             FROM orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+            WHERE created_at >= ? AND created_at < ?
             AND status IN ('confirmed', 'shipped', 'delivered')
-        ''', (self.tax_rate, start_date, end_date))
+        ''', (self.tax_rate, *day_range(start_date, end_date)))
         
         # Расходы, уменьшающие налогооблагаемую базу
         deductible_expenses = self.db.execute_query('''
@@ -351,9 +352,9 @@ class FinancialReportsManager:
                     o.status
                 FROM orders o
                 JOIN users u ON o.user_id = u.id
-                WHERE DATE(o.created_at) BETWEEN ? AND ?
+                WHERE o.created_at >= ? AND o.created_at < ?
                 ORDER BY o.created_at DESC
-            ''', (start_date, end_date))
+            ''', day_range(start_date, end_date))
             
             writer.writerow(['Order ID', 'Date', 'Customer', 'Amount', 'Discount', 'Payment Method', 'Status'])
             for transaction in transactions:
@@ -377,11 +378,11 @@ class FinancialReportsManager:
                 FROM products p
                 LEFT JOIN order_items oi ON p.id = oi.product_id
                 LEFT JOIN orders o ON oi.order_id = o.id 
-                    AND DATE(o.created_at) BETWEEN ? AND ?
+                    AND o.created_at >= ? AND o.created_at < ?
                     AND o.status != 'cancelled'
                 GROUP BY p.id, p.name, p.stock, p.views
                 ORDER BY profit DESC
-            ''', (start_date, end_date))
+            ''', day_range(start_date, end_date))
             
             writer.writerow(['Product', 'Units Sold', 'Revenue', 'Cost', 'Profit', 'Stock', 'Views'])
             for product in products:
@@ -408,7 +409,7 @@ class FinancialReportsManager:
         
         new_customers = self.db.execute_query('''
             SELECT COUNT(*) FROM users
-            WHERE DATE(created_at) >= ?
+            WHERE created_at >= ?
             AND is_admin = 0
         ''', (start_date.strftime('%Y-%m-%d'),))[0][0]
         
@@ -440,16 +441,13 @@ class FinancialReportsManager:
         # Churn Rate (отток клиентов)
         active_customers_30_days_ago = self.db.execute_query('''
             SELECT COUNT(DISTINCT user_id) FROM orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+            WHERE created_at >= ? AND created_at < ?
             AND status != 'cancelled'
-        ''', (
-            (start_date - timedelta(days=30)).strftime('%Y-%m-%d'),
-            start_date.strftime('%Y-%m-%d')
-        ))[0][0]
+        ''', day_range(start_date - timedelta(days=30), start_date))[0][0]
         
         active_customers_now = self.db.execute_query('''
             SELECT COUNT(DISTINCT user_id) FROM orders
-            WHERE DATE(created_at) >= ?
+            WHERE created_at >= ?
             AND status != 'cancelled'
         ''', (start_date.strftime('%Y-%m-%d'),))[0][0]
         
@@ -460,7 +458,7 @@ class FinancialReportsManager:
         mrr = self.db.execute_query('''
             SELECT SUM(total_amount) / 30 as daily_revenue
             FROM orders
-            WHERE DATE(created_at) >= ?
+            WHERE created_at >= ?
             AND status != 'cancelled'
         ''', (start_date.strftime('%Y-%m-%d'),))[0][0] or 0
         
@@ -14,7 +14,7 @@ from keyboards import (
     create_order_details_keyboard, create_language_keyboard,
     create_payment_methods_keyboard, create_cart_item_keyboard
 )
-from keyboards import create_product_inline_keyboard_with_qty
+from keyboards import create_product_inline_keyboard_with_qty, create_catalog_page_keyboard
 from utils import (
     format_price, format_date, validate_email, validate_phone,
     truncate_text, create_pagination_keyboard, escape_html,
@@ -22,6 +22,10 @@ from utils import (
     get_order_status_text, create_product_card, create_stars_display
 )
 from localization import t, get_user_language
+from config import PAGINATION, RECOMMENDATIONS_CONFIG
+from database import decode_cursor
+from catalog_index import CatalogIndex
+from item_similarity import ItemSimilarityIndex
 from payments import PaymentProcessor, create_payment_keyboard, format_payment_info
 
 logger = logging.getLogger(__name__)
@@ -33,6 +37,9 @@ class MessageHandler:
         self.user_states = {}
         self.notification_manager = None
         self.payment_processor = PaymentProcessor()
+        # Категории и подкатегории для маршрутизации по кнопкам без запросов к БД
+        self.catalog = CatalogIndex(db)
+        self.item_similarity = ItemSimilarityIndex(db)
 
     def _extract_label_name(self, text: str) -> str:
         """Возвращает часть после первого пробела: '🍎 Фрукты' -> 'Фрукты'"""
@@ -45,15 +52,13 @@ class MessageHandler:
         name = self._extract_label_name(text)
         if not name:
             return False
-        rows = self.db.execute_query('SELECT id FROM categories WHERE name = ? AND is_active = 1', (name,))
-        return bool(rows)
+        return self.catalog.category_id(name) is not None
 
     def _is_subcategory_label(self, text: str) -> bool:
         name = self._extract_label_name(text)
         if not name:
             return False
-        rows = self.db.execute_query('SELECT id FROM subcategories WHERE name = ? AND is_active = 1', (name,))
-        return bool(rows)
+        return self.catalog.subcategory_id(name) is not None
 
     
     def handle_message(self, message):
@@ -493,7 +498,7 @@ Biz doimo yordam berishga tayyormiz! 🤝
         """Показ каталога товаров"""
         chat_id = message['chat']['id']
         
-        categories = self.db.get_categories()
+        categories = self.catalog.categories()
         
         if categories:
             catalog_text = "🛍 <b>Каталог товаров</b>\n\nВыберите категорию:"
@@ -509,17 +514,12 @@ Biz doimo yordam berishga tayyormiz! 🤝
         # Извлекаем название категории
         category_name = text.split(' ', 1)[-1].strip()  # Убираем эмодзи
         
-        # Находим категорию в базе
-        category = self.db.execute_query(
-            'SELECT id FROM categories WHERE name = ? AND is_active = 1',
-            (category_name,)
-        )
+        # Находим категорию в индексе каталога
+        category_id = self.catalog.category_id(category_name)
         
-        if category:
-            category_id = category[0][0]
-            
+        if category_id is not None:
             # Получаем подкатегории/бренды
-            subcategories = self.db.get_products_by_category(category_id)
+            subcategories = self.catalog.subcategories(category_id)
             
             if subcategories:
                 subcategory_text = f"📂 <b>{category_name}</b>\n\nВыберите бренд или подкатегорию:"
@@ -547,25 +547,37 @@ Biz doimo yordam berishga tayyormiz! 🤝
         subcategory_name = text.split(' ', 1)[-1].strip()  # Убираем эмодзи
         
         # Находим подкатегорию
-        subcategory = self.db.execute_query(
-            'SELECT id FROM subcategories WHERE name = ? AND is_active = 1',
-            (subcategory_name,)
-        )
+        subcategory_id = self.catalog.subcategory_id(subcategory_name)
         
-        if subcategory:
-            subcategory_id = subcategory[0][0]
-            
+        if subcategory_id is not None:
             # Получаем товары подкатегории
-            products = self.db.get_products_by_subcategory(subcategory_id)
-            
-            if products:
-                products_text = f"🛍 <b>{subcategory_name}</b>\n\nВыберите товар:"
-                self.bot.send_message(chat_id, products_text, create_products_keyboard(products))
-            else:
-                self.bot.send_message(chat_id, f"❌ В подкатегории '{subcategory_name}' пока нет товаров")
+            self.show_subcategory_products(chat_id, subcategory_id, subcategory_name)
         else:
             self.bot.send_message(chat_id, "❌ Подкатегория не найдена")
     
+    def show_subcategory_products(self, chat_id, subcategory_id, subcategory_name, after=None):
+        """Страница товаров подкатегории с inline-кнопкой «Ещё товары»"""
+        per_page = PAGINATION.get('products_per_page', 10)
+        # Берем на один товар больше, чтобы понять, есть ли следующая страница
+        products = self.db.get_products_by_subcategory(subcategory_id, per_page + 1, after=after) or []
+        has_more = len(products) > per_page
+        products = products[:per_page]
+        
+        if not products:
+            if after:
+                self.bot.send_message(chat_id, "✅ Это все товары подкатегории")
+            else:
+                self.bot.send_message(chat_id, f"❌ В подкатегории '{subcategory_name}' пока нет товаров")
+            return
+        
+        products_text = f"🛍 <b>{subcategory_name}</b>\n\nВыберите товар:"
+        self.bot.send_message(chat_id, products_text, create_products_keyboard(products))
+        if has_more:
+            self.bot.send_message(
+                chat_id, "📄 Показаны не все товары",
+                create_catalog_page_keyboard(subcategory_id, products[-1][1], products[-1][0])
+            )
+    
     def handle_product_selection(self, message):
         """Обработка выбора товара"""
         text = message.get('text', '')
@@ -608,6 +620,13 @@ Biz doimo yordam berishga tayyormiz! 🤝
                 stars = create_stars_display(avg_rating)
                 product_card += f"⭐ Рейтинг: {stars} ({avg_rating:.1f}/5, {len(reviews)} отзывов)\n"
 
+            # С этим товаром покупают: соседи из индекса совместных покупок
+            also_bought = self.item_similarity.also_bought(product[0], RECOMMENDATIONS_CONFIG.get('product_page_limit', 3))
+            if also_bought:
+                product_card += "\n🤝 <b>С этим товаром покупают:</b>\n"
+                for item in also_bought:
+                    product_card += f"• {escape_html(item[1])} — {format_price(item[3])}\n"
+
             # Клавиатура
             kb = create_product_inline_keyboard_with_qty(product[0], qty=1, category_id=product[4], subcategory_id=product[5])
 
@@ -747,6 +766,10 @@ Biz doimo yordam berishga tayyormiz! 🤝
         if order_stats[2]:
             profile_text += f"📅 Последний заказ: {format_date(order_stats[2])}\n"
         
+        cart_count, cart_total = self.db.get_cart_summary(user_id)
+        if cart_count:
+            profile_text += f"🛒 В корзине: {cart_count} шт. на {format_price(cart_total)}\n"
+        
         profile_text += f"\n⭐ <b>Программа лояльности:</b>\n"
         profile_text += f"💎 Уровень: {loyalty_data[3]}\n"
         profile_text += f"🏆 Баллов: {loyalty_data[1]}\n\n"
@@ -824,9 +847,10 @@ Biz doimo yordam berishga tayyormiz! 🤝
             return
         
         user_id = user_data[0][0]
-        cart_items = self.db.get_cart_items(user_id)
+        # Сводка корзины уже загружена с пользователем в контексте update
+        cart_count, total_amount = self.db.get_cart_summary(user_id)
         
-        if not cart_items:
+        if not cart_count:
             empty_cart_text = t('empty_cart', language=user_data[0][5])
             self.bot.send_message(chat_id, empty_cart_text)
             return
@@ -848,10 +872,8 @@ Biz doimo yordam berishga tayyormiz! 🤝
 
         
         # Показываем сводку заказа
-        total_amount = calculate_cart_total(cart_items)
-        
         order_summary = "📦 <b>Оформление заказа</b>\n\n"
-        order_summary += f"🛍 Товаров: {len(cart_items)}\n"
+        order_summary += f"🛍 Товаров: {cart_count}\n"
         order_summary += f"💰 Сумма: {format_price(total_amount)}\n\n"
         order_summary += "📍 Введите адрес доставки:"
         
@@ -953,19 +975,20 @@ Biz doimo yordam berishga tayyormiz! 🤝
         order_data = getattr(self, 'order_data', {}).get(telegram_id, {})
         delivery_address = order_data.get('address', 'Не указан')
         
-        order_id = self.db.create_order(user_id, total_amount, delivery_address, payment_method, order_data.get('lat'), order_data.get('lon'))
+        points_earned = int(total_amount * 0.05)  # 5% от суммы
+        
+        # Заказ, позиции, очистка корзины и баллы фиксируются одной транзакцией
+        try:
+            with self.db.transaction():
+                order_id = self.db.create_order(user_id, total_amount, delivery_address, payment_method, order_data.get('lat'), order_data.get('lon'))
+                self.db.add_order_items(order_id, cart_items)
+                self.db.clear_cart(user_id)
+                self.db.update_loyalty_points(user_id, points_earned)
+        except Exception as e:
+            logging.info(f"Ошибка оформления заказа: {e}")
+            order_id = None
         
         if order_id:
-            # Добавляем товары в заказ
-            self.db.add_order_items(order_id, cart_items)
-            
-            # Очищаем корзину
-            self.db.clear_cart(user_id)
-            
-            # Начисляем баллы лояльности
-            points_earned = int(total_amount * 0.05)  # 5% от суммы
-            self.db.update_loyalty_points(user_id, points_earned)
-            
             # Уведомляем клиента
             success_text = f"✅ <b>Заказ #{order_id} оформлен!</b>\n\n"
             success_text += f"💰 Сумма: {format_price(total_amount)}\n"
@@ -1235,14 +1258,12 @@ Biz doimo yordam berishga tayyormiz! 🤝
                     return
 
                 user_id = user_data[0][0]
-                cart_items = self.db.get_cart_items(user_id)
+                cart_count, cart_total = self.db.get_cart_summary(user_id)
 
-                if not cart_items:
+                if not cart_count:
                     self.bot.send_message(chat_id, "❌ Добавьте товары в корзину для применения промокода")
                     return
 
-                cart_total = calculate_cart_total(cart_items)
-
                 # Проверяем промокод
                 from promotions import PromotionManager
                 promo_manager = PromotionManager(self.db)
@@ -1334,9 +1355,8 @@ Biz doimo yordam berishga tayyormiz! 🤝
                         cid = None
                     if cid:
                         # Показ подкатегорий
-                        cat_row = self.db.execute_query('SELECT name FROM categories WHERE id=?', (cid,))
-                        name = cat_row[0][0] if cat_row else ''
-                        subs = self.db.get_products_by_category(cid)
+                        name = self.catalog.category_name(cid) or ''
+                        subs = self.catalog.subcategories(cid)
                         if subs:
                             self.bot.send_message(chat_id, f"📂 <b>{name}</b>\n\nВыберите бренд или подкатегорию:", create_subcategories_keyboard(subs))
                         else:
@@ -1355,16 +1375,23 @@ Biz doimo yordam berishga tayyormiz! 🤝
                         sid = None
                     if sid:
                         # Показ товаров в подкатегории
-                        sub_row = self.db.execute_query('SELECT name FROM subcategories WHERE id=?', (sid,))
-                        subname = sub_row[0][0] if sub_row else 'Подкатегория'
-                        products = self.db.get_products_by_subcategory(sid)
-                        if products:
-                            self.bot.send_message(chat_id, f"🛍 <b>{subname}</b>\n\nВыберите товар:", create_products_keyboard(products))
-                        else:
-                            self.bot.send_message(chat_id, f"❌ В подкатегории '{subname}' пока нет товаров")
+                        subname = self.catalog.subcategory_name(sid) or 'Подкатегория'
+                        self.show_subcategory_products(chat_id, sid, subname)
                     else:
                         msg = {'chat': {'id': chat_id}}
                         self.show_catalog(msg)
+                elif data.startswith('subcat_next_'):
+                    # Следующая страница товаров: subcat_next_{subcategory_id}_{курсор (name, id)}
+                    sid, _, token = data[len('subcat_next_'):].partition('_')
+                    state = decode_cursor(token)
+                    try:
+                        sid = int(sid)
+                        last_name, last_id = state['k']
+                        after = (str(last_name), int(last_id))
+                    except (TypeError, ValueError):
+                        return
+                    subname = self.catalog.subcategory_name(sid) or 'Подкатегория'
+                    self.show_subcategory_products(chat_id, sid, subname, after=after)
                 elif data.startswith('qty_inc_') or data.startswith('qty_dec_'):
                     parts = data.split('_')
                     try:
@@ -2,6 +2,7 @@
 Система мониторинга здоровья бота
 """
 
+import hmac
 import time
 import threading
 import psutil
@@ -20,8 +21,16 @@ class HealthMonitor:
             'last_error': None,
             'database_status': 'unknown',
             'memory_usage': 0,
-            'cpu_usage': 0
+            'cpu_usage': 0,
+            'db_pool': {},
+            'db_queries': {},
+            'db_updates': {},
+            'dispatcher': {},
+            'outbound': {},
+            'push_queue': {},
+            'jobs': {}
         }
+        self.post_routes = {}
         self.start_monitoring()
     
     def start_monitoring(self):
@@ -49,12 +58,32 @@ class HealthMonitor:
         
         # Проверка базы данных
         try:
-            self.db.execute_query('SELECT 1')
-            self.metrics['database_status'] = 'healthy'
+            result = self.db.execute_query('SELECT 1')
+            self.metrics['database_status'] = 'healthy' if result else 'error'
+            if hasattr(self.db, 'get_pool_stats'):
+                self.metrics['db_pool'] = self.db.get_pool_stats()
+            if hasattr(self.db, 'get_query_stats'):
+                self.metrics['db_queries'] = self.db.get_query_stats(limit=10)
+            if hasattr(self.db, 'get_update_stats'):
+                self.metrics['db_updates'] = self.db.get_update_stats()
         except Exception as e:
             self.metrics['database_status'] = 'error'
             logger.error(f"Ошибка базы данных: {e}")
         
+        # Очереди обработки update
+        if hasattr(self.bot, 'dispatcher'):
+            self.metrics['dispatcher'] = self.bot.dispatcher.get_stats()
+        if getattr(self.bot, 'webhook_receiver', None):
+            self.metrics['dispatcher']['webhook'] = self.bot.webhook_receiver.get_stats()
+        if hasattr(self.bot, 'api'):
+            self.metrics['outbound'] = dict(self.bot.api.stats, governor=self.bot.api.governor.get_stats())
+        if hasattr(self.bot, 'notification_manager'):
+            self.metrics['push_queue'] = self.bot.notification_manager.get_push_stats()
+        if hasattr(self.bot, 'jobs'):
+            self.metrics['jobs'] = self.bot.jobs.get_stats()
+        if hasattr(self.bot, 'file_ids'):
+            self.metrics['outbound']['file_ids'] = self.bot.file_ids.get_stats()
+        
         # Время работы
         uptime = time.time() - self.metrics['start_time']
         self.metrics['uptime_hours'] = uptime / 3600
@@ -75,6 +104,11 @@ class HealthMonitor:
         if self.metrics['database_status'] != 'healthy':
             issues.append("Проблемы с базой данных")
         
+        # Проверка пула соединений
+        pool = self.metrics.get('db_pool') or {}
+        if pool and pool.get('in_use', 0) >= pool.get('max_connections', 0):
+            issues.append(f"Пул соединений БД исчерпан: {pool['in_use']}/{pool['max_connections']}")
+        
         # Проверка ошибок
         if self.metrics['errors_count'] > 100:
             issues.append(f"Много ошибок: {self.metrics['errors_count']}")
@@ -127,37 +161,99 @@ class HealthMonitor:
             'cpu_percent': self.metrics['cpu_usage'],
             'messages_processed': self.metrics['messages_processed'],
             'errors_count': self.metrics['errors_count'],
-            'database_status': self.metrics['database_status']
+            'database_status': self.metrics['database_status'],
+            'db_pool': self.metrics['db_pool'],
+            'db_queries': self.get_query_summary(),
+            'db_updates': self.metrics['db_updates'],
+            'dispatcher': self.metrics['dispatcher'],
+            'outbound': self.metrics['outbound'],
+            'push_queue': self.metrics['push_queue'],
+            'jobs': self.metrics['jobs']
+        }
+    
+    def get_query_summary(self):
+        """Счетчики и задержки SQL-запросов без текста запросов и планов (для открытого /health)"""
+        stats = self.metrics['db_queries'] or {}
+        queries = stats.get('queries') or []
+        return {
+            'total_queries': stats.get('total_queries', 0),
+            'fingerprints': stats.get('fingerprints', 0),
+            'slow_query_ms': stats.get('slow_query_ms'),
+            'slow_queries': len(stats.get('slow_queries') or []),
+            'max_p99_ms': max((q['p99_ms'] for q in queries), default=0),
+            'max_ms': max((q['max_ms'] for q in queries), default=0)
         }
     
+    def authorized_for_stats(self, headers):
+        """Полная статистика запросов (SQL и планы) — только с токеном MONITORING_CONFIG['stats_token']"""
+        token = MONITORING_CONFIG.get('stats_token')
+        return bool(token) and hmac.compare_digest(headers.get('X-Stats-Token') or '', token)
+    
+    def add_post_route(self, path, callback):
+        """POST-обработчик на HTTP-сервере мониторинга: callback(headers, body) -> (status, dict)"""
+        self.post_routes[path] = callback
+    
     def create_health_endpoint(self):
         """Создание HTTP endpoint для проверки здоровья"""
-        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
         import json
         
         class HealthHandler(BaseHTTPRequestHandler):
+            disable_nagle_algorithm = True
+            
+            def _send_json(self, status, payload, indent=None):
+                response = json.dumps(payload, indent=indent).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+            
             def do_GET(self):
                 if self.path == '/health':
                     health_status = self.server.health_monitor.get_health_status()
-                    
-                    self.send_response(200 if health_status['status'] == 'healthy' else 503)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    
-                    response = json.dumps(health_status, indent=2)
-                    self.wfile.write(response.encode())
+                    self._send_json(200 if health_status['status'] == 'healthy' else 503, health_status, indent=2)
+                elif self.path == '/query_stats':
+                    monitor = self.server.health_monitor
+                    if monitor.authorized_for_stats(self.headers):
+                        self._send_json(200, monitor.metrics['db_queries'])
+                    else:
+                        self._send_json(403, {'ok': False})
                 else:
                     self.send_response(404)
                     self.end_headers()
             
+            def do_POST(self):
+                callback = self.server.health_monitor.post_routes.get(self.path.split('?', 1)[0])
+                if not callback:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                try:
+                    status, payload = callback(self.headers, body)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки {self.path}: {e}", exc_info=True)
+                    status, payload = 500, {'ok': False}
+                self._send_json(status, payload)
+            
             def log_message(self, format, *args):
                 pass  # Отключаем логи HTTP сервера
         
+        class HealthServer(ThreadingHTTPServer):
+            daemon_threads = True
+            # Telegram открывает до webhook_max_connections соединений одновременно
+            request_queue_size = 128
+        
+        host = MONITORING_CONFIG.get('http_host', '0.0.0.0')
+        port = MONITORING_CONFIG.get('http_port', 8080)
+        
         def start_health_server():
             try:
-                server = HTTPServer(('0.0.0.0', 8080), HealthHandler)
+                server = HealthServer((host, port), HealthHandler)
                 server.health_monitor = self
-                logger.info("Health check сервер запущен на порту 8080")
+                logger.info(f"Health check сервер запущен на порту {port}")
                 server.serve_forever()
             except Exception as e:
                 logger.error(f"Ошибка запуска health check сервера: {e}")
@@ -341,7 +341,7 @@ class InventoryManager:
             FROM inventory_movements im
             JOIN products p ON im.product_id = p.id
             LEFT JOIN suppliers s ON im.supplier_id = s.id
-            WHERE DATE(im.created_at) >= ?
+            WHERE im.created_at >= ?
             ORDER BY im.created_at DESC
         ''', (start_date,))
         
@@ -352,7 +352,7 @@ class InventoryManager:
                 COUNT(*) as count,
                 SUM(ABS(quantity_change)) as total_quantity
             FROM inventory_movements
-            WHERE DATE(created_at) >= ?
+            WHERE created_at >= ?
             GROUP BY movement_type
         ''', (start_date,))
         
@@ -431,7 +431,7 @@ class InventoryManager:
             FROM products p
             LEFT JOIN order_items oi ON p.id = oi.product_id
             LEFT JOIN orders o ON oi.order_id = o.id AND o.status != 'cancelled'
-                AND DATE(o.created_at) >= ?
+                AND o.created_at >= ?
             WHERE p.is_active = 1
             GROUP BY p.id, p.name, p.stock, p.price
             ORDER BY turnover_ratio DESC
@@ -623,7 +623,7 @@ class InventoryManager:
                     COUNT(CASE WHEN po.status = 'completed' THEN 1 END) * 100.0 / COUNT(po.id) as completion_rate
                 FROM suppliers s
                 LEFT JOIN purchase_orders po ON s.id = po.supplier_id
-                    AND DATE(po.created_at) >= ?
+                    AND po.created_at >= ?
                 WHERE s.id = ?
                 GROUP BY s.id, s.name
             ''', (start_date, supplier_id))
@@ -637,7 +637,7 @@ class InventoryManager:
                     COUNT(CASE WHEN po.status = 'completed' THEN 1 END) * 100.0 / COUNT(po.id) as completion_rate
                 FROM suppliers s
                 LEFT JOIN purchase_orders po ON s.id = po.supplier_id
-                    AND DATE(po.created_at) >= ?
+                    AND po.created_at >= ?
                 GROUP BY s.id, s.name
                 ORDER BY total_spent DESC
             ''', (start_date,))
@@ -732,34 +732,33 @@ class InventoryManager:
             AND si.counted_quantity != si.system_quantity
         ''', (session_id,))
         
-        # Применяем корректировки
-        for discrepancy in discrepancies:
-            product_id, name, system_qty, counted_qty, difference = discrepancy
-            
-            # Обновляем остаток
-            self.db.execute_query(
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        # Применяем корректировки и закрываем сессию одной транзакцией
+        with self.db.transaction():
+            self.db.execute_many(
                 'UPDATE products SET stock = ? WHERE id = ?',
-                (counted_qty, product_id)
+                [(d[3], d[0]) for d in discrepancies]
             )
             
-            # Записываем движение
-            self.db.execute_query('''
+            # Записываем движения
+            self.db.execute_many('''
                 INSERT INTO inventory_movements (
                     product_id, movement_type, quantity_change,
                     old_quantity, new_quantity, reason, created_at
                 ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                product_id, 'adjustment', difference,
-                system_qty, counted_qty, f'Инвентаризация #{session_id}',
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            ))
-        
-        # Закрываем сессию
-        self.db.execute_query('''
-            UPDATE stocktaking_sessions 
-            SET status = 'completed', completed_at = ?
-            WHERE id = ?
-        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), session_id))
+            ''', [
+                (product_id, 'adjustment', difference,
+                 system_qty, counted_qty, f'Инвентаризация #{session_id}', now)
+                for product_id, name, system_qty, counted_qty, difference in discrepancies
+            ])
+            
+            # Закрываем сессию
+            self.db.execute_query('''
+                UPDATE stocktaking_sessions 
+                SET status = 'completed', completed_at = ?
+                WHERE id = ?
+            ''', (now, session_id))
         
         return {
             'discrepancies_count': len(discrepancies),
@@ -935,7 +934,7 @@ Email: {order[8]}
                 FROM inventory_movements im
                 JOIN products p ON im.product_id = p.id
                 LEFT JOIN suppliers s ON im.supplier_id = s.id
-                WHERE DATE(im.created_at) >= date('now', '-30 days')
+                WHERE im.created_at >= date('now', '-30 days')
                 ORDER BY im.created_at DESC
             ''')
             
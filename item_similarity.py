@@ -0,0 +1,266 @@
+"""
+Индекс «с этим товаром покупают»
+
+Для каждой пары товаров из одного заказа хранится число совместных заказов
+(item_pairs), для товара — число заказов с ним (item_counts). Из них для каждого
+товара выбираются top_k соседей с нормированной оценкой
+pair_count / sqrt(count_a * count_b) (item_neighbors). Новые заказы дописываются
+по отметке last_order_id, соседи пересчитываются только у товаров из этих
+заказов; раз в сутки соседи пересчитываются у всех товаров, потому что оценка
+зависит и от популярности соседа. Отмененные заказы до отметки хранятся в
+item_excluded_orders: отмена учтенного заказа вычитает его корзину, откат
+отмены возвращает ее. Рекомендации читаются по первичному ключу
+item_neighbors, без соединения истории заказов самой с собой.
+"""
+
+import heapq
+import logging
+import math
+import time
+from collections import Counter, defaultdict
+from itertools import combinations
+
+try:
+    from config import RECOMMENDATIONS_CONFIG
+except Exception:
+    RECOMMENDATIONS_CONFIG = {}
+
+
+class ItemSimilarityIndex:
+    """Разреженный индекс совместных покупок товаров"""
+
+    def __init__(self, db, top_k=None, batch_orders=None):
+        self.db = db
+        self.top_k = top_k or RECOMMENDATIONS_CONFIG.get('top_k', 20)
+        self.batch_orders = batch_orders or RECOMMENDATIONS_CONFIG.get('batch_orders', 5000)
+        self.min_pair_count = RECOMMENDATIONS_CONFIG.get('min_pair_count', 1)
+        self.max_order_items = RECOMMENDATIONS_CONFIG.get('max_order_items', 50)
+        self.update_delay = RECOMMENDATIONS_CONFIG.get('update_delay', 10)
+        self.refresh_interval = RECOMMENDATIONS_CONFIG.get('refresh_hours', 24) * 3600
+        self.jobs = None
+
+    # Построение
+
+    def update(self):
+        """Дописать в индекс новые заказы и учесть отмены; возвращает число обработанных заказов"""
+        processed = self._reconcile()
+        while True:
+            count = self._update_batch()
+            if not count:
+                break
+            processed += count
+        rows = self.db.execute_query('SELECT refreshed_at FROM item_similarity_state WHERE id = 1')
+        refreshed_at = rows[0][0] if rows else None
+        if refreshed_at is None or time.time() - refreshed_at > self.refresh_interval:
+            self.refresh_neighbors()
+        if processed:
+            logging.info(f"Индекс совместных покупок: +{processed} заказов")
+        return processed
+
+    def _update_batch(self):
+        """Пачка заказов после отметки: счетчики, отметка и соседи — одной транзакцией"""
+        with self.db.transaction():
+            last_order_id = self.db.execute_query(
+                'SELECT last_order_id FROM item_similarity_state WHERE id = 1'
+            )[0][0]
+            orders = self.db.execute_query(
+                'SELECT id, status FROM orders WHERE id > ? ORDER BY id LIMIT ?',
+                (last_order_id, self.batch_orders)
+            )
+            if not orders:
+                return 0
+            max_order_id = orders[-1][0]
+            cancelled = [(order_id,) for order_id, status in orders if status == 'cancelled']
+            if cancelled:
+                self.db.execute_many('INSERT OR IGNORE INTO item_excluded_orders (order_id) VALUES (?)', cancelled)
+            items = self.db.execute_query('''
+                SELECT DISTINCT oi.order_id, oi.product_id
+                FROM order_items oi
+                JOIN orders o ON o.id = oi.order_id
+                WHERE oi.order_id > ? AND oi.order_id <= ? AND o.status != 'cancelled'
+            ''', (last_order_id, max_order_id)) or []
+            product_ids = self._count(items, 1)
+            self.db.execute_query(
+                'UPDATE item_similarity_state SET last_order_id = ? WHERE id = 1', (max_order_id,)
+            )
+            self._write_neighbors(product_ids)
+        return len(orders)
+
+    def _reconcile(self):
+        """Смена статуса учтенных заказов: отмененные вычитаются, восстановленные возвращаются"""
+        with self.db.transaction():
+            last_order_id = self.db.execute_query(
+                'SELECT last_order_id FROM item_similarity_state WHERE id = 1'
+            )[0][0]
+            cancelled = [row[0] for row in self.db.execute_query('''
+                SELECT o.id FROM orders o
+                WHERE o.status = 'cancelled' AND o.id <= ?
+                AND NOT EXISTS (SELECT 1 FROM item_excluded_orders e WHERE e.order_id = o.id)
+            ''', (last_order_id,)) or []]
+            restored = [row[0] for row in self.db.execute_query('''
+                SELECT e.order_id FROM item_excluded_orders e
+                JOIN orders o ON o.id = e.order_id
+                WHERE o.status != 'cancelled'
+            ''') or []]
+            if not cancelled and not restored:
+                return 0
+            product_ids = set(self._count(self._order_items(cancelled), -1))
+            product_ids.update(self._count(self._order_items(restored), 1))
+            if cancelled:
+                self.db.execute_many('INSERT INTO item_excluded_orders (order_id) VALUES (?)',
+                                     [(order_id,) for order_id in cancelled])
+            if restored:
+                self.db.execute_many('DELETE FROM item_excluded_orders WHERE order_id = ?',
+                                     [(order_id,) for order_id in restored])
+            self.db.execute_query('DELETE FROM item_counts WHERE order_count <= 0')
+            self.db.execute_query('DELETE FROM item_pairs WHERE pair_count <= 0')
+            self._write_neighbors(sorted(product_ids))
+        logging.info(f"Индекс совместных покупок: отменено {len(cancelled)}, восстановлено {len(restored)} заказов")
+        return len(cancelled) + len(restored)
+
+    def _order_items(self, order_ids, chunk=500):
+        items = []
+        for start in range(0, len(order_ids), chunk):
+            ids = order_ids[start:start + chunk]
+            items += self.db.execute_query(f'''
+                SELECT DISTINCT order_id, product_id FROM order_items
+                WHERE order_id IN ({','.join('?' * len(ids))})
+            ''', ids) or []
+        return items
+
+    def _count(self, items, sign):
+        """Прибавить (sign=1) или вычесть (sign=-1) корзины заказов; возвращает затронутые товары"""
+        baskets = defaultdict(list)
+        for order_id, product_id in items:
+            baskets[order_id].append(product_id)
+        item_counts, pair_counts = Counter(), Counter()
+        for products in baskets.values():
+            item_counts.update(products)
+            # Очень большие заказы (опт) дают квадратичное число пар и мало говорят о сходстве
+            if 1 < len(products) <= self.max_order_items:
+                pair_counts.update(combinations(sorted(products), 2))
+
+        if item_counts:
+            self.db.execute_many('''
+                INSERT INTO item_counts (product_id, order_count) VALUES (?, ?)
+                ON CONFLICT(product_id) DO UPDATE SET order_count = order_count + excluded.order_count
+            ''', [(product_id, sign * count) for product_id, count in item_counts.items()])
+        if pair_counts:
+            self.db.execute_many('''
+                INSERT INTO item_pairs (product_id, other_id, pair_count) VALUES (?, ?, ?)
+                ON CONFLICT(product_id, other_id) DO UPDATE SET pair_count = pair_count + excluded.pair_count
+            ''', [row for (a, b), count in pair_counts.items()
+                  for row in ((a, b, sign * count), (b, a, sign * count))])
+        return sorted(item_counts)
+
+    def refresh_neighbors(self):
+        """Пересчитать соседей всех товаров (оценки стареют при росте популярности соседей)"""
+        with self.db.transaction():
+            product_ids = [row[0] for row in self.db.execute_query('SELECT product_id FROM item_counts') or []]
+            self._write_neighbors(product_ids)
+            self.db.execute_query(
+                'UPDATE item_similarity_state SET refreshed_at = ? WHERE id = 1', (time.time(),)
+            )
+        return len(product_ids)
+
+    def rebuild(self):
+        """Построить индекс заново по всей истории заказов"""
+        with self.db.transaction():
+            for table in ('item_pairs', 'item_counts', 'item_neighbors', 'item_excluded_orders'):
+                self.db.execute_query(f'DELETE FROM {table}')
+            self.db.execute_query(
+                'UPDATE item_similarity_state SET last_order_id = 0, refreshed_at = NULL WHERE id = 1'
+            )
+        return self.update()
+
+    def _write_neighbors(self, product_ids, chunk=500):
+        for start in range(0, len(product_ids), chunk):
+            ids = product_ids[start:start + chunk]
+            placeholders = ','.join('?' * len(ids))
+            rows = self.db.execute_query(f'''
+                SELECT p.product_id, p.other_id, p.pair_count, ca.order_count, cb.order_count
+                FROM item_pairs p
+                JOIN item_counts ca ON ca.product_id = p.product_id
+                JOIN item_counts cb ON cb.product_id = p.other_id
+                WHERE p.product_id IN ({placeholders}) AND p.pair_count >= ?
+            ''', (*ids, self.min_pair_count)) or []
+            candidates = defaultdict(list)
+            for product_id, other_id, pair_count, count_a, count_b in rows:
+                candidates[product_id].append((pair_count / math.sqrt(count_a * count_b), pair_count, other_id))
+            neighbors = [
+                (product_id, other_id, score, pair_count)
+                for product_id, scored in candidates.items()
+                for score, pair_count, other_id in heapq.nlargest(self.top_k, scored)
+            ]
+            self.db.execute_query(f'DELETE FROM item_neighbors WHERE product_id IN ({placeholders})', ids)
+            if neighbors:
+                self.db.execute_many('''
+                    INSERT INTO item_neighbors (product_id, neighbor_id, score, pair_count)
+                    VALUES (?, ?, ?, ?)
+                ''', neighbors)
+
+    # Рекомендации
+
+    def also_bought(self, product_id, limit=5):
+        """Активные товары, которые чаще всего покупают вместе с данным: p.* и оценка"""
+        return self.db.execute_query('''
+            SELECT p.*, n.score
+            FROM item_neighbors n
+            JOIN products p ON p.id = n.neighbor_id
+            WHERE n.product_id = ? AND p.is_active = 1
+            ORDER BY n.score DESC
+            LIMIT ?
+        ''', (product_id, limit)) or []
+
+    def recommend_for_user(self, user_id, limit=5, seeds=20):
+        """Соседи последних купленных товаров, кроме уже купленных: p.*, категория, оценка"""
+        return self.db.execute_query('''
+            SELECT p.*, c.name as category_name, r.score as recommendation_score
+            FROM (
+                SELECT n.neighbor_id, SUM(n.score) AS score
+                FROM item_neighbors n
+                WHERE n.product_id IN (
+                    SELECT oi.product_id
+                    FROM order_items oi
+                    JOIN orders o ON o.id = oi.order_id
+                    WHERE o.user_id = ? AND o.status != 'cancelled'
+                    GROUP BY oi.product_id
+                    ORDER BY MAX(o.id) DESC
+                    LIMIT ?
+                )
+                AND n.neighbor_id NOT IN (
+                    SELECT oi.product_id
+                    FROM order_items oi
+                    JOIN orders o ON o.id = oi.order_id
+                    WHERE o.user_id = ?
+                )
+                GROUP BY n.neighbor_id
+            ) r
+            JOIN products p ON p.id = r.neighbor_id
+            JOIN categories c ON p.category_id = c.id
+            WHERE p.is_active = 1
+            ORDER BY r.score DESC, p.views DESC
+            LIMIT ?
+        ''', (user_id, seeds, user_id, limit)) or []
+
+    # Фоновое обновление
+
+    def use_job_queue(self, jobs):
+        """Обновление индекса — заданием постоянной очереди; при запуске догоняем пропущенные заказы"""
+        self.jobs = jobs
+        jobs.register('item_similarity', self.run_update)
+        self.schedule(0)
+
+    def schedule(self, delay=None):
+        """Одно задание на окно update_delay: заказы за окно обрабатываются одним прогоном"""
+        delay = self.update_delay if delay is None else delay
+        slot = int((time.time() + delay) // max(1, self.update_delay))
+        self.jobs.enqueue('item_similarity', delay=delay, idempotency_key=f"item_similarity:{slot}")
+
+    def on_order_events(self, entities, events):
+        """Подписчик канала изменений: новые заказы и смена статуса (отмена или ее откат)"""
+        if self.jobs and events:
+            self.schedule()
+
+    def run_update(self, payload=None):
+        self.update()
@@ -0,0 +1,230 @@
+"""
+Очередь заданий в SQLite
+
+Отложенные push-уведомления и другие задачи переживают перезапуск бота.
+Исполнитель забирает пачку готовых заданий в одной транзакции BEGIN IMMEDIATE
+и берет их в аренду (lease) до lease_until: пока аренда не истекла, задание
+не достанется другому потоку или процессу. После выполнения задание
+подтверждается (ack) токеном аренды; если исполнитель упал, задание снова
+станет доступно по истечении аренды. idempotency_key не дает поставить одно
+и то же задание дважды.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from config import JOBS_CONFIG
+except Exception:
+    JOBS_CONFIG = {}
+
+
+class JobQueue:
+    """Постоянная очередь заданий с арендой, подтверждением и повторами"""
+
+    def __init__(self, db, workers=None, batch_size=None, lease_seconds=None, poll_interval=None):
+        self.db = db
+        self.workers = workers or JOBS_CONFIG.get('workers', 4)
+        self.batch_size = batch_size or JOBS_CONFIG.get('batch_size', 20)
+        self.lease_seconds = lease_seconds or JOBS_CONFIG.get('lease_seconds', 120)
+        self.poll_interval = poll_interval or JOBS_CONFIG.get('poll_interval', 5)
+        self.max_attempts = JOBS_CONFIG.get('max_attempts', 5)
+        self.retry_delay = JOBS_CONFIG.get('retry_delay', 30)
+        self.keep_days = JOBS_CONFIG.get('keep_days', 7)
+        self.owner = uuid.uuid4().hex[:8]
+        self.handlers = {}
+        self.running = False
+        self._wake = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._stats_lock = threading.Lock()
+        self.stats = {'claimed': 0, 'done': 0, 'retried': 0, 'failed': 0, 'duplicates': 0}
+
+    def register(self, kind, handler):
+        """handler(payload) выполняет задание; исключение — повтор с экспоненциальной задержкой"""
+        self.handlers[kind] = handler
+
+    # Постановка и аренда
+
+    def enqueue(self, kind, payload=None, delay=0, idempotency_key=None, max_attempts=None):
+        """Поставить задание; возвращает id (для повтора с тем же ключом — id существующего)"""
+        with self.db.transaction():
+            if idempotency_key:
+                rows = self.db.execute_query('SELECT id FROM jobs WHERE idempotency_key = ?', (idempotency_key,))
+                if rows:
+                    with self._stats_lock:
+                        self.stats['duplicates'] += 1
+                    return rows[0][0]
+            job_id = self.db.execute_query('''
+                INSERT INTO jobs (kind, payload, run_at, idempotency_key, max_attempts)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (kind, json.dumps(payload or {}, ensure_ascii=False), time.time() + max(0, delay),
+                  idempotency_key, max_attempts or self.max_attempts))
+        if delay <= 0:
+            self._wake.set()
+        return job_id
+
+    def claim(self, limit=None, lease_seconds=None):
+        """Взять в аренду готовые задания: [(id, kind, payload, attempts, max_attempts, token)]"""
+        now = time.time()
+        lease_until = now + (lease_seconds or self.lease_seconds)
+        token = f"{self.owner}:{uuid.uuid4().hex[:12]}"
+        with self.db.transaction():
+            # У арендованного задания run_at = lease_until: истекшая аренда делает его снова готовым
+            rows = self.db.execute_query('''
+                SELECT id, kind, payload, attempts, max_attempts FROM jobs
+                WHERE status IN ('queued', 'leased') AND run_at <= ?
+                ORDER BY run_at
+                LIMIT ?
+            ''', (now, limit or self.batch_size))
+            exhausted = [(row[0],) for row in rows if row[3] >= row[4]]
+            claimed = [row for row in rows if row[3] < row[4]]
+            if exhausted:
+                # Исполнитель падал на этих заданиях каждый раз — дальше не пробуем
+                self.db.execute_many('''
+                    UPDATE jobs SET status = 'failed', lease_owner = NULL, finished_at = CURRENT_TIMESTAMP,
+                                    last_error = IFNULL(last_error, 'аренда истекла')
+                    WHERE id = ?
+                ''', exhausted)
+            if claimed:
+                self.db.execute_many('''
+                    UPDATE jobs SET status = 'leased', lease_owner = ?, run_at = ?, attempts = attempts + 1
+                    WHERE id = ?
+                ''', [(token, lease_until, row[0]) for row in claimed])
+        with self._stats_lock:
+            self.stats['claimed'] += len(claimed)
+            self.stats['failed'] += len(exhausted)
+        return [(job_id, kind, json.loads(payload), attempts + 1, max_attempts, token)
+                for job_id, kind, payload, attempts, max_attempts in claimed]
+
+    def ack(self, results):
+        """Записать итоги пачки: [(id, token, ошибка или None, attempts, max_attempts)]"""
+        done, retry, failed = [], [], []
+        now = time.time()
+        for job_id, token, error, attempts, max_attempts in results:
+            if error is None:
+                done.append((job_id, token))
+            elif attempts >= max_attempts:
+                failed.append((error, job_id, token))
+            else:
+                retry.append((now + self.retry_delay * 2 ** (attempts - 1), error, job_id, token))
+        counts = {}
+        with self.db.transaction():
+            # Условие lease_owner: задание с истекшей арендой мог уже забрать другой исполнитель
+            for name, items, query in (
+                ('done', done, '''
+                    UPDATE jobs SET status = 'done', lease_owner = NULL, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND lease_owner = ?
+                '''),
+                ('retried', retry, '''
+                    UPDATE jobs SET status = 'queued', lease_owner = NULL, run_at = ?, last_error = ?
+                    WHERE id = ? AND lease_owner = ?
+                '''),
+                ('failed', failed, '''
+                    UPDATE jobs SET status = 'failed', lease_owner = NULL, last_error = ?, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND lease_owner = ?
+                '''),
+            ):
+                if items:
+                    counts[name] = self.db.execute_many(query, items)
+        with self._stats_lock:
+            for name, count in counts.items():
+                self.stats[name] += count
+
+    def release(self, jobs):
+        """Вернуть невыполненные задания в очередь без траты попытки"""
+        if jobs:
+            self.db.execute_many('''
+                UPDATE jobs SET status = 'queued', lease_owner = NULL, run_at = ?, attempts = attempts - 1
+                WHERE id = ? AND lease_owner = ?
+            ''', [(time.time(), job[0], job[5]) for job in jobs])
+
+    def purge(self):
+        """Удалить завершенные задания старше keep_days"""
+        return self.db.execute_query('''
+            DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < datetime('now', ?)
+        ''', (f'-{self.keep_days} days',))
+
+    # Исполнитель
+
+    def start(self):
+        self.running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='jobs')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logging.info(f"Очередь заданий: {self.workers} потоков, аренда {self.lease_seconds}с")
+
+    def stop(self, timeout=10):
+        """Остановка: текущая пачка дописывается, остальные задания ждут в базе"""
+        self.running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        last_purge = 0
+        while self.running:
+            try:
+                if time.time() - last_purge > 3600:
+                    self.purge()
+                    last_purge = time.time()
+                jobs = self.claim()
+                if jobs:
+                    self.run_batch(jobs)
+                    continue
+            except Exception as e:
+                logging.error(f"Ошибка очереди заданий: {e}", exc_info=True)
+            self._wake.wait(self._next_wait())
+            self._wake.clear()
+
+    def _next_wait(self):
+        """Сон до ближайшего задания, но не дольше poll_interval (задания ставят и другие процессы)"""
+        rows = self.db.execute_query(
+            "SELECT MIN(run_at) FROM jobs WHERE status IN ('queued', 'leased')"
+        )
+        next_run = rows[0][0] if rows and rows[0][0] is not None else None
+        if next_run is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.05, next_run - time.time()))
+
+    def run_batch(self, jobs):
+        if not self.running:
+            self.release(jobs)
+            return
+        errors = list(self._executor.map(self._execute, jobs))
+        self.ack([(job[0], job[5], error, job[3], job[4]) for job, error in zip(jobs, errors)])
+
+    def _execute(self, job):
+        job_id, kind, payload, attempts, _max_attempts, _token = job
+        handler = self.handlers.get(kind)
+        if handler is None:
+            return f"нет обработчика для {kind}"
+        try:
+            handler(payload)
+            return None
+        except Exception as e:
+            logging.info(f"Задание {job_id} ({kind}), попытка {attempts}: {e}")
+            return str(e)[:200] or e.__class__.__name__
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        rows = self.db.execute_query('''
+            SELECT status, COUNT(*), MIN(CASE WHEN run_at <= ? THEN run_at END) FROM jobs
+            WHERE status IN ('queued', 'leased')
+            GROUP BY status
+        ''', (time.time(),)) or []
+        for status, count, oldest_ready in rows:
+            stats[status] = count
+            if status == 'queued' and oldest_ready is not None:
+                stats['ready_lag'] = round(time.time() - oldest_ready, 3)
+        return stats
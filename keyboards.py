@@ -2,6 +2,11 @@
 Клавиатуры для телеграм-бота
 """
 
+from database import encode_cursor
+
+# Максимальная длина callback_data inline-кнопки в байтах (ограничение Telegram API)
+CALLBACK_DATA_LIMIT = 64
+
 def _t(lang: str, ru: str) -> str:
     """
     Простейший локализатор RU -> UZ.
@@ -60,6 +65,7 @@ def _t(lang: str, ru: str) -> str:
         '💎 $100-500': '💎 $100-500',
         '👑 $500+': '👑 $500+',
         '🔙 Назад': '🔙 Orqaga',
+        '➡️ Ещё товары': '➡️ Yana tovarlar',
         '❌ Отменить заказ': '❌ Buyurtmani bekor qilish',
         '📋 Детали заказа': '📋 Buyurtma tafsilotlari',
         '📞 Связаться': "📞 Bog'lanish",
@@ -171,6 +177,30 @@ def create_products_keyboard(products, show_back=True, language='ru'):
         'one_time_keyboard': False
     }
 
+def create_catalog_page_keyboard(subcategory_id, last_product_name, last_product_id, language='ru'):
+    """Inline кнопка следующей страницы товаров подкатегории (keyset-курсор по (name, id) товара)"""
+    return {
+        'inline_keyboard': [
+            [{'text': _t(language, '➡️ Ещё товары'),
+              'callback_data': catalog_page_callback(subcategory_id, last_product_name, last_product_id)}]
+        ]
+    }
+
+def catalog_page_callback(subcategory_id, last_product_name, last_product_id):
+    """
+    callback_data кнопки «Ещё товары»: subcat_next_{subcategory_id}_{курсор}.
+    Telegram ограничивает callback_data 64 байтами, поэтому длинное название
+    укорачивается: префикс сортируется не позже полного названия, и следующая
+    страница может повторить пару товаров, но не пропустит ни одного.
+    """
+    prefix = f'subcat_next_{subcategory_id}_'
+    name = last_product_name or ''
+    while True:
+        data = prefix + encode_cursor('n', [name, last_product_id])
+        if len(data.encode('utf-8')) <= CALLBACK_DATA_LIMIT or not name:
+            return data
+        name = name[:-1]
+
 def format_price(price):
     """Форматирование цены для клавиатур"""
     return f"${price:.2f}"
@@ -5,20 +5,19 @@ import logging
 
 import json
 import urllib.request
-import urllib.parse
-import urllib.error
 import os
 import time
 import signal
 import sys
 import threading
-import mimetypes
+import secrets
 logger = logging.getLogger('shop_bot')
 if not logger.handlers:
     logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:%(message)s')
 else:
     logger.setLevel(logging.INFO)
 from database import DatabaseManager
+from change_feed import ChangeFeed, ALL_ENTITIES, notify_change
 from handlers import MessageHandler
 from notifications import NotificationManager
 from utils import format_date
@@ -26,11 +25,20 @@ from payments import PaymentProcessor
 from logistics import LogisticsManager
 from promotions import PromotionManager
 from crm import CRMManager
+from customer_scores import CustomerScores
+from item_similarity import ItemSimilarityIndex
 from logger import logger
 from health_check import HealthMonitor
 from database_backup import DatabaseBackup
 from scheduled_posts import ScheduledPostsManager
-from config import BOT_CONFIG, BOT_TOKEN
+from config import BOT_CONFIG, BOT_TOKEN, UPDATES_CONFIG
+from telegram_api import MultipartBody, get_telegram_api
+from update_dispatcher import UpdateDispatcher
+from webhook_receiver import WebhookReceiver
+from broadcasts import BroadcastEngine
+from job_queue import JobQueue
+from file_id_cache import FileIdCache, is_invalid_file_id, is_private_url, local_photo_path
+from rate_governor import BULK, outbound_priority
 
 # Импорты с обработкой ошибок
 from datetime import datetime
@@ -87,20 +95,26 @@ except ImportError:
 class TelegramShopBot:
     def __init__(self, token):
         self.token = token
-        self.base_url = f"https://api.telegram.org/bot{token}"
+        self.api = get_telegram_api(token)
         self.offset = 0
         self.running = True
+        self._polling = False
+        self.webhook_receiver = None
         self.error_count = 0
         self.max_errors = 10
-        self.data_cache = {}
         self.last_data_reload = time.time()
         
         # Инициализация компонентов
         self.db = DatabaseManager()
+        self.file_ids = FileIdCache(self.db)
         self.setup_admin_from_env()
         self.backup_manager = DatabaseBackup(self.db.db_path)
         self.message_handler = MessageHandler(self, self.db)
+        self.dispatcher = UpdateDispatcher(self.handle_update)
+        self.broadcasts = BroadcastEngine(self.db, self)
         self.notification_manager = NotificationManager(self, self.db)
+        self.jobs = JobQueue(self.db)
+        self.notification_manager.use_job_queue(self.jobs)
         self.payment_processor = PaymentProcessor()
         
         # Система мониторинга
@@ -116,6 +130,11 @@ class TelegramShopBot:
         self.logistics_manager = LogisticsManager(self.db)
         self.promotion_manager = PromotionManager(self.db)
         self.crm_manager = CRMManager(self.db)
+        self.crm_manager.use_job_queue(self.jobs)
+        self.customer_scores = CustomerScores(self.db)
+        self.customer_scores.use_job_queue(self.jobs)
+        self.item_similarity = ItemSimilarityIndex(self.db)
+        self.item_similarity.use_job_queue(self.jobs)
         
         # Связываем компоненты
         self.message_handler.notification_manager = self.notification_manager
@@ -204,84 +223,54 @@ class TelegramShopBot:
         logger.info("✅ Бот инициализирован успешно")
     
     def start_data_sync_monitor(self):
-        """Запуск мониторинга обновлений данных"""
-        def sync_worker():
-            while self.running:
-                try:
-                    self.check_for_data_updates()
-                    time.sleep(5)  # Проверяем каждые 5 секунд
-                except Exception as e:
-                    logger.error(f"Ошибка синхронизации данных: {e}")
-                    time.sleep(30)
-        
-        sync_thread = threading.Thread(target=sync_worker, daemon=True)
-        sync_thread.start()
-        logger.info("Мониторинг синхронизации данных запущен")
+        """Подписка на изменения данных из веб-панели (вместо опроса файлов-флагов)"""
+        self.change_feed = ChangeFeed(self.db)
+        self.change_feed.subscribe(('categories', 'subcategories', 'products'), self.on_catalog_changed)
+        self.change_feed.subscribe(('scheduled_posts',), self.on_scheduled_posts_changed)
+        self.change_feed.subscribe((ALL_ENTITIES,), self.on_full_reload_requested)
+        self.change_feed.subscribe(('broadcast_jobs',), self.broadcasts.on_jobs_changed)
+        self.change_feed.subscribe(('orders',), self.item_similarity.on_order_events)
+        if self.marketing_automation:
+            self.change_feed.subscribe(('orders', 'inventory_movements'), self.marketing_automation.on_events)
+        try:
+            self.change_feed.start()
+        except Exception as e:
+            logger.error(f"Ошибка запуска канала изменений: {e}")
     
-    def check_for_data_updates(self):
-        """Проверка обновлений данных"""
-        # Проверяем обычный флаг обновления
-        update_flag_file = 'data_update_flag.txt'
-        force_reload_flag = 'force_reload_flag.txt'
-        
-        # Проверяем принудительную перезагрузку
-        if os.path.exists(force_reload_flag):
-            try:
-                logger.info("🔄 ПРИНУДИТЕЛЬНАЯ ПЕРЕЗАГРУЗКА данных...")
-                self.full_data_reload()
-                os.remove(force_reload_flag)
-                logger.info("✅ Принудительная перезагрузка завершена")
-            except Exception as e:
-                logger.error(f"Ошибка принудительной перезагрузки: {e}")
-                try:
-                    os.remove(force_reload_flag)
-                except Exception:
-                    pass
-        
-        # Проверяем обычное обновление
-        elif os.path.exists(update_flag_file):
-            try:
-                # Читаем время последнего обновления
-                with open(update_flag_file, 'r') as f:
-                    update_time_str = f.read().strip()
-                
-                update_time = float(update_time_str)
-                
-                # Если обновление новее нашего последнего обновления
-                if update_time > self.last_data_reload:
-                    logger.info("🔄 Обнаружено обновление данных, перезагружаем...")
-                    self.reload_data_cache()
-                    self.last_data_reload = update_time
-                    
-                    # Удаляем флаг
-                    os.remove(update_flag_file)
-                    logger.info("✅ Данные обновлены в боте")
-                    
-            except Exception as e:
-                logger.error(f"Ошибка обработки флага обновления: {e}")
-                # Удаляем поврежденный флаг
-                try:
-                    os.remove(update_flag_file)
-                except Exception:
-                    pass
+    def on_catalog_changed(self, entities, events):
+        """Изменения каталога: перестраиваем только индекс каталога"""
+        self.message_handler.catalog.refresh()
+        self.last_data_reload = time.time()
+        logger.info(f"🔄 Каталог обновлен ({', '.join(sorted(entities))}: {len(events)} изм.)")
+        # Новые и измененные товары: изображение загружаем в Telegram заранее
+        product_ids = sorted({event[2] for event in events if event[1] == 'products' and event[3] != 'delete'})
+        if product_ids:
+            threading.Thread(target=self.prewarm_product_images, args=(product_ids,), daemon=True).start()
+    
+    def on_scheduled_posts_changed(self, entities, events):
+        """Изменения автопостов: перечитываем расписание"""
+        if hasattr(self, 'scheduled_posts') and self.scheduled_posts:
+            self.scheduled_posts.load_schedule_from_database()
+            logger.info(f"🔄 Расписание автопостов обновлено ({len(events)} изм.)")
+    
+    def on_full_reload_requested(self, entities, events):
+        """Полная синхронизация по кнопке в веб-панели"""
+        if ALL_ENTITIES in entities:
+            logger.info("🔄 ПРИНУДИТЕЛЬНАЯ ПЕРЕЗАГРУЗКА данных...")
+            self.full_data_reload()
     
     def full_data_reload(self):
-        """Полная перезагрузка всех данных и компонентов"""
+        """Полная перезагрузка кэшей и компонентов (соединения с БД переиспользуются)"""
         try:
-            # Перезагружаем базу данных
-            self.db = DatabaseManager()
-            
-            # Перезагружаем кэш
             self.reload_data_cache()
             
-            # Перезагружаем автопосты
-            if hasattr(self, 'scheduled_posts') and self.scheduled_posts:
-                self.scheduled_posts.load_schedule_from_database()
-            
             # Перезагружаем правила автоматизации
             if hasattr(self, 'marketing_automation') and self.marketing_automation:
                 self.setup_default_automation_rules()
             
+            # Уведомляем админов об обновлении
+            self.notify_admins_about_update()
+            
             logger.info("✅ Полная перезагрузка данных завершена")
             
         except Exception as e:
@@ -290,23 +279,14 @@ class TelegramShopBot:
     def reload_data_cache(self):
         """Перезагрузка кэша данных"""
         try:
-            # Очищаем кэш
-            self.data_cache.clear()
-            
-            # Перезагружаем категории
-            self.data_cache['categories'] = self.db.get_categories()
-            
-            # Перезагружаем товары
-            self.data_cache['products'] = self.db.execute_query(
-                'SELECT * FROM products WHERE is_active = 1 ORDER BY name'
-            )
+            # Перезагружаем индекс каталога
+            self.message_handler.catalog.refresh()
             
             # Перезагружаем автопосты если есть модуль
             if hasattr(self, 'scheduled_posts') and self.scheduled_posts:
                 self.scheduled_posts.load_schedule_from_database()
             
-            # Уведомляем админов об обновлении
-            self.notify_admins_about_update()
+            self.last_data_reload = time.time()
             
         except Exception as e:
             logger.error(f"Ошибка перезагрузки данных: {e}")
@@ -333,13 +313,10 @@ class TelegramShopBot:
     
     def trigger_data_update(self):
         """Принудительное обновление данных"""
-        update_flag_file = 'data_update_flag.txt'
-        try:
-            with open(update_flag_file, 'w') as f:
-                f.write(str(time.time()))
-            logger.info("Флаг обновления данных установлен")
-        except Exception as e:
-            logger.error(f"Ошибка установки флага обновления: {e}")
+        if notify_change([ALL_ENTITIES]):
+            logger.info("Сигнал обновления данных отправлен")
+        else:
+            self.full_data_reload()
     
     def setup_admin_from_env(self):
         """Настройка админа из переменных окружения"""
@@ -385,7 +362,10 @@ class TelegramShopBot:
         """Обработчик сигналов для graceful shutdown"""
         logger.info(f"Получен сигнал {signum}, завершение работы...")
         self.running = False
-        sys.exit(0)
+        self.dispatcher.accepting = False
+        # Прерываем только ожидание getUpdates; принятые update дообработает run()
+        if self._polling:
+            raise SystemExit(0)
     
     def schedule_inventory_checks(self):
         """Планирование проверок склада"""
@@ -442,181 +422,34 @@ class TelegramShopBot:
     
     def delete_webhook(self, drop_pending_updates: bool = True):
         """Удаляет вебхук, чтобы разрешить polling (getUpdates)."""
-        import urllib.request, urllib.parse, json
-        url = f"{self.base_url}/deleteWebhook"
-        data = {'drop_pending_updates': 'true' if drop_pending_updates else 'false'}
-        try:
-            req = urllib.request.Request(url, data=urllib.parse.urlencode(data).encode('utf-8'), method='POST')
-            with urllib.request.urlopen(req) as response:
-                resp_text = response.read().decode('utf-8', errors='ignore')
-                logger.info(f"[webhook] deleteWebhook: {resp_text}")
-                try:
-                    return json.loads(resp_text)
-                except Exception:
-                    return {"ok": False, "raw": resp_text}
-        except Exception as e:
-            logger.warning(f"[webhook] deleteWebhook failed: {e}")
-            return {"ok": False, "error": str(e)}
+        result = self.api.request('deleteWebhook', {'drop_pending_updates': 'true' if drop_pending_updates else 'false'})
+        if 'error' in result:
+            logger.warning(f"[webhook] deleteWebhook failed: {result['error']}")
+        else:
+            logger.info(f"[webhook] deleteWebhook: {result}")
+        return result
 
     def get_webhook_info(self):
         """Для диагностики: информация о текущем вебхуке."""
-        import urllib.request, json
-        url = f"{self.base_url}/getWebhookInfo"
-        try:
-            with urllib.request.urlopen(url) as response:
-                resp_text = response.read().decode('utf-8', errors='ignore')
-                logger.info(f"[webhook] getWebhookInfo: {resp_text}")
-                try:
-                    return json.loads(resp_text)
-                except Exception:
-                    return {"ok": False, "raw": resp_text}
-        except Exception as e:
-            logger.warning(f"[webhook] getWebhookInfo failed: {e}")
-            return {"ok": False, "error": str(e)}
+        result = self.api.request('getWebhookInfo')
+        if 'error' in result:
+            logger.warning(f"[webhook] getWebhookInfo failed: {result['error']}")
+        else:
+            logger.info(f"[webhook] getWebhookInfo: {result}")
+        return result
+
     def send_message(self, chat_id, text, reply_markup=None):
         """Отправка сообщения"""
-        url = f"{self.base_url}/sendMessage"
-        data = {
-            'chat_id': chat_id,
-            'text': text,
-            'parse_mode': 'HTML'
-        }
-        
-        if reply_markup:
-            data['reply_markup'] = json.dumps(reply_markup)
-        
-        try:
-            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=data_encoded, method='POST')
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                if not result.get('ok'):
-                    logging.info(f"Ошибка отправки сообщения: {result}")
-                return result
-        except Exception as e:
-            logging.info(f"Ошибка отправки сообщения: {e}")
+        result = self.api.send_message(chat_id, text, reply_markup=reply_markup or None)
+        if 'error' in result:
+            logging.info(f"Ошибка отправки сообщения: {result['error']}")
             return None
+        if not result.get('ok'):
+            logging.info(f"Ошибка отправки сообщения: {result}")
+        return result
     
     
-    def _is_private_url(self, url: str) -> bool:
-        try:
-            from urllib.parse import urlparse
-            p = urlparse(url)
-            host = (p.hostname or "").lower()
-            if not p.scheme:
-                return True
-            if host in ("localhost", "127.0.0.1"):
-                return True
-            if host.startswith("192.168.") or host.startswith("10."):
-                return True
-            if host.startswith("172."):
-                parts = host.split(".")
-                try:
-                    second = int(parts[1])
-                    if 16 <= second <= 31:
-                        return True
-                except Exception:
-                    pass
-            return False
-        except Exception:
-            return True
-
-    def _map_url_to_local_path(self, url_or_path: str) -> str | None:
-        """Преобразует URL вида http://<lan>/static/uploads/xxx.png в локальный путь web_admin/static/uploads/xxx.png"""
-        import os
-        from urllib.parse import urlparse, unquote
-        if not url_or_path:
-            return None
-        # If already an existing file path
-        if os.path.exists(url_or_path):
-            return url_or_path
-        try:
-            p = urlparse(url_or_path)
-            path = p.path if p.scheme else url_or_path
-            path = unquote(path.lstrip("/"))
-        except Exception:
-            path = url_or_path.lstrip("/")
-        # Candidates
-        here = os.path.dirname(__file__)
-        candidates = [
-            os.path.join(here, "web_admin", path),
-            os.path.join(here, path),
-            os.path.join(os.path.dirname(here), path),
-        ]
-        for c in candidates:
-            c = os.path.normpath(c)
-            if os.path.exists(c):
-                return c
-        return None
-
-    def _encode_multipart_formdata(self, fields: dict, files: dict):
-        """Собирает тело multipart/form-data без внешних зависимостей."""
-        import uuid
-        boundary = "----WebKitFormBoundary" + uuid.uuid4().hex
-        crlf = "\r\n"
-        lines = []
-        for name, value in fields.items():
-            lines.append(f"--{boundary}")
-            lines.append(f'Content-Disposition: form-data; name="{name}"')
-            lines.append("")
-            lines.append(str(value))
-        for name, filepath in files.items():
-            filename = os.path.basename(filepath)
-            ctype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
-            lines.append(f"--{boundary}")
-            lines.append(f'Content-Disposition: form-data; name="{name}"; filename="{filename}"')
-            lines.append(f"Content-Type: {ctype}")
-            lines.append("")
-            with open(filepath, "rb") as f:
-                file_data = f.read()
-            # append bytes safely
-            # We'll return bytes separately because mixing str and bytes is tricky
-            header = (crlf.join(lines) + crlf).encode("utf-8")
-            body = header + file_data + crlf.encode("utf-8")
-            lines = []  # reset lines after file chunk
-        closing = f"--{boundary}--{crlf}".encode("utf-8")
-        content_type = f"multipart/form-data; boundary={boundary}"
-        # Combine: because we reset before, we need to re-assemble correctly
-        # Simpler approach: build a proper multipart using BytesIO:
-        from io import BytesIO
-        body_io = BytesIO()
-        # rebuild fields
-        for name, value in fields.items():
-            body_io.write(f"--{boundary}{crlf}".encode("utf-8"))
-            body_io.write(f'Content-Disposition: form-data; name="{name}"{crlf}{crlf}'.encode("utf-8"))
-            body_io.write(str(value).encode("utf-8"))
-            body_io.write(crlf.encode("utf-8"))
-        # files
-        for name, filepath in files.items():
-            filename = os.path.basename(filepath)
-            ctype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
-            body_io.write(f"--{boundary}{crlf}".encode("utf-8"))
-            body_io.write(f'Content-Disposition: form-data; name="{name}"; filename="{filename}"{crlf}'.encode("utf-8"))
-            body_io.write(f"Content-Type: {ctype}{crlf}{crlf}".encode("utf-8"))
-            with open(filepath, "rb") as f:
-                body_io.write(f.read())
-            body_io.write(crlf.encode("utf-8"))
-        body_io.write(f"--{boundary}--{crlf}".encode("utf-8"))
-        return content_type, body_io.getvalue()
-
-    
-    def _read_http_error_body(self, err):
-        """Возвращает текст ответа даже при HTTPError (например, 400), чтобы увидеть реальную ошибку Telegram."""
-        try:
-            import urllib.error
-            if isinstance(err, urllib.error.HTTPError) and err.read:
-                try:
-                    body = err.read().decode("utf-8", errors="replace")
-                    return body
-                except Exception:
-                    return ""
-        except Exception:
-            pass
-        return ""
-
     def _send_photo_file(self, chat_id, file_path, caption="", reply_markup=None):
-        import urllib.request, urllib.error, json, os, mimetypes
-        url = f"{self.base_url}/sendPhoto"
         fields = {
             "chat_id": chat_id,
         }
@@ -624,34 +457,59 @@ class TelegramShopBot:
             fields["caption"] = caption
             fields["parse_mode"] = "HTML"
         if reply_markup:
-            import json as _json
-            fields["reply_markup"] = _json.dumps(reply_markup)
+            fields["reply_markup"] = json.dumps(reply_markup)
 
-        content_type, body = self._encode_multipart_formdata(fields, {"photo": file_path})
-        req = urllib.request.Request(url, data=body, method='POST')
-        req.add_header("Content-Type", content_type)
         try:
-            with urllib.request.urlopen(req) as resp:
-                resp_text = resp.read().decode('utf-8', errors='replace')
-                logger.info(f"[send_photo multipart] response: {resp_text[:240]}")
-                try:
-                    return json.loads(resp_text)
-                except Exception:
-                    return {"ok": False, "result": None, "raw": resp_text}
+            body = MultipartBody(fields, {"photo": file_path})
         except Exception as e:
-            # Попробуем прочитать тело ошибки у Telegram
-            body_text = self._read_http_error_body(e)
-            if body_text:
-                logger.info(f"[send_photo multipart] HTTPError body: {body_text[:400]}")
-                try:
-                    obj = json.loads(body_text)
-                    return obj
-                except Exception:
-                    return {"ok": False, "error": str(e), "raw": body_text[:400]}
             logger.info(f"[send_photo multipart] exception: {e}")
             return {"ok": False, "error": str(e)}
+        result = self.api.request('sendPhoto', body=body, content_type=body.content_type, chat_id=chat_id)
+        logger.info(f"[send_photo multipart] response: {str(result)[:400]}")
+        return result
     
     def send_photo(self, chat_id, photo_url, caption="", reply_markup=None):
+        """Отправка фото: по file_id из кэша, а если его нет — загрузка с сохранением file_id"""
+        key = self.file_ids.photo_key(photo_url)
+        file_id = self.file_ids.get(key)
+        if file_id:
+            result = self.api.send_photo(chat_id, file_id, caption or None, reply_markup=reply_markup or None)
+            if result.get('ok'):
+                return result
+            if not is_invalid_file_id(result):
+                # file_id исправен (чат недоступен, лимит и т.п.) — повторная загрузка не поможет
+                logger.info(f"[send_photo file_id] fail: {str(result)[:240]}")
+                return result
+            self.file_ids.invalidate(key)
+        result = self._upload_photo(chat_id, photo_url, caption, reply_markup)
+        if result and result.get('ok'):
+            self.file_ids.remember(key, result, str(photo_url))
+        return result
+
+    def prewarm_product_images(self, product_ids):
+        """Загрузить новые изображения товаров заранее, чтобы первый покупатель получил их по file_id"""
+        chat_id = BOT_CONFIG.get('file_cache_chat_id')
+        if not chat_id or not product_ids:
+            return
+        placeholders = ','.join('?' * len(product_ids))
+        rows = self.db.execute_query(f'''
+            SELECT DISTINCT image_url FROM products
+            WHERE id IN ({placeholders}) AND image_url IS NOT NULL AND image_url != ''
+        ''', tuple(product_ids)) or []
+        for (image_url,) in rows:
+            try:
+                if self.file_ids.get(self.file_ids.photo_key(image_url)):
+                    continue
+                with outbound_priority(BULK):
+                    result = self.send_photo(chat_id, image_url)
+                if result and result.get('ok'):
+                    # Само сообщение не нужно — достаточно file_id
+                    self.api.request('deleteMessage', {'chat_id': chat_id, 'message_id': result['result']['message_id']})
+                    logger.info(f"🖼 Изображение загружено в кэш file_id: {image_url}")
+            except Exception as e:
+                logger.info(f"Ошибка предзагрузки изображения {image_url}: {e}")
+
+    def _upload_photo(self, chat_id, photo_url, caption="", reply_markup=None):
         """Надёжная отправка фото:
         1) Если http(s) URL — пробуем прямой URL в Telegram.
         2) Если URL не принялся (failed to get HTTP URL content и т.п.) — качаем во временный файл и шлём multipart.
@@ -659,10 +517,9 @@ class TelegramShopBot:
         4) Для локальных/приватных путей — сразу multipart.
         Все ответы Telegram логируются (включая тело при 400), чтобы быстро понять причину.
         """
-        import urllib.request, urllib.parse, urllib.error, json, os, tempfile
+        import urllib.request, json, os, tempfile
         
         def try_url(mode_caption: str, use_parse_mode: bool = True):
-            url = f"{self.base_url}/sendPhoto"
             data = {
                 "chat_id": chat_id,
                 "photo": str(photo_url),
@@ -672,24 +529,10 @@ class TelegramShopBot:
                 if use_parse_mode:
                     data["parse_mode"] = "HTML"
             if reply_markup:
-                data["reply_markup"] = json.dumps(reply_markup)
-            try:
-                payload = urllib.parse.urlencode(data).encode("utf-8")
-                req = urllib.request.Request(url, data=payload, method="POST")
-                with urllib.request.urlopen(req) as response:
-                    response_text = response.read().decode("utf-8", errors="replace")
-                    logger.info(f"[send_photo URL] response: {response_text[:240]}")
-                    return json.loads(response_text)
-            except Exception as e:
-                body_text = self._read_http_error_body(e)
-                if body_text:
-                    logger.info(f"[send_photo URL] HTTPError body: {body_text[:400]}")
-                    try:
-                        return json.loads(body_text)
-                    except Exception:
-                        return {"ok": False, "error": str(e), "raw": body_text[:400]}
-                logger.info(f"[send_photo URL] fail: {e}")
-                return {"ok": False, "error": str(e)}
+                data["reply_markup"] = reply_markup
+            result = self.api.request('sendPhoto', data)
+            logger.info(f"[send_photo URL] response: {str(result)[:400]}")
+            return result
         
         def download_to_temp(src_url: str) -> str | None:
             try:
@@ -703,9 +546,9 @@ class TelegramShopBot:
 
         # 0) Определим режим: URL или локальный файл
         is_http = isinstance(photo_url, str) and photo_url.lower().startswith(("http://", "https://"))
-        if not is_http or self._is_private_url(str(photo_url)):
+        if not is_http or is_private_url(str(photo_url)):
             # локальный/приватный — multipart сразу
-            local_path = self._map_url_to_local_path(str(photo_url)) or str(photo_url)
+            local_path = local_photo_path(str(photo_url)) or str(photo_url)
             logger.info(f"[send_photo] multipart path={local_path}")
             res = self._send_photo_file(chat_id, local_path, caption or "", reply_markup)
             if res and res.get("ok"):
@@ -773,116 +616,187 @@ class TelegramShopBot:
 
     def get_updates(self):
         """Получение обновлений"""
-        url = f"{self.base_url}/getUpdates"
-        params = {'offset': self.offset, 'timeout': 30}
-        
-        try:
-            url_with_params = f"{url}?{urllib.parse.urlencode(params)}"
-            with urllib.request.urlopen(url_with_params) as response:
-                data = json.loads(response.read().decode('utf-8'))
-                return data
-        except urllib.error.HTTPError as e:
-            if e.code == 409:
-                logger.warning("[409 handler] Webhook conflict detected. Clearing webhook and backing off...")
-                try:
-                    self.delete_webhook(drop_pending_updates=True)
-                except Exception as _wh_err:
-                    logger.warning(f"[409 handler] delete_webhook error: {_wh_err}")
-                time.sleep(2.0)
-                return []
-            else:
-                logger.info(f"Ошибка получения обновлений: {e}")
-                return []
-        except Exception as e:
-            logging.info(f"Ошибка получения обновлений: {e}")
+        data = self.api.get_updates(
+            offset=self.offset,
+            timeout=UPDATES_CONFIG['poll_timeout'],
+            limit=UPDATES_CONFIG['poll_limit'],
+            allowed_updates=UPDATES_CONFIG['allowed_updates']
+        )
+        if data.get('error_code') == 409:
+            logger.warning("[409 handler] Webhook conflict detected. Clearing webhook and backing off...")
+            self.delete_webhook(drop_pending_updates=True)
+            time.sleep(2.0)
+            return []
+        if 'error' in data:
+            logging.info(f"Ошибка получения обновлений: {data['error']}")
             return None
+        if not data.get('ok'):
+            logger.info(f"Ошибка получения обновлений: {data}")
+            return []
+        return data
     
+    def process_update(self, update):
+        """Маршрутизация одного update по обработчикам"""
+        if 'message' in update:
+            message = update['message']
+            text = message.get('text', '')
+            telegram_id = message['from']['id']
+
+            # Логируем сообщение
+            logger.info(f"Сообщение от {telegram_id}: {text[:50]}...")
+
+            # Проверяем админ команды
+            if self.admin_handler and (text.startswith('/admin') or text in ['📊 Статистика', '📦 Заказы', '🛠 Товары', '👥 Пользователи', '🔙 Пользовательский режим']):
+                self.admin_handler.handle_admin_command(message)
+            elif self.admin_handler and text in ['📈 Аналитика', '🛡 Безопасность', '💰 Финансы', '📦 Склад', '🤖 AI', '🎯 Автоматизация', '👥 CRM', '📢 Рассылка']:
+                self.admin_handler.handle_admin_command(message)
+            elif self.admin_handler and text.startswith('/admin_order_'):
+                self.admin_handler.handle_order_management(message)
+            elif self.admin_handler and (text.startswith('/edit_product_') or text.startswith('/delete_product_')):
+                self.admin_handler.handle_product_commands(message)
+            elif self.admin_handler and hasattr(self.admin_handler, 'admin_states') and self.admin_handler.admin_states.get(telegram_id):
+                state = self.admin_handler.admin_states.get(telegram_id, '')
+                if state.startswith('adding_product_'):
+                    self.admin_handler.handle_add_product_process(message)
+                elif state.startswith('creating_broadcast_'):
+                    self.admin_handler.handle_broadcast_creation(message)
+            elif text == '/notifications':
+                self.show_user_notifications(message)
+            else:
+                self.message_handler.handle_message(message)
+        elif 'callback_query' in update:
+            callback_query = update['callback_query']
+            data = callback_query['data']
+            telegram_id = callback_query['from']['id']
+
+            # Проверяем админ callback'и
+            if self.admin_handler and (data.startswith('admin_') or data.startswith('change_status_') or data.startswith('order_details_')):
+                self.admin_handler.handle_callback_query(callback_query)
+            elif self.admin_handler and (data.startswith('analytics_') or data.startswith('period_')):
+                self.admin_handler.handle_analytics_callback(callback_query)
+            elif self.admin_handler and data.startswith('export_'):
+                self.admin_handler.handle_export_callback(callback_query)
+            elif self.admin_handler and (data.startswith('security_') or data.startswith('unblock_user_')):
+                if hasattr(self.admin_handler, 'handle_security_callback'):
+                    self.admin_handler.handle_security_callback(callback_query)
+                else:
+                    self.admin_handler.handle_callback_query(callback_query)
+            elif self.admin_handler and data.startswith('broadcast_'):
+                if hasattr(self.admin_handler, 'handle_broadcast_callback'):
+                    self.admin_handler.handle_broadcast_callback(callback_query)
+                else:
+                    self.admin_handler.handle_callback_query(callback_query)
+            else:
+                self.message_handler.handle_callback_query(callback_query)
+    
+    def handle_update(self, update):
+        """Обработка одного update в потоке диспетчера"""
+        self.health_monitor.increment_messages()
+        try:
+            # Пользователь, язык, права и корзина загружаются один раз на update
+            source = update.get('message') or update.get('callback_query') or {}
+            with self.db.update_context((source.get('from') or {}).get('id')):
+                self.process_update(update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления: {e}", exc_info=True)
+            self.health_monitor.increment_errors(str(e))
+
+    def confirm_offset(self, upto=None):
+        """Подтвердить Telegram update до upto (по умолчанию все переданные в обработку),
+        чтобы после перезапуска они не пришли снова"""
+        offset = self.offset if upto is None else min(self.offset, upto)
+        if offset:
+            self.api.get_updates(offset=offset, timeout=0, limit=1)
+
+    def set_webhook(self, url, secret_token):
+        """Регистрирует вебхук в Telegram (режим UPDATES_CONFIG['mode'] == 'webhook')."""
+        result = self.api.request('setWebhook', {
+            'url': url,
+            'secret_token': secret_token,
+            'allowed_updates': UPDATES_CONFIG['allowed_updates'],
+            'max_connections': UPDATES_CONFIG['webhook_max_connections'],
+            'drop_pending_updates': 'false'
+        })
+        logger.info(f"[webhook] setWebhook: {result}")
+        return result.get('ok', False)
+
+    def start_webhook_mode(self):
+        """Прием update через вебхук на HTTP-сервере мониторинга; False — остаемся на polling"""
+        url = BOT_CONFIG.get('webhook_url')
+        if not url:
+            logger.warning("[webhook] WEBHOOK_URL не задан, используется polling")
+            return False
+        # Без заданного секрета генерируем свой: вебхук регистрирует сам бот
+        secret_token = BOT_CONFIG.get('webhook_secret') or secrets.token_urlsafe(32)
+        self.webhook_receiver = WebhookReceiver(self.dispatcher, secret_token)
+        self.health_monitor.add_post_route(UPDATES_CONFIG['webhook_path'], self.webhook_receiver.handle)
+        if not self.set_webhook(url, secret_token):
+            logger.warning("[webhook] setWebhook не удался, используется polling")
+            self.health_monitor.post_routes.pop(UPDATES_CONFIG['webhook_path'], None)
+            self.webhook_receiver = None
+            return False
+        logger.info(f"📡 Прием update через вебхук: {UPDATES_CONFIG['webhook_path']}")
+        return True
+
     def run(self):
         """Запуск бота"""
         logger.info("🛍 Телеграм-бот интернет-магазина запущен!")
         logger.info("📱 Ожидание сообщений...")
         logger.info("Нажмите Ctrl+C для остановки")
         
+        self.dispatcher.start()
+        self.broadcasts.start()
+        self.jobs.start()
+        self.health_monitor.create_health_endpoint()
         try:
-            while self.running:
-                updates = self.get_updates()
-                
-                if updates and updates.get('ok'):
-                    self.error_count = 0  # Сбрасываем счетчик ошибок при успехе
-                    
-                    for update in updates['result']:
-                        self.offset = update['update_id'] + 1
-                        
-                        try:
-                            self.health_monitor.increment_messages()
-                            
-                            if 'message' in update:
-                                message = update['message']
-                                text = message.get('text', '')
-                                telegram_id = message['from']['id']
-                                
-                                # Логируем сообщение
-                                logger.info(f"Сообщение от {telegram_id}: {text[:50]}...")
-                                
-                                # Проверяем админ команды
-                                if self.admin_handler and (text.startswith('/admin') or text in ['📊 Статистика', '📦 Заказы', '🛠 Товары', '👥 Пользователи', '🔙 Пользовательский режим']):
-                                    self.admin_handler.handle_admin_command(message)
-                                elif self.admin_handler and text in ['📈 Аналитика', '🛡 Безопасность', '💰 Финансы', '📦 Склад', '🤖 AI', '🎯 Автоматизация', '👥 CRM', '📢 Рассылка']:
-                                    self.admin_handler.handle_admin_command(message)
-                                elif self.admin_handler and text.startswith('/admin_order_'):
-                                    self.admin_handler.handle_order_management(message)
-                                elif self.admin_handler and (text.startswith('/edit_product_') or text.startswith('/delete_product_')):
-                                    self.admin_handler.handle_product_commands(message)
-                                elif self.admin_handler and hasattr(self.admin_handler, 'admin_states') and self.admin_handler.admin_states.get(telegram_id):
-                                    state = self.admin_handler.admin_states.get(telegram_id, '')
-                                    if state.startswith('adding_product_'):
-                                        self.admin_handler.handle_add_product_process(message)
-                                    elif state.startswith('creating_broadcast_'):
-                                        self.admin_handler.handle_broadcast_creation(message)
-                                elif text == '/notifications':
-                                    self.show_user_notifications(message)
-                                else:
-                                    self.message_handler.handle_message(message)
-                            elif 'callback_query' in update:
-                                callback_query = update['callback_query']
-                                data = callback_query['data']
-                                telegram_id = callback_query['from']['id']
-                                
-                                # Проверяем админ callback'и
-                                if self.admin_handler and (data.startswith('admin_') or data.startswith('change_status_') or data.startswith('order_details_')):
-                                    self.admin_handler.handle_callback_query(callback_query)
-                                elif self.admin_handler and (data.startswith('analytics_') or data.startswith('period_')):
-                                    self.admin_handler.handle_analytics_callback(callback_query)
-                                elif self.admin_handler and data.startswith('export_'):
-                                    self.admin_handler.handle_export_callback(callback_query)
-                                elif self.admin_handler and (data.startswith('security_') or data.startswith('unblock_user_')):
-                                    if hasattr(self.admin_handler, 'handle_security_callback'):
-                                        self.admin_handler.handle_security_callback(callback_query)
-                                    else:
-                                        self.admin_handler.handle_callback_query(callback_query)
-                                elif self.admin_handler and data.startswith('broadcast_'):
-                                    if hasattr(self.admin_handler, 'handle_broadcast_callback'):
-                                        self.admin_handler.handle_broadcast_callback(callback_query)
-                                    else:
-                                        self.admin_handler.handle_callback_query(callback_query)
-                                else:
-                                    self.message_handler.handle_callback_query(callback_query)
-                        except Exception as e:
-                            logger.error(f"Ошибка обработки обновления: {e}", exc_info=True)
-                            self.health_monitor.increment_errors(str(e))
-                else:
-                    logger.warning("getUpdates returned empty/invalid — backing off")
-                    time.sleep(3)
-                
-                time.sleep(1)
+            if UPDATES_CONFIG['mode'] == 'webhook' and self.start_webhook_mode():
+                # Update приходят в потоки HTTP-сервера, здесь только ждем остановки
+                while self.running:
+                    time.sleep(1)
+            else:
+                self.poll_updates()
                 
         except KeyboardInterrupt:
             logger.info("🛑 Бот остановлен пользователем")
+        except SystemExit:
+            pass
         except Exception as e:
             logger.critical(f"Критическая ошибка: {e}", exc_info=True)
         finally:
-            logger.info("🔄 Закрытие соединений...")
+            self._polling = False
             self.running = False
+            logger.info(f"🔄 Дообработка очереди update ({self.dispatcher.pending()})...")
+            if self.dispatcher.shutdown():
+                self.confirm_offset()
+            else:
+                # Необработанные update (и следующие за ними) Telegram пришлет снова после перезапуска
+                oldest = self.dispatcher.oldest_unprocessed()
+                self.confirm_offset(oldest)
+                logger.warning(f"Update подтверждены до {oldest}, остальные будут получены повторно")
+            self.broadcasts.stop()
+            self.jobs.stop()
+            self.notification_manager.stop_push_service()
+            logger.info("🔄 Закрытие соединений...")
+            self.api.close()
+
+    def poll_updates(self):
+        """Long polling getUpdates с передачей update диспетчеру"""
+        while self.running:
+            self._polling = True
+            updates = self.get_updates()
+            self._polling = False
+            
+            if updates and updates.get('ok'):
+                self.error_count = 0  # Сбрасываем счетчик ошибок при успехе
+                
+                for update in updates['result']:
+                    # Блокируется, пока очередь чата заполнена
+                    if not self.dispatcher.submit(update):
+                        break
+                    self.offset = update['update_id'] + 1
+            elif self.running:
+                logger.warning("getUpdates returned empty/invalid — backing off")
+                time.sleep(3)
     
     def show_user_notifications(self, message):
         """Показ уведомлений пользователя"""
@@ -957,22 +871,14 @@ class TelegramShopBot:
     
     def edit_message_reply_markup(self, chat_id, message_id, reply_markup):
         """Редактирование клавиатуры сообщения"""
-        url = f"{self.base_url}/editMessageReplyMarkup"
-        data = {
+        result = self.api.request('editMessageReplyMarkup', {
             'chat_id': chat_id,
             'message_id': message_id,
-            'reply_markup': json.dumps(reply_markup)
-        }
-        
-        try:
-            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=data_encoded, method='POST')
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                return result.get('ok', False)
-        except Exception as e:
-            logging.info(f"Ошибка редактирования клавиатуры: {e}")
-            return False
+            'reply_markup': reply_markup
+        })
+        if not result.get('ok'):
+            logging.info(f"Ошибка редактирования клавиатуры: {result.get('error') or result.get('description')}")
+        return result.get('ok', False)
 
 def main():
     """Главная функция"""
@@ -1,5 +1,15 @@
 """
 Модуль маркетинговой автоматизации
+
+Правила проверяются инкрементально: у каждого правила есть отметка (последнее
+обработанное событие change_events и время прошлого прогона), и условия
+считаются только для пользователей, затронутых с тех пор. Заказы и поступления
+на склад пишутся в change_events триггерами (миграция 11), брошенные корзины —
+это позиции корзины, чей возраст перешел порог между двумя прогонами.
+
+Правила разбираются один раз в CompiledRule (до изменения правила), а все
+правила одного типа триггера проверяются по общей сводке пользователей,
+поэтому стоимость прогона растет с числом пользователей, а не пользователей × правил.
 """
 import logging
 
@@ -8,15 +18,85 @@ from utils import format_price, format_date
 import json
 import threading
 import time
+from collections import namedtuple
+
+try:
+    from config import AUTOMATION_CONFIG
+except Exception:
+    AUTOMATION_CONFIG = {}
+
+SEASONAL_MONTHS = {
+    'winter': [12, 1, 2],
+    'spring': [3, 4, 5],
+    'summer': [6, 7, 8],
+    'autumn': [9, 10, 11]
+}
+
+# Сводка по пользователю, общая для всех правил одного типа триггера
+UserAggregate = namedtuple('UserAggregate', 'user_id spend order_count last_order_at cart_value last_cart_at')
+
+# Правила, которые проверяются по сводке пользователей
+USER_TRIGGERS = ('cart_abandonment', 'customer_milestone')
+
+
+def _shift(timestamp, hours):
+    """Время 'YYYY-MM-DD HH:MM:SS' минус hours часов (строки сравниваются как даты)"""
+    moment = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S') - timedelta(hours=hours)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class CompiledRule:
+    """Правило, разобранное один раз: условия превращены в предикат над UserAggregate"""
+
+    def __init__(self, rule_id, name, trigger_type, conditions_json, actions_json):
+        self.id = rule_id
+        self.name = name
+        self.trigger_type = trigger_type
+        self.signature = (trigger_type, conditions_json, actions_json)
+        self.conditions = json.loads(conditions_json or '{}')
+        self.actions = json.loads(actions_json or '[]')
+        self.repeat_after_days = int(self.conditions.get('repeat_after_days', 30))
+        self.hours = int(self.conditions.get('hours_since_last_activity', 24))
+        self.predicate = self._compile()
+
+    def _compile(self):
+        conditions = self.conditions
+        if self.trigger_type == 'cart_abandonment':
+            min_cart_value = conditions.get('min_cart_value', 0)
+
+            def abandoned(agg, cutoff):
+                # В корзине ничего не менялось hours часов и за это время не было заказов
+                return (agg.cart_value >= min_cart_value and agg.last_cart_at is not None
+                        and agg.last_cart_at <= cutoff
+                        and (agg.last_order_at is None or agg.last_order_at < cutoff))
+            return abandoned
+        if self.trigger_type == 'customer_milestone':
+            milestone_type = conditions.get('milestone_type')
+            if milestone_type == 'first_order':
+                return lambda agg, cutoff: agg.order_count == 1
+            if milestone_type == 'spending_threshold':
+                threshold = conditions.get('spending_amount', 500)
+                return lambda agg, cutoff: agg.spend >= threshold
+        return lambda agg, cutoff: False
+
+    def cutoff(self, now):
+        return _shift(now, self.hours)
+
 
 class MarketingAutomationManager:
     def __init__(self, db, notification_manager):
         self.db = db
         self.notification_manager = notification_manager
         self.automation_rules = {}
+        self.interval = AUTOMATION_CONFIG.get('interval', 300)
+        self.min_interval = AUTOMATION_CONFIG.get('min_interval', 10)
+        self._wake = threading.Event()
+        self.stats = {'runs': 0, 'full_runs': 0, 'compiled': 0, 'candidates': 0, 'executions': 0, 'last_run_ms': 0}
+        self._compiled = {}
         self.start_automation_engine()
     
     def start_automation_engine(self):
+        """Запуск движка автоматизации"""
         # Cleanup: deactivate duplicate rules with same name+trigger, keep smallest id
         try:
             dups = self.db.execute_query('''
@@ -29,19 +109,24 @@ class MarketingAutomationManager:
                 self.db.execute_query('UPDATE automation_rules SET is_active = 0 WHERE name = ? AND trigger_type = ? AND id <> ?', (name, trig, keep_id))
         except Exception as e:
             logging.info(f"deduplicate rules warn: {e}")
-        """Запуск движка автоматизации"""
         def automation_worker():
             while True:
                 try:
                     self.process_automation_rules()
-                    time.sleep(300)  # Проверяем каждые 5 минут
                 except Exception as e:
                     logging.info(f"Ошибка автоматизации: {e}")
-                    time.sleep(60)
+                # Новые заказы будят движок сразу, брошенные корзины проверяются по таймеру
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                time.sleep(self.min_interval)  # события за это время обработаются одной пачкой
         
         automation_thread = threading.Thread(target=automation_worker, daemon=True)
         automation_thread.start()
     
+    def on_events(self, entities, events):
+        """Подписчик канала изменений: заказы и поступления на склад"""
+        self._wake.set()
+    
     def create_automation_rule(self, rule_name, trigger_type, conditions, actions):
         """Создание правила автоматизации"""
                 # Avoid duplicates: reuse existing active rule with same name+trigger
@@ -72,136 +157,248 @@ class MarketingAutomationManager:
         
         return rule_id
     
+    def load_rules(self):
+        """Активные правила с отметками; заново разбираются только изменившиеся правила"""
+        rows = self.db.execute_query('''
+            SELECT r.id, r.name, r.trigger_type, r.conditions, r.actions, w.last_event_id, w.last_run_at
+            FROM automation_rules r
+            LEFT JOIN automation_watermarks w ON w.rule_id = r.id
+            WHERE r.is_active = 1
+        ''') or []
+        compiled = {}
+        rules = []
+        for rule_id, name, trigger_type, conditions_json, actions_json, last_event_id, last_run_at in rows:
+            rule = self._compiled.get(rule_id)
+            if rule is None or rule.signature != (trigger_type, conditions_json, actions_json):
+                try:
+                    rule = CompiledRule(rule_id, name, trigger_type, conditions_json, actions_json)
+                except (ValueError, TypeError) as e:
+                    logging.info(f"Ошибка разбора правила {name}: {e}")
+                    continue
+                self.stats['compiled'] += 1
+            compiled[rule_id] = rule
+            rules.append((rule, last_event_id or 0, last_run_at))
+        self._compiled = compiled
+        return rules
+    
     def process_automation_rules(self):
-        """Обработка правил автоматизации"""
-        # Загружаем активные правила
-        active_rules = self.db.execute_query('''
-            SELECT id, name, trigger_type, conditions, actions
-            FROM automation_rules
-            WHERE is_active = 1
-        ''')
+        """Обработка правил автоматизации по событиям с прошлого прогона"""
+        started = time.perf_counter()
+        rules = self.load_rules()
+        head, floor = self.db.execute_query(
+            'SELECT IFNULL(MAX(id), 0), IFNULL(MIN(id), 0) FROM change_events'
+        )[0]
+        now = self.db.execute_query("SELECT datetime('now')")[0][0]
         
-        for rule in active_rules:
-            rule_id, name, trigger_type, conditions_json, actions_json = rule
-            
+        # Правила одного типа триггера проверяются вместе, по одной сводке пользователей
+        groups = {}
+        for rule, last_event_id, last_run_at in rules:
+            # Первый прогон или события удалены из журнала раньше, чем мы их прочли — полная проверка
+            full = last_run_at is None or bool(floor and last_event_id < floor - 1)
+            watermark = {'last_event_id': last_event_id, 'last_run_at': last_run_at,
+                         'head': head, 'now': now, 'full': full}
+            groups.setdefault(rule.trigger_type, []).append((rule, watermark))
+            self.stats['full_runs'] += full
+        
+        executions = []
+        watermarks = []
+        for trigger_type, group in groups.items():
             try:
-                conditions = json.loads(conditions_json)
-                actions = json.loads(actions_json)
-                
-                # Проверяем условия срабатывания
-                if self.check_trigger_conditions(trigger_type, conditions):
-                    self.execute_automation_actions(rule_id, actions)
-                    
+                if trigger_type in USER_TRIGGERS:
+                    fired = self.evaluate_user_rules(group)
+                else:
+                    fired = {rule.id: self.find_triggered(rule, watermark) for rule, watermark in group}
             except Exception as e:
-                logging.info(f"Ошибка обработки правила {name}: {e}")
+                logging.info(f"Ошибка проверки правил {trigger_type}: {e}")
+                continue
+            for rule, watermark in group:
+                try:
+                    if fired.get(rule.id):
+                        executions.extend(self.execute_automation_actions(rule.id, rule.actions, fired[rule.id], trigger_type))
+                    watermarks.append((rule.id, head, now))
+                except Exception as e:
+                    logging.info(f"Ошибка обработки правила {rule.name}: {e}")
+        
+        # Выполнения и отметки правил — одной транзакцией
+        with self.db.transaction():
+            if executions:
+                self.db.execute_many('''
+                    INSERT INTO automation_executions (rule_id, user_id, rule_type, executed_at)
+                    VALUES (?, ?, ?, ?)
+                ''', executions)
+            if watermarks:
+                self.db.execute_many('''
+                    INSERT INTO automation_watermarks (rule_id, last_event_id, last_run_at) VALUES (?, ?, ?)
+                    ON CONFLICT(rule_id) DO UPDATE SET
+                        last_event_id = excluded.last_event_id, last_run_at = excluded.last_run_at
+                ''', watermarks)
+        self.stats['runs'] += 1
+        self.stats['executions'] += len(executions)
+        self.stats['last_run_ms'] = round((time.perf_counter() - started) * 1000, 1)
     
-    def check_trigger_conditions(self, trigger_type, conditions):
-        """Проверка условий срабатывания"""
-        if trigger_type == 'cart_abandonment':
-            # Проверяем брошенные корзины
-            hours_threshold = conditions.get('hours_since_last_activity', 24)
-            min_cart_value = conditions.get('min_cart_value', 0)
-            
-            abandoned_carts = self.db.execute_query('''
-                SELECT DISTINCT c.user_id
-                FROM cart c
-                JOIN products p ON c.product_id = p.id
-                WHERE c.created_at <= datetime('now', '-{} hours')
-                AND c.user_id NOT IN (
-                    SELECT DISTINCT user_id FROM orders 
-                    WHERE created_at >= datetime('now', '-{} hours')
-                )
+    def _touched(self, entity, watermark, action=None):
+        """id из событий сущности после отметки правила (для заказов — user_id); action — только такие события"""
+        rows = self.db.execute_query('''
+            SELECT DISTINCT entity_id FROM change_events
+            WHERE id > ? AND id <= ? AND entity = ? AND (? IS NULL OR action = ?)
+        ''', (watermark['last_event_id'], watermark['head'], entity, action, action)) or []
+        return [row[0] for row in rows]
+    
+    def _candidates(self, rule, watermark):
+        """Пользователи, которых правилу стоит проверить; None — все пользователи"""
+        if rule.trigger_type == 'cart_abandonment':
+            # Последнее действие с корзиной перешло порог между прошлым и текущим прогоном
+            since = '1970-01-01 00:00:00' if watermark['full'] else rule.cutoff(watermark['last_run_at'])
+            rows = self.db.execute_query('''
+                SELECT DISTINCT user_id FROM cart WHERE created_at > ? AND created_at <= ?
+            ''', (since, rule.cutoff(watermark['now']))) or []
+            return [row[0] for row in rows]
+        first_order = rule.conditions.get('milestone_type') == 'first_order'
+        if not watermark['full']:
+            # Первый заказ — только по новым заказам: смена статуса или суммы того же
+            # единственного заказа не должна отправлять поздравление повторно
+            return self._touched('orders', watermark, 'insert' if first_order else None)
+        if first_order:
+            rows = self.db.execute_query('''
+                SELECT DISTINCT user_id FROM orders WHERE created_at >= datetime('now', '-1 hour')
+            ''') or []
+            return [row[0] for row in rows]
+        return None
+    
+    def user_snapshot(self, user_ids=None):
+        """Сводка по пользователям (все, если user_ids=None): траты, заказы, последняя активность, корзина"""
+        if user_ids is None:
+            # Полный прогон: по одному GROUP BY на заказы и корзины, соединяем по user_id в памяти
+            snapshot = {row[0]: [row[0], 0, 0, None, 0, None] for row in self.db.execute_query('SELECT id FROM users') or []}
+            for user_id, spend, order_count, last_order_at in self.db.execute_query('''
+                SELECT user_id, SUM(CASE WHEN status != 'cancelled' THEN total_amount ELSE 0 END),
+                       SUM(status != 'cancelled'), MAX(created_at)
+                FROM orders GROUP BY user_id
+            ''') or []:
+                if user_id in snapshot:
+                    snapshot[user_id][1:4] = [spend or 0, order_count or 0, last_order_at]
+            for user_id, cart_value, last_cart_at in self.db.execute_query('''
+                SELECT c.user_id, SUM(p.price * c.quantity), MAX(c.created_at)
+                FROM cart c JOIN products p ON c.product_id = p.id
                 GROUP BY c.user_id
-                HAVING SUM(p.price * c.quantity) >= ?
-            '''.format(hours_threshold, hours_threshold), (min_cart_value,))
-            
-            return len(abandoned_carts) > 0
+            ''') or []:
+                if user_id in snapshot:
+                    snapshot[user_id][4:6] = [cart_value or 0, last_cart_at]
+            return {user_id: UserAggregate(*values) for user_id, values in snapshot.items()}
         
-        elif trigger_type == 'customer_milestone':
-            # Проверяем достижения клиентов
-            milestone_type = conditions.get('milestone_type')
-            
-            if milestone_type == 'first_order':
-                # Клиенты, сделавшие первый заказ за последний час
-                first_orders = self.db.execute_query('''
-                    SELECT user_id FROM orders
-                    WHERE created_at >= datetime('now', '-1 hour')
-                    AND user_id NOT IN (
-                        SELECT DISTINCT user_id FROM orders
-                        WHERE created_at < datetime('now', '-1 hour')
-                    )
-                ''')
-                return len(first_orders) > 0
-            
-            elif milestone_type == 'spending_threshold':
-                threshold = conditions.get('spending_amount', 500)
-                # Клиенты, достигшие порога трат
-                milestone_customers = self.db.execute_query('''
-                    SELECT user_id, SUM(total_amount) as total_spent
-                    FROM orders
-                    WHERE status != 'cancelled'
-                    GROUP BY user_id
-                    HAVING total_spent >= ?
-                    AND user_id NOT IN (
-                        SELECT user_id FROM automation_executions
-                        WHERE rule_type = 'spending_milestone'
-                        AND created_at >= datetime('now', '-30 days')
-                    )
-                ''', (threshold,))
-                return len(milestone_customers) > 0
-        
-        elif trigger_type == 'product_restock':
-            # Проверяем поступления товаров
-            restocked_products = self.db.execute_query('''
-                SELECT product_id FROM inventory_movements
-                WHERE movement_type = 'inbound'
-                AND created_at >= datetime('now', '-1 hour')
-            ''')
-            return len(restocked_products) > 0
+        # Затронутые пользователи: точечные подзапросы по индексам user_id
+        rows = self.db.execute_query('''
+            SELECT s.value,
+                (SELECT IFNULL(SUM(total_amount), 0) FROM orders WHERE user_id = s.value AND status != 'cancelled'),
+                (SELECT COUNT(*) FROM orders WHERE user_id = s.value AND status != 'cancelled'),
+                (SELECT MAX(created_at) FROM orders WHERE user_id = s.value),
+                (SELECT IFNULL(SUM(p.price * c.quantity), 0) FROM cart c JOIN products p ON c.product_id = p.id
+                 WHERE c.user_id = s.value),
+                (SELECT MAX(created_at) FROM cart WHERE user_id = s.value)
+            FROM json_each(?) s
+        ''', (json.dumps(sorted(u for u in user_ids if u is not None)),)) or []
+        return {row[0]: UserAggregate(*row) for row in rows}
+    
+    def evaluate_user_rules(self, group):
+        """Все правила группы за один проход по общей сводке: {rule_id: [user_id]}"""
+        candidates = {rule.id: self._candidates(rule, watermark) for rule, watermark in group}
+        if any(users is None for users in candidates.values()):
+            snapshot = self.user_snapshot()
+        else:
+            union = set().union(*candidates.values())
+            if not union:
+                return {}
+            snapshot = self.user_snapshot(union)
+        self.stats['candidates'] += len(snapshot)
         
-        elif trigger_type == 'seasonal':
-            # Сезонные триггеры
-            season = conditions.get('season')
-            current_month = datetime.now().month
-            
-            seasonal_months = {
-                'winter': [12, 1, 2],
-                'spring': [3, 4, 5],
-                'summer': [6, 7, 8],
-                'autumn': [9, 10, 11]
-            }
-            
-            return current_month in seasonal_months.get(season, [])
+        fired = {}
+        for rule, watermark in group:
+            cutoff = rule.cutoff(watermark['now'])
+            users = candidates[rule.id]
+            pool = snapshot.values() if users is None else [snapshot[user_id] for user_id in users if user_id in snapshot]
+            matched = [agg.user_id for agg in pool if rule.predicate(agg, cutoff)]
+            if matched:
+                fired[rule.id] = matched
+        return self._drop_repeats(group, fired)
+    
+    def _drop_repeats(self, group, fired):
+        """Убираем пользователей, которым правило уже срабатывало за repeat_after_days (один запрос на группу)"""
+        if not fired:
+            return fired
+        users = set().union(*fired.values())
+        rows = self.db.execute_query('''
+            SELECT rule_id, user_id, MAX(executed_at) FROM automation_executions
+            WHERE rule_id IN (SELECT value FROM json_each(?)) AND user_id IN (SELECT value FROM json_each(?))
+            GROUP BY rule_id, user_id
+        ''', (json.dumps(sorted(fired)), json.dumps(sorted(users)))) or []
+        last_executed = {(rule_id, user_id): executed_at for rule_id, user_id, executed_at in rows}
+        rules = {rule.id: rule for rule, _watermark in group}
+        result = {}
+        for rule_id, matched in fired.items():
+            # executed_at пишется по локальному времени
+            since = (datetime.now() - timedelta(days=rules[rule_id].repeat_after_days)).strftime('%Y-%m-%d %H:%M:%S')
+            fresh = [user_id for user_id in matched if (last_executed.get((rule_id, user_id)) or '') < since]
+            if fresh:
+                result[rule_id] = fresh
+        return result
+    
+    def find_triggered(self, rule, watermark):
+        """Правила без привязки к пользователям: True, если сработало"""
+        if rule.trigger_type == 'product_restock':
+            # Поступления товаров после прошлого прогона
+            if watermark['full']:
+                return bool(self.db.execute_query('''
+                    SELECT 1 FROM inventory_movements
+                    WHERE movement_type = 'inbound' AND created_at >= datetime('now', '-1 hour')
+                    LIMIT 1
+                '''))
+            return bool(self._touched('inventory_movements', watermark))
+        
+        elif rule.trigger_type == 'seasonal':
+            # Сезонный триггер срабатывает один раз — при наступлении сезона
+            months = SEASONAL_MONTHS.get(rule.conditions.get('season'), [])
+            last_run_at = watermark['last_run_at']
+            last_month = datetime.strptime(last_run_at, '%Y-%m-%d %H:%M:%S').month if last_run_at else None
+            return datetime.now().month in months and last_month not in months
         
         return False
     
-    def execute_automation_actions(self, rule_id, actions):
-        """Выполнение действий автоматизации"""
+    def execute_automation_actions(self, rule_id, actions, users=None, rule_type=None):
+        """Выполнение действий автоматизации; возвращает строки для automation_executions"""
+        # users — сработавшие пользователи; True — правило без привязки к пользователям
+        users = users if isinstance(users, list) else None
         for action in actions:
             action_type = action.get('type')
             
             if action_type == 'send_notification':
-                self.execute_notification_action(rule_id, action)
+                self.execute_notification_action(rule_id, action, users)
             elif action_type == 'create_promo_code':
                 self.execute_promo_creation_action(rule_id, action)
             elif action_type == 'update_product_price':
                 self.execute_price_update_action(rule_id, action)
             elif action_type == 'send_personalized_offer':
-                self.execute_personalized_offer_action(rule_id, action)
+                self.execute_personalized_offer_action(rule_id, action, users)
         
-        # Записываем выполнение
-        self.db.execute_query('''
-            INSERT INTO automation_executions (rule_id, executed_at)
-            VALUES (?, ?)
-        ''', (rule_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        executed_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if users:
+            return [(rule_id, user_id, rule_type, executed_at) for user_id in users]
+        return [(rule_id, None, rule_type, executed_at)]
     
-    def execute_notification_action(self, rule_id, action):
+    def execute_notification_action(self, rule_id, action, users=None):
         """Выполнение действия отправки уведомления"""
         target_audience = action.get('target_audience', 'all')
         message_template = action.get('message_template', '')
         notification_type = action.get('notification_type', 'promotion')
         
         # Определяем целевую аудиторию
+        if users is not None:
+            # Сработавшие по событиям пользователи; повторы отсекает automation_executions
+            for user_id in users:
+                self.notification_manager.send_instant_push(
+                    user_id, 'Автоматическое уведомление',
+                    self.personalize_message(user_id, message_template), notification_type
+                )
+            return
         if target_audience == 'abandoned_cart':
             target_users = self.db.execute_query('''
                 SELECT DISTINCT c.user_id
@@ -330,17 +527,19 @@ class MarketingAutomationManager:
                     (new_price, product_id)
                 )
     
-    def execute_personalized_offer_action(self, rule_id, action):
+    def execute_personalized_offer_action(self, rule_id, action, users=None):
         """Создание персональных предложений"""
         from crm import CRMManager
         crm = CRMManager(self.db)
         
-        # Получаем клиентов для персональных предложений
-        segments = crm.segment_customers()
-        target_segment = action.get('target_segment', 'need_attention')
+        # Сработавшим по событиям пользователям — им, иначе клиентам сегмента
+        if users is not None:
+            customers = [(user_id,) for user_id in users]
+        else:
+            target_segment = action.get('target_segment', 'need_attention')
+            customers = crm.get_segment(target_segment, limit=10)
         
-        if target_segment in segments:
-            customers = segments[target_segment]
+        if customers:
             
             for customer in customers[:10]:  # Ограничиваем 10 клиентами за раз
                 user_id = customer[0]
@@ -420,25 +619,39 @@ class MarketingAutomationManager:
                 message['title'],
                 message['message'],
                 message['delay_hours'] * 60,  # Конвертируем в минуты
-                message['type']
+                message['type'],
+                idempotency_key=f"welcome:{user_id}:{message['delay_hours']}"
             )
     
     def create_win_back_campaign(self, days_inactive=60):
         """Кампания возврата неактивных клиентов"""
-        inactive_customers = self.db.execute_query('''
-            SELECT 
-                u.id, u.name, u.telegram_id,
-                MAX(o.created_at) as last_order,
-                SUM(o.total_amount) as total_spent
-            FROM users u
-            JOIN orders o ON u.id = o.user_id
-            WHERE u.is_admin = 0
-            AND o.status != 'cancelled'
-            GROUP BY u.id, u.name, u.telegram_id
-            HAVING julianday('now') - julianday(MAX(o.created_at)) >= ?
-            AND total_spent >= 50
-            ORDER BY total_spent DESC
-        ''', (days_inactive,))
+        from customer_scores import CURRENT_SCORES, CustomerScores
+        if CustomerScores(self.db).is_fresh():
+            # Пакетные оценки: сначала клиенты с наибольшим риском оттока
+            inactive_customers = self.db.execute_query(f'''
+                SELECT u.id, u.name, u.telegram_id, s.last_order_at, s.total_spent
+                FROM {CURRENT_SCORES}
+                JOIN users u ON u.id = s.user_id
+                WHERE u.is_admin = 0
+                AND s.last_order_at <= datetime('now', ?)
+                AND s.total_spent >= 50
+                ORDER BY s.churn_score DESC, s.total_spent DESC
+            ''', (f'-{int(days_inactive)} days',))
+        else:
+            inactive_customers = self.db.execute_query('''
+                SELECT 
+                    u.id, u.name, u.telegram_id,
+                    MAX(o.created_at) as last_order,
+                    SUM(o.total_amount) as total_spent
+                FROM users u
+                JOIN orders o ON u.id = o.user_id
+                WHERE u.is_admin = 0
+                AND o.status != 'cancelled'
+                GROUP BY u.id, u.name, u.telegram_id
+                HAVING julianday('now') - julianday(MAX(o.created_at)) >= ?
+                AND total_spent >= 50
+                ORDER BY total_spent DESC
+            ''', (days_inactive,))
         
         campaign_results = []
         
@@ -478,8 +691,7 @@ class MarketingAutomationManager:
         from crm import CRMManager
         crm = CRMManager(self.db)
         
-        segments = crm.segment_customers()
-        target_customers = segments.get(target_segment, [])
+        target_customers = crm.get_segment(target_segment)
         
         upsell_results = []
         
@@ -4,113 +4,177 @@
 import logging
 
 from datetime import datetime, timedelta
+from database import day_range
 from utils import format_date, format_price
+from rate_governor import BULK, INTERACTIVE, outbound_priority
+from delayed_queue import DelayedQueue
 import threading
 import time
 
+try:
+    from config import NOTIFICATIONS_CONFIG
+except Exception:
+    NOTIFICATIONS_CONFIG = {}
+
 class NotificationManager:
     def __init__(self, bot, db):
         self.bot = bot
         self.db = db
-        self.push_queue = []
+        self.push_queue = DelayedQueue()
+        self.jobs = None
+        self.push_workers = NOTIFICATIONS_CONFIG.get('push_workers', 4)
+        self.max_attempts = NOTIFICATIONS_CONFIG.get('max_attempts', 3)
+        self.retry_delay = NOTIFICATIONS_CONFIG.get('retry_delay', 30)
+        self.push_stats = {'sent': 0, 'failed': 0, 'retried': 0, 'dropped': 0, 'max_lag': 0.0, 'last_lag': 0.0}
+        self._stats_lock = threading.Lock()
         self.start_push_service()
     
     def start_push_service(self):
-        """Запуск службы push-уведомлений"""
+        """Запуск службы push-уведомлений: пул потоков над очередью с отложенной выдачей"""
         def push_worker():
             while True:
+                entry = self.push_queue.get()
+                if entry is None:
+                    return
+                notification, lag = entry
+                with self._stats_lock:
+                    self.push_stats['last_lag'] = round(lag, 3)
+                    self.push_stats['max_lag'] = max(self.push_stats['max_lag'], round(lag, 3))
                 try:
-                    if self.push_queue:
-                        notification = self.push_queue.pop(0)
-                        self.send_push_notification(notification)
-                    time.sleep(1)
+                    self.send_push_notification(notification)
                 except Exception as e:
                     logging.info(f"Ошибка push-службы: {e}")
         
-        push_thread = threading.Thread(target=push_worker, daemon=True)
-        push_thread.start()
+        for _ in range(self.push_workers):
+            threading.Thread(target=push_worker, daemon=True).start()
+    
+    def stop_push_service(self):
+        self.push_queue.close()
+    
+    def get_push_stats(self):
+        """Очередь push-уведомлений для мониторинга"""
+        with self._stats_lock:
+            stats = dict(self.push_stats)
+        stats.update(self.push_queue.get_stats())
+        return stats
     
-    def queue_push_notification(self, user_id, title, message, notification_type='info', delay_seconds=0):
+    def use_job_queue(self, jobs):
+        """Отложенные уведомления — через постоянную очередь заданий, чтобы пережить перезапуск"""
+        self.jobs = jobs
+        jobs.register('push', self.deliver_push)
+        jobs.register('notification', self.run_scheduled_notification)
+    
+    def queue_push_notification(self, user_id, title, message, notification_type='info', delay_seconds=0,
+                                idempotency_key=None):
         """Добавление push-уведомления в очередь"""
         notification = {
             'user_id': user_id,
             'title': title,
             'message': message,
             'type': notification_type,
-            'scheduled_time': datetime.now() + timedelta(seconds=delay_seconds),
             'attempts': 0,
-            'max_attempts': 3
+            'max_attempts': self.max_attempts
         }
-        self.push_queue.append(notification)
+        if self.jobs is not None and (delay_seconds > 0 or idempotency_key):
+            try:
+                self.jobs.enqueue('push', notification, delay_seconds, idempotency_key)
+                return
+            except Exception as e:
+                logging.info(f"Не удалось сохранить отложенный push, остается в памяти: {e}")
+        self.push_queue.put(notification, delay_seconds)
     
     def send_push_notification(self, notification):
-        """Отправка push-уведомления"""
-        if datetime.now() < notification['scheduled_time']:
-            # Возвращаем в очередь если время еще не пришло
-            self.push_queue.append(notification)
-            return
-        
+        """Отправка push-уведомления из очереди в памяти с повторами"""
         try:
-            # Получаем telegram_id пользователя
-            user = self.db.execute_query(
-                'SELECT telegram_id, language FROM users WHERE id = ?',
-                (notification['user_id'],)
-            )
-            
-            if user:
-                telegram_id, language = user[0]
-                
-                # Локализуем сообщение
-                from localization import t
-                localized_title = t(notification['title'], language=language) if notification['title'].startswith('push_') else notification['title']
-                localized_message = t(notification['message'], language=language) if notification['message'].startswith('push_') else notification['message']
-                
-                # Добавляем эмодзи в зависимости от типа
-                type_emojis = {
-                    'order': '📦',
-                    'payment': '💳',
-                    'delivery': '🚚',
-                    'promotion': '🎁',
-                    'reminder': '⏰',
-                    'warning': '⚠️',
-                    'success': '✅',
-                    'info': 'ℹ️'
-                }
-                
-                emoji = type_emojis.get(notification['type'], '📱')
-                push_text = f"{emoji} <b>{localized_title}</b>\n\n{localized_message}"
-                
-                # Отправляем уведомление
-                result = self.bot.send_message(telegram_id, push_text)
-                
-                if result and result.get('ok'):
-                    # Сохраняем в базу как доставленное
-                    self.db.add_notification(
-                        notification['user_id'],
-                        localized_title,
-                        localized_message,
-                        notification['type']
-                    )
-                    logging.info(f"✅ Push отправлен пользователю {telegram_id}")
-                else:
-                    raise Exception("Не удалось отправить сообщение")
-                    
+            self.deliver_push(notification)
         except Exception as e:
             notification['attempts'] += 1
             logging.info(f"❌ Ошибка отправки push пользователю {notification['user_id']}: {e}")
             
-            # Повторная попытка если не превышен лимит
+            # Повторная попытка с экспоненциальной задержкой, если не превышен лимит
             if notification['attempts'] < notification['max_attempts']:
-                notification['scheduled_time'] = datetime.now() + timedelta(minutes=5)
-                self.push_queue.append(notification)
+                with self._stats_lock:
+                    self.push_stats['retried'] += 1
+                self.push_queue.put(notification, self.retry_delay * 2 ** (notification['attempts'] - 1))
+            else:
+                with self._stats_lock:
+                    self.push_stats['failed'] += 1
+    
+    def deliver_push(self, notification):
+        """Одна попытка отправки push; исключение — временная ошибка, стоит повторить"""
+        # Получаем telegram_id пользователя
+        user = self.db.execute_query(
+            'SELECT telegram_id, language FROM users WHERE id = ?',
+            (notification['user_id'],)
+        )
+        
+        if user:
+            telegram_id, language = user[0]
+            
+            # Локализуем сообщение
+            from localization import t
+            localized_title = t(notification['title'], language=language) if notification['title'].startswith('push_') else notification['title']
+            localized_message = t(notification['message'], language=language) if notification['message'].startswith('push_') else notification['message']
+            
+            # Добавляем эмодзи в зависимости от типа
+            type_emojis = {
+                'order': '📦',
+                'payment': '💳',
+                'delivery': '🚚',
+                'promotion': '🎁',
+                'reminder': '⏰',
+                'warning': '⚠️',
+                'success': '✅',
+                'info': 'ℹ️'
+            }
+            
+            emoji = type_emojis.get(notification['type'], '📱')
+            push_text = f"{emoji} <b>{localized_title}</b>\n\n{localized_message}"
+            
+            # Отправляем уведомление; рекламные уступают ответам пользователям
+            priority = BULK if notification['type'] == 'promotion' else INTERACTIVE
+            with outbound_priority(priority):
+                result = self.bot.send_message(telegram_id, push_text)
+            
+            if result and result.get('ok'):
+                # Сохраняем в базу как доставленное
+                self.db.add_notification(
+                    notification['user_id'],
+                    localized_title,
+                    localized_message,
+                    notification['type']
+                )
+                with self._stats_lock:
+                    self.push_stats['sent'] += 1
+                logging.info(f"✅ Push отправлен пользователю {telegram_id}")
+            elif result and result.get('error_code') in (400, 403):
+                # Бот заблокирован или чат недоступен — повтор не поможет
+                with self._stats_lock:
+                    self.push_stats['dropped'] += 1
+                logging.info(f"❌ Push пользователю {telegram_id} не доставлен: {result.get('description')}")
+            else:
+                raise Exception("Не удалось отправить сообщение")
     
     def send_instant_push(self, user_id, title, message, notification_type='info'):
         """Мгновенная отправка push-уведомления"""
         self.queue_push_notification(user_id, title, message, notification_type, 0)
     
-    def send_delayed_push(self, user_id, title, message, delay_minutes=0, notification_type='reminder'):
-        """Отложенное push-уведомление"""
-        self.queue_push_notification(user_id, title, message, notification_type, delay_minutes * 60)
+    def send_delayed_push(self, user_id, title, message, delay_minutes=0, notification_type='reminder',
+                          idempotency_key=None):
+        """Отложенное push-уведомление; с idempotency_key повторная постановка игнорируется"""
+        self.queue_push_notification(user_id, title, message, notification_type, delay_minutes * 60, idempotency_key)
+    
+    def run_scheduled_notification(self, payload):
+        """Задание 'notification' из очереди: сводки и напоминания по типу"""
+        handlers = {
+            'low_stock': self.send_low_stock_alert,
+            'daily_summary': self.send_daily_summary,
+            'cart_abandonment': self.send_cart_abandonment_reminder,
+            'weekly_recommendations': self.send_weekly_recommendations,
+        }
+        handler = handlers.get(payload.get('type'))
+        if handler:
+            handler()
     
     def send_order_notification_to_admins(self, order_id):
         """Уведомление админам о новом заказе"""
@@ -279,8 +343,8 @@ class NotificationManager:
                 SUM(total_amount) as revenue,
                 COUNT(DISTINCT user_id) as unique_customers
             FROM orders 
-            WHERE DATE(created_at) = ?
-        ''', (today,))
+            WHERE created_at >= ? AND created_at < ?
+        ''', day_range(today))
         
         if not daily_stats or daily_stats[0][0] == 0:
             return  # Нет заказов за день
@@ -298,11 +362,11 @@ class NotificationManager:
             FROM order_items oi
             JOIN products p ON oi.product_id = p.id
             JOIN orders o ON oi.order_id = o.id
-            WHERE DATE(o.created_at) = ?
+            WHERE o.created_at >= ? AND o.created_at < ?
             GROUP BY p.id, p.name
             ORDER BY sold DESC
             LIMIT 3
-        ''', (today,))
+        ''', day_range(today))
         
         if top_products:
             summary_text += "🏆 <b>Топ товары дня:</b>\n"
@@ -320,6 +384,7 @@ class NotificationManager:
             except Exception as e:
                 logging.info(f"Ошибка отправки сводки админу {admin[0]}: {e}")
     
+    @outbound_priority(BULK)
     def send_promotional_broadcast(self, message_text, target_group='all'):
         """Рассылка промо-сообщений"""
         if target_group == 'all':
@@ -352,8 +417,11 @@ class NotificationManager:
             try:
                 # Можно добавить локализацию сообщения по языку пользователя
                 localized_message = self.localize_broadcast_message(message_text, user[2])
-                self.bot.send_message(user[0], localized_message)
-                success_count += 1
+                result = self.bot.send_message(user[0], localized_message)
+                if result and result.get('ok'):
+                    success_count += 1
+                else:
+                    error_count += 1
             except Exception as e:
                 error_count += 1
                 logging.info(f"Ошибка рассылки пользователю {user[0]}: {e}")
@@ -0,0 +1,162 @@
+"""
+Ограничение исходящих сообщений по лимитам Telegram
+
+Общий лимит бота (~30 сообщений/с), 1 сообщение/с в личный чат и 20 в минуту
+в группу или канал. Ответы пользователям (INTERACTIVE) получают глобальные токены
+раньше рассылок (BULK). При 429 чат ждет retry_after, а общая скорость снижается
+и затем плавно восстанавливается.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from config import TELEGRAM_API_CONFIG
+except Exception:
+    TELEGRAM_API_CONFIG = {}
+
+INTERACTIVE = 0
+BULK = 1
+
+_local = threading.local()
+
+
+@contextmanager
+def outbound_priority(priority):
+    """Приоритет отправок текущего потока, например: with outbound_priority(BULK): ..."""
+    previous = getattr(_local, 'priority', INTERACTIVE)
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_priority():
+    return getattr(_local, 'priority', INTERACTIVE)
+
+
+def is_group_chat(chat_id):
+    """Группы и каналы: отрицательный id или @username канала"""
+    if isinstance(chat_id, str):
+        return chat_id.startswith('@') or chat_id.startswith('-')
+    return chat_id < 0
+
+
+class RateGovernor:
+    """Токен-бакеты Telegram: общий с приоритетами и по чатам"""
+
+    def __init__(self, global_rate=None, private_rate=None, group_rate=None, min_global_rate=None):
+        limits = TELEGRAM_API_CONFIG.get('rate_limits', {})
+        self.max_global_rate = global_rate or limits.get('global_per_second', 30)
+        self.private_interval = 1.0 / (private_rate or limits.get('private_chat_per_second', 1))
+        self.group_interval = 60.0 / (group_rate or limits.get('group_chat_per_minute', 20))
+        self.min_global_rate = min_global_rate or limits.get('min_global_per_second', 5)
+        self.global_rate = self.max_global_rate
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._chat_next = {}
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {'sent': 0, 'bulk': 0, 'chat_waits': 0, 'global_waits': 0, 'rate_limited': 0}
+
+    def _reserve_chat(self, chat_id, now):
+        """Слот чата (виртуальное расписание): момент, раньше которого отправлять нельзя"""
+        interval = self.group_interval if is_group_chat(chat_id) else self.private_interval
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + interval
+        if len(self._chat_next) > 10000:
+            self._chat_next = {key: value for key, value in self._chat_next.items() if value > now}
+        return slot
+
+    def _refill(self, now):
+        # Емкость — одна секунда общего лимита
+        self._tokens = min(self.global_rate, self._tokens + (now - self._updated) * self.global_rate)
+        self._updated = now
+
+    def acquire(self, chat_id, priority=None):
+        """Дождаться разрешения на отправку в чат; возвращает время ожидания в секундах"""
+        priority = current_priority() if priority is None else priority
+        started = time.monotonic()
+        with self._cond:
+            slot = self._reserve_chat(chat_id, started)
+        if slot > started:
+            with self._cond:
+                self.stats['chat_waits'] += 1
+            time.sleep(slot - started)
+
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            waited = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiting[0] == ticket and self._tokens >= 1 and now >= self._paused_until:
+                        self._tokens -= 1
+                        heapq.heappop(self._waiting)
+                        self.stats['sent'] += 1
+                        if priority == BULK:
+                            self.stats['bulk'] += 1
+                        self._cond.notify_all()
+                        return time.monotonic() - started
+                    if not waited:
+                        waited = True
+                        self.stats['global_waits'] += 1
+                    if now < self._paused_until:
+                        timeout = self._paused_until - now
+                    elif self._tokens < 1:
+                        timeout = (1 - self._tokens) / self.global_rate
+                    else:
+                        timeout = 0.05  # ждем, пока отправит более приоритетный
+                    self._cond.wait(timeout)
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+
+    def penalize(self, chat_id, retry_after):
+        """Ответ 429: чат ждет retry_after, общая скорость снижается вдвое"""
+        with self._cond:
+            now = time.monotonic()
+            self.stats['rate_limited'] += 1
+            if chat_id is None:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            else:
+                self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), now + retry_after)
+            self.global_rate = max(self.min_global_rate, self.global_rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+    def record_success(self):
+        """Успешная отправка: скорость возвращается к лимиту на 0.1 сообщения/с за отправку"""
+        if self.global_rate < self.max_global_rate:
+            with self._cond:
+                self.global_rate = min(self.max_global_rate, self.global_rate + 0.1)
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats['global_rate'] = round(self.global_rate, 2)
+            stats['waiting'] = len(self._waiting)
+        return stats
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_rate_governor():
+    """Общий ограничитель процесса"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = RateGovernor()
+        return _governor
@@ -7,6 +7,8 @@ import threading
 import html
 import time
 from logger import logger
+from rate_governor import BULK, outbound_priority
+from broadcasts import create_broadcast_job
 
 # Простой планировщик без внешних зависимостей
 class SimpleScheduler:
@@ -150,6 +152,7 @@ class ScheduledPostsManager:
         except Exception as e:
             logger.error(f"Ошибка загрузки расписания: {e}")
     
+    @outbound_priority(BULK)
     def send_scheduled_post(self, post_id, time_period):
         """Отправка запланированного поста"""
         try:
@@ -168,15 +171,6 @@ class ScheduledPostsManager:
             title, content, target_audience, image_url = post_data[0]
             logging.info(f"📝 Пост: {title}, Аудитория: {target_audience}")
             
-            # Получаем список получателей
-            recipients = self.get_target_audience(target_audience)
-            
-            if not recipients:
-                logging.info(f"⚠️ Нет получателей для поста {post_id}")
-                return
-            
-            logging.info(f"👥 Получателей: {len(recipients)}")
-            
             # Форматируем сообщение
             message_text = self.format_post_message(title, content, time_period)
             logging.info(f"📄 Сообщение готово: {len(message_text)} символов")
@@ -184,6 +178,20 @@ class ScheduledPostsManager:
             # Создаем кнопки для товаров
             keyboard = self.create_post_keyboard()
             
+            if target_audience != 'channel':
+                # Пользователям — заданием рассылки; статистику поста запишет BroadcastEngine по завершении
+                job_id, total = create_broadcast_job(
+                    self.db, message_text, target_audience, image_url, keyboard,
+                    title=title, post_id=post_id, time_period=time_period
+                )
+                if not job_id:
+                    logging.info(f"⚠️ Неизвестная аудитория поста {post_id}: {target_audience}")
+                    return
+                logging.info(f"👥 Пост {post_id}: рассылка {job_id}, получателей {total}")
+                if getattr(self.bot, 'broadcasts', None):
+                    self.bot.broadcasts.wake()
+                return
+            
             # Отправляем ТОЛЬКО ОДИН пост
             success_count = 0
             error_count = 0
@@ -215,27 +223,7 @@ class ScheduledPostsManager:
                 except Exception as e:
                     error_count = 1
                     logging.info(f"❌ Ошибка отправки в канал: {e}")
-            else:
-                # Отправляем пользователям
-                for recipient in recipients:
-                    try:
-                        telegram_id = recipient[0] if isinstance(recipient, (list, tuple)) else recipient.get('telegram_id')
-                        if image_url and len(message_text) <= 1024:
-                            result = self.bot.send_photo(telegram_id, image_url, message_text, keyboard)
-                        elif image_url and len(message_text) > 1024:
-                            _ = self.bot.send_photo(telegram_id, image_url, '', None)
-                            result = self.bot.send_message(telegram_id, message_text, keyboard)
-                        else:
-                            result = self.bot.send_message(telegram_id, message_text, keyboard)
-                        
-                        if result and result.get('ok'):
-                            success_count += 1
-                        else:
-                            error_count += 1
-                    except Exception as e:
-                        error_count += 1
-                        logging.info(f"❌ Ошибка отправки пользователю: {e}")
-            
+
             # Записываем статистику
             current_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
             self.db.execute_query('''
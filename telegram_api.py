@@ -0,0 +1,319 @@
+"""
+Общий клиент Telegram Bot API: пул keep-alive соединений, таймауты, gzip и повторы с учетом retry_after
+"""
+
+import gzip
+import http.client
+import json
+import logging
+import mimetypes
+import mmap
+import os
+import queue
+import socket
+import threading
+import time
+import urllib.parse
+import uuid
+
+from rate_governor import get_rate_governor
+
+try:
+    from config import TELEGRAM_API_CONFIG
+except Exception:
+    TELEGRAM_API_CONFIG = {}
+
+# Ошибки соединения, после которых запрос можно повторить на новом соединении
+_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    http.client.CannotSendRequest,
+    http.client.ResponseNotReady,
+    ConnectionError,
+    socket.timeout,
+    OSError,
+)
+
+# Методы без побочных эффектов: их можно повторять после обрыва уже отправленного запроса
+IDEMPOTENT_METHODS = {
+    'getUpdates', 'getMe', 'getWebhookInfo', 'deleteWebhook', 'setWebhook',
+    'editMessageReplyMarkup', 'getChat', 'getFile',
+}
+
+# Методы, на которые действуют лимиты Telegram на сообщения в чат
+RATE_LIMITED_METHODS = {
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendVideo', 'sendAnimation', 'sendMediaGroup',
+    'copyMessage', 'forwardMessage', 'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup',
+}
+
+
+class _NotSent(Exception):
+    """Соединение не установлено — запрос точно не дошел до сервера"""
+
+
+class TelegramAPI:
+    """Клиент Bot API поверх http.client с пулом постоянных соединений.
+
+    Методы возвращают разобранный JSON ответа Telegram (включая ответы с ошибкой,
+    где есть error_code/description), а при сетевой ошибке после всех повторов —
+    {'ok': False, 'error': '...'}; исключения наружу не выбрасываются.
+    """
+
+    def __init__(self, token, base_url=None, timeout=None, max_connections=None,
+                 retries=None, max_retry_after=None, governor=None):
+        config = TELEGRAM_API_CONFIG
+        self.token = token
+        parsed = urllib.parse.urlsplit(base_url or config.get('base_url', 'https://api.telegram.org'))
+        self.scheme = parsed.scheme or 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path_prefix = parsed.path.rstrip('/')
+        self.timeout = timeout or config.get('timeout', 10)
+        self.max_connections = max_connections or config.get('max_connections', 8)
+        self.retries = config.get('retries', 3) if retries is None else retries
+        self.max_retry_after = max_retry_after or config.get('max_retry_after', 30)
+        self.governor = governor or get_rate_governor()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'connections': 0, 'reused': 0, 'retries': 0, 'rate_limited': 0, 'errors': 0}
+
+    # Соединения
+
+    def _new_connection(self):
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        with self._lock:
+            self.stats['connections'] += 1
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.stats['reused'] += 1
+            return conn, True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def _release(self, conn):
+        if self._idle.qsize() < self.max_connections:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        """Закрыть все свободные соединения"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # Запросы
+
+    def _send(self, method, body, content_type, timeout):
+        """Один HTTP-запрос; соединение из пула, при обрыве переиспользованного — один повтор на новом"""
+        path = f"{self.path_prefix}/bot{self.token}/{method}"
+        headers = {
+            'Content-Type': content_type,
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive',
+        }
+        if isinstance(body, MultipartBody):
+            headers['Content-Length'] = str(body.content_length)
+        for attempt in range(2):
+            conn, reused = self._acquire()
+            try:
+                conn.timeout = timeout
+                if conn.sock is None:
+                    try:
+                        conn.connect()
+                    except _CONNECTION_ERRORS as e:
+                        conn.close()
+                        raise _NotSent(e)
+                    conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                conn.sock.settimeout(timeout)
+                conn.request('POST', path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                if response.getheader('Content-Encoding', '').lower() == 'gzip':
+                    data = gzip.decompress(data)
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._release(conn)
+                return response.status, data
+            except _CONNECTION_ERRORS:
+                conn.close()
+                # Сервер мог закрыть простаивавшее keep-alive соединение — пробуем на свежем
+                if reused and attempt == 0:
+                    continue
+                raise
+
+    def request(self, method, params=None, body=None, content_type=None, timeout=None, chat_id=None):
+        """Вызов метода Bot API.
+
+        params — поля формы (значения-словари/списки кодируются в JSON),
+        либо готовое тело body с content_type (например, MultipartBody для загрузки файлов);
+        для body chat_id передается отдельно, чтобы учесть лимиты чата.
+        """
+        if chat_id is None and params:
+            chat_id = params.get('chat_id')
+        governed = method in RATE_LIMITED_METHODS and chat_id is not None
+        if body is None:
+            fields = {}
+            for key, value in (params or {}).items():
+                if value is None:
+                    continue
+                fields[key] = json.dumps(value) if isinstance(value, (dict, list)) else value
+            body = urllib.parse.urlencode(fields).encode('utf-8')
+            content_type = 'application/x-www-form-urlencoded'
+        timeout = timeout or self.timeout
+
+        delay = 0.5
+        last_error = None
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                self.stats['requests'] += 1
+                if attempt:
+                    self.stats['retries'] += 1
+            if governed:
+                self.governor.acquire(chat_id)
+            try:
+                status, data = self._send(method, body, content_type, timeout)
+            except _NotSent as e:
+                last_error = e.args[0]
+                time.sleep(delay)
+                delay *= 2
+                continue
+            except _CONNECTION_ERRORS as e:
+                last_error = e
+                # Ответ не получен, но запрос мог быть выполнен: sendMessage не дублируем
+                if method not in IDEMPOTENT_METHODS:
+                    break
+                time.sleep(delay)
+                delay *= 2
+                continue
+
+            try:
+                result = json.loads(data.decode('utf-8'))
+            except ValueError:
+                result = {'ok': False, 'error_code': status, 'description': data[:200].decode('utf-8', 'replace')}
+
+            if status == 429 or result.get('error_code') == 429:
+                retry_after = (result.get('parameters') or {}).get('retry_after', 1)
+                with self._lock:
+                    self.stats['rate_limited'] += 1
+                if governed:
+                    self.governor.penalize(chat_id, retry_after)
+                if retry_after > self.max_retry_after or attempt == self.retries:
+                    return result
+                logging.info(f"Telegram API {method}: 429, повтор через {retry_after}с")
+                if not governed:
+                    time.sleep(retry_after)
+                continue
+            if status >= 500 and attempt < self.retries:
+                time.sleep(delay)
+                delay *= 2
+                continue
+            if governed and result.get('ok'):
+                self.governor.record_success()
+            return result
+
+        with self._lock:
+            self.stats['errors'] += 1
+        logging.info(f"Telegram API {method}: сетевая ошибка: {last_error}")
+        return {'ok': False, 'error': str(last_error)}
+
+    # Часто используемые методы
+
+    def send_message(self, chat_id, text, reply_markup=None, parse_mode='HTML', **extra):
+        return self.request('sendMessage', dict(
+            chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup, **extra
+        ))
+
+    def send_photo(self, chat_id, photo, caption=None, reply_markup=None, parse_mode='HTML', **extra):
+        return self.request('sendPhoto', dict(
+            chat_id=chat_id, photo=photo, caption=caption or None,
+            parse_mode=parse_mode if caption else None, reply_markup=reply_markup, **extra
+        ))
+
+    def get_updates(self, offset=None, timeout=30, **extra):
+        """Long polling: таймаут сокета больше таймаута getUpdates"""
+        return self.request('getUpdates', dict(offset=offset, timeout=timeout, **extra),
+                            timeout=timeout + self.timeout)
+
+
+class MultipartBody:
+    """Тело multipart/form-data, которое отправляется потоком.
+
+    Заголовки частей собираются заранее, содержимое файлов отдается срезами
+    memoryview поверх mmap — без чтения файла в память. Длина известна до
+    отправки (Content-Length), тело можно перебирать повторно (для повторов запроса).
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, fields, files):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        head = bytearray()
+        self._parts = []
+        for name, value in fields.items():
+            head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                     f'{value}\r\n').encode('utf-8')
+        for name, path in files.items():
+            filename = os.path.basename(path)
+            ctype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {ctype}\r\n\r\n').encode('utf-8')
+            self._parts.append(bytes(head))
+            self._parts.append((path, os.path.getsize(path)))
+            head = bytearray(b'\r\n')
+        head += f'--{self.boundary}--\r\n'.encode('utf-8')
+        self._parts.append(bytes(head))
+        self.content_length = sum(len(part) if isinstance(part, bytes) else part[1] for part in self._parts)
+
+    def __iter__(self):
+        mapped = None
+        try:
+            for part in self._parts:
+                if isinstance(part, bytes):
+                    yield part
+                    if mapped is not None:
+                        # Следующий фрагмент уже отдан — срезы файла отпущены, mmap можно закрыть
+                        mapped.close()
+                        mapped = None
+                    continue
+                path, size = part
+                if not size:
+                    continue
+                with open(path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if len(mapped) != size:
+                    raise OSError(f"файл {path} изменился во время отправки")
+                view = memoryview(mapped)
+                for offset in range(0, size, self.chunk_size):
+                    yield view[offset:offset + self.chunk_size]
+                view.release()
+        finally:
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass  # срез еще у вызывающего кода, mmap закроется при сборке мусора
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_telegram_api(token=None):
+    """Общий клиент на токен (по умолчанию BOT_TOKEN из config)"""
+    if token is None:
+        from config import BOT_TOKEN
+        token = BOT_TOKEN
+    with _clients_lock:
+        client = _clients.get(token)
+        if client is None:
+            client = _clients[token] = TelegramAPI(token)
+        return client
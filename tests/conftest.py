@@ -0,0 +1,24 @@
+"""
+Общие фикстуры тестов: база во временном файле, а не shop_bot.db из репозитория
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'test.db')
+
+
+@pytest.fixture
+def db(db_path):
+    manager = DatabaseManager(db_path)
+    yield manager
+    manager.pool.close_all()
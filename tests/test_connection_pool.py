@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+
+import pytest
+
+from database import ConnectionPool, PoolExhaustedError
+
+
+@pytest.fixture
+def pool(db_path):
+    pool = ConnectionPool(db_path, max_connections=2, timeout=0.2, pragmas={'journal_mode': 'WAL'})
+    yield pool
+    pool.close_all()
+
+
+def test_released_connection_is_reused(pool):
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert pool.get_stats()['created'] == 1
+
+
+def test_pragmas_applied(pool):
+    conn = pool.acquire()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    pool.release(conn)
+
+
+def test_pool_size_is_capped(pool):
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(PoolExhaustedError):
+        pool.acquire()
+    assert pool.get_stats()['in_use'] == 2
+
+    # Соединение, возвращенное другим потоком, достается ожидающему
+    threading.Timer(0.05, pool.release, (first,)).start()
+    assert pool.acquire() is first
+    assert pool.get_stats()['created'] == 2
+    pool.release(first)
+    pool.release(second)
+
+
+def test_discard_wakes_waiter(pool):
+    first, second = pool.acquire(), pool.acquire()
+    pool.timeout = 5
+    # Закрытое соединение освобождает слот, и ожидающий получает новое соединение
+    threading.Timer(0.05, pool._discard, (first,)).start()
+    conn = pool.acquire()
+    assert conn is not first and conn.execute('SELECT 1').fetchone() == (1,)
+    stats = pool.get_stats()
+    assert stats['waits'] == 1 and stats['wait_time_total'] < 1
+    assert stats['created'] == 3 and stats['open'] == 2
+    pool.release(conn)
+    pool.release(second)
+
+
+def test_release_rolls_back_open_transaction(pool):
+    conn = pool.acquire()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    pool.release(conn)
+    conn = pool.acquire()
+    assert not conn.in_transaction
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    pool.release(conn)
+
+
+def test_broken_idle_connection_is_replaced(db_path):
+    pool = ConnectionPool(db_path, max_connections=1, health_check_after=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.close()
+    fresh = pool.acquire()
+    assert fresh is not conn
+    assert fresh.execute('SELECT 1').fetchone() == (1,)
+    assert pool.get_stats()['health_check_failures'] == 1
+    pool.release(fresh)
+    pool.close_all()
+
+
+def test_transaction_commits_or_rolls_back(db):
+    user_id = db.execute_query("INSERT INTO users (telegram_id, name) VALUES (1, 'a')")
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction():
+            db.execute_query("UPDATE users SET name = 'b' WHERE id = ?", (user_id,))
+            db.execute_query("INSERT INTO users (telegram_id, name) VALUES (1, 'duplicate')")
+    assert db.execute_query('SELECT name FROM users WHERE id = ?', (user_id,)) == [('a',)]
+
+    with db.transaction():
+        db.execute_query("UPDATE users SET name = 'c' WHERE id = ?", (user_id,))
+        with db.transaction():
+            db.execute_query("UPDATE users SET phone = '1' WHERE id = ?", (user_id,))
+    assert db.execute_query('SELECT name, phone FROM users WHERE id = ?', (user_id,)) == [('c', '1')]
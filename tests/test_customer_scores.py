@@ -0,0 +1,38 @@
+import pytest
+
+import customer_scores
+from customer_scores import CustomerScores
+
+
+@pytest.fixture
+def buyer(db):
+    user_id = db.execute_query("INSERT INTO users (telegram_id, name) VALUES (1, 'buyer')")
+    for days, amount in ((40, 30), (20, 50)):
+        db.execute_query("INSERT INTO orders (user_id, total_amount, status, created_at) "
+                         "VALUES (?, ?, 'delivered', datetime('now', ?))", (user_id, amount, f'-{days} days'))
+    return user_id
+
+
+def test_scores_ignored_after_new_order(db, buyer):
+    scores = CustomerScores(db)
+    scores.score_all()
+    assert scores.get(buyer)['total_orders'] == 2
+
+    db.execute_query("INSERT INTO orders (user_id, total_amount) VALUES (?, 25)", (buyer,))
+    assert scores.get(buyer) is None
+    scores.score_all()
+    assert scores.get(buyer)['total_orders'] == 3
+
+
+def test_scores_ignored_after_cancellation(db, buyer):
+    scores = CustomerScores(db)
+    scores.score_all()
+    db.execute_query("UPDATE orders SET status = 'cancelled' WHERE user_id = ? AND total_amount = 30", (buyer,))
+    assert scores.get(buyer) is None
+
+
+def test_numpy_scoring_is_used_and_matches_python(db, buyer):
+    # NumPy — зависимость из requirements.txt: векторный расчет должен работать, а не фолбэк
+    assert customer_scores.np is not None
+    features = CustomerScores(db).load_features()
+    assert CustomerScores._score_numpy(features) == CustomerScores._score_python(features)
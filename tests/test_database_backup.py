@@ -0,0 +1,29 @@
+import gzip
+import sqlite3
+
+
+def test_backup_includes_uncheckpointed_wal(db, db_path, tmp_path, monkeypatch):
+    # logger пишет файлы логов в текущий каталог
+    monkeypatch.chdir(tmp_path)
+    from database_backup import DatabaseBackup
+
+    writer = sqlite3.connect(db_path)
+    writer.execute('PRAGMA wal_autocheckpoint = 0')
+    writer.execute("INSERT INTO users (telegram_id, name) VALUES (777, 'in wal only')")
+    writer.commit()
+
+    backup = DatabaseBackup.__new__(DatabaseBackup)
+    backup.db_path = db_path
+    backup.backup_dir = str(tmp_path)
+    compressed = backup.create_backup()
+    writer.close()
+    assert compressed and compressed.endswith('.db.gz')
+
+    restored = tmp_path / 'restored.db'
+    with gzip.open(compressed, 'rb') as f:
+        restored.write_bytes(f.read())
+    conn = sqlite3.connect(restored)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    assert conn.execute('SELECT name FROM users WHERE telegram_id = 777').fetchone() == ('in wal only',)
+    assert conn.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    conn.close()
@@ -0,0 +1,33 @@
+import hashlib
+
+from file_id_cache import FileIdCache, is_invalid_file_id, is_private_url
+
+
+def test_photo_key_hashes_local_and_private_files(db, tmp_path):
+    image = tmp_path / 'photo.png'
+    image.write_bytes(b'png bytes')
+    expected = 'sha256:' + hashlib.sha256(b'png bytes').hexdigest()
+    cache = FileIdCache(db)
+    assert cache.photo_key(str(image)) == expected
+    assert cache.photo_key('https://cdn.example.com/a.png') == 'https://cdn.example.com/a.png'
+
+    image.write_bytes(b'other bytes')
+    assert cache.photo_key(str(image)) != expected
+
+
+def test_private_urls():
+    assert is_private_url('static/uploads/a.png')
+    assert is_private_url('http://192.168.1.5/static/uploads/a.png')
+    assert is_private_url('http://172.20.0.2/a.png')
+    assert not is_private_url('http://172.40.0.2/a.png')
+    assert not is_private_url('https://cdn.example.com/a.png')
+
+
+def test_cache_round_trip_and_invalidation(db):
+    cache = FileIdCache(db)
+    result = {'ok': True, 'result': {'photo': [{'file_id': 'small'}, {'file_id': 'big', 'file_unique_id': 'u'}]}}
+    assert cache.remember('key', result) == 'big'
+    assert FileIdCache(db).get('key') == 'big'
+    assert is_invalid_file_id({'ok': False, 'description': 'Bad Request: wrong file identifier/HTTP URL specified'})
+    cache.invalidate('key')
+    assert FileIdCache(db).get('key') is None
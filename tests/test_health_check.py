@@ -0,0 +1,34 @@
+import pytest
+
+
+@pytest.fixture
+def health_check(tmp_path, monkeypatch):
+    # logger пишет файлы логов в текущий каталог
+    monkeypatch.chdir(tmp_path)
+    return pytest.importorskip('health_check')
+
+
+@pytest.fixture
+def monitor(db, health_check):
+    monitor = health_check.HealthMonitor.__new__(health_check.HealthMonitor)
+    monitor.db = db
+    monitor.metrics = {'db_queries': {}}
+    db.execute_query('SELECT 1')
+    monitor.metrics['db_queries'] = db.get_query_stats(limit=10)
+    return monitor
+
+
+def test_health_summary_has_no_sql(monitor):
+    summary = monitor.get_query_summary()
+    assert summary['total_queries'] >= 1
+    assert 'SELECT' not in repr(summary)
+    assert set(summary) == {'total_queries', 'fingerprints', 'slow_query_ms', 'slow_queries', 'max_p99_ms', 'max_ms'}
+
+
+def test_query_stats_require_token(monitor, health_check, monkeypatch):
+    monkeypatch.setitem(health_check.MONITORING_CONFIG, 'stats_token', None)
+    assert not monitor.authorized_for_stats({'X-Stats-Token': ''})
+    monkeypatch.setitem(health_check.MONITORING_CONFIG, 'stats_token', 'secret')
+    assert not monitor.authorized_for_stats({})
+    assert not monitor.authorized_for_stats({'X-Stats-Token': 'wrong'})
+    assert monitor.authorized_for_stats({'X-Stats-Token': 'secret'})
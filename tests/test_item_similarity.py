@@ -0,0 +1,45 @@
+from item_similarity import ItemSimilarityIndex
+
+
+def snapshot(db):
+    return (db.execute_query('SELECT * FROM item_counts ORDER BY 1'),
+            db.execute_query('SELECT * FROM item_pairs ORDER BY 1, 2'),
+            db.execute_query('SELECT product_id, neighbor_id, round(score, 9) FROM item_neighbors ORDER BY 1, 2'))
+
+
+def add_order(db, user_id, product_ids, status='pending'):
+    order_id = db.execute_query('INSERT INTO orders (user_id, total_amount, status) VALUES (?, 0, ?)',
+                                (user_id, status))
+    db.execute_many('INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, 1, 10)',
+                    [(order_id, product_id) for product_id in product_ids])
+    return order_id
+
+
+def matches_rebuild(db, index):
+    index.refresh_neighbors()
+    incremental = snapshot(db)
+    index.rebuild()
+    return snapshot(db) == incremental
+
+
+def test_cancellation_is_subtracted_and_restored(db):
+    user_id = db.execute_query("INSERT INTO users (telegram_id, name) VALUES (1, 'buyer')")
+    a, b, c = [row[0] for row in db.execute_query('SELECT id FROM products ORDER BY id LIMIT 3')]
+    index = ItemSimilarityIndex(db)
+    add_order(db, user_id, [a, b])
+    order_id = add_order(db, user_id, [a, c])
+    add_order(db, user_id, [b, c], status='cancelled')
+    index.update()
+    assert {row[0] for row in index.also_bought(a)} == {b, c}
+
+    db.execute_query("UPDATE orders SET status = 'cancelled' WHERE id = ?", (order_id,))
+    assert index.update() == 1
+    assert [row[0] for row in index.also_bought(a)] == [b]
+    assert db.execute_query('SELECT order_count FROM item_counts WHERE product_id = ?', (c,)) == []
+    assert matches_rebuild(db, index)
+
+    db.execute_query("UPDATE orders SET status = 'delivered' WHERE id = ?", (order_id,))
+    assert index.update() == 1
+    assert {row[0] for row in index.also_bought(a)} == {b, c}
+    assert matches_rebuild(db, index)
+    assert index.update() == 0
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def jobs(db):
+    return JobQueue(db, workers=1, lease_seconds=60)
+
+
+def job_row(db, job_id):
+    return db.execute_query('SELECT status, attempts, lease_owner, last_error FROM jobs WHERE id = ?', (job_id,))[0]
+
+
+def expire_lease(db, job_id):
+    db.execute_query('UPDATE jobs SET run_at = ? WHERE id = ?', (time.time() - 1, job_id))
+
+
+def test_expired_lease_is_claimed_again(db, jobs):
+    job_id = jobs.enqueue('push', {'user': 1})
+    [first] = jobs.claim()
+    assert first[0] == job_id and first[2] == {'user': 1} and first[3] == 1
+    assert jobs.claim() == []
+
+    expire_lease(db, job_id)
+    [second] = jobs.claim()
+    assert second[0] == job_id and second[3] == 2
+    assert second[5] != first[5]
+
+
+def test_ack_with_stale_token_does_not_finish_job(db, jobs):
+    job_id = jobs.enqueue('push')
+    [first] = jobs.claim()
+    expire_lease(db, job_id)
+    [second] = jobs.claim()
+
+    jobs.ack([(job_id, first[5], None, first[3], first[4])])
+    assert job_row(db, job_id)[0] == 'leased'
+    jobs.ack([(job_id, second[5], None, second[3], second[4])])
+    assert job_row(db, job_id)[:3] == ('done', 2, None)
+
+
+def test_failed_attempts_retry_then_fail(db, jobs):
+    job_id = jobs.enqueue('push', max_attempts=2)
+    [job] = jobs.claim()
+    jobs.ack([(job_id, job[5], 'timeout', job[3], job[4])])
+    status, attempts, owner, error = job_row(db, job_id)
+    assert (status, attempts, owner, error) == ('queued', 1, None, 'timeout')
+
+    expire_lease(db, job_id)
+    [job] = jobs.claim()
+    jobs.ack([(job_id, job[5], 'timeout again', job[3], job[4])])
+    assert job_row(db, job_id)[:2] == ('failed', 2)
+    assert jobs.claim() == []
+
+
+def test_exhausted_expired_lease_is_failed(db, jobs):
+    job_id = jobs.enqueue('push', max_attempts=1)
+    jobs.claim()
+    expire_lease(db, job_id)
+    assert jobs.claim() == []
+    assert job_row(db, job_id)[0] == 'failed'
+    assert job_row(db, job_id)[3] == 'аренда истекла'
+
+
+def test_release_does_not_spend_attempt(db, jobs):
+    job_id = jobs.enqueue('push', max_attempts=1)
+    claimed = jobs.claim()
+    jobs.release(claimed)
+    assert job_row(db, job_id)[:3] == ('queued', 0, None)
+    [job] = jobs.claim()
+    assert job[3] == 1
+
+
+def test_idempotency_key_deduplicates(db, jobs):
+    first = jobs.enqueue('push', {'n': 1}, delay=60, idempotency_key='welcome:1')
+    second = jobs.enqueue('push', {'n': 2}, idempotency_key='welcome:1')
+    assert first == second
+    assert db.execute_query("SELECT COUNT(*), payload FROM jobs WHERE idempotency_key = 'welcome:1'") == [(1, '{"n": 1}')]
+    assert jobs.stats['duplicates'] == 1
+
+
+def test_delayed_job_waits_for_run_at(db, jobs):
+    jobs.enqueue('push', delay=60)
+    assert jobs.claim() == []
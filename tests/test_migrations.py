@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from database import DatabaseManager
+
+LATEST = DatabaseManager.MIGRATIONS[-1][0]
+
+
+def table_names(db):
+    return {row[0] for row in db.execute_query("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_new_database_gets_latest_schema(db):
+    assert db.get_schema_version() == LATEST
+    assert {'change_events', 'jobs', 'customer_rfm', 'customer_scores', 'item_neighbors'} <= table_names(db)
+
+
+def test_reopening_is_noop(db_path, db):
+    again = DatabaseManager(db_path)
+    assert again.get_schema_version() == LATEST
+    again.pool.close_all()
+
+
+def test_non_empty_legacy_database_is_migrated(db_path):
+    # База старой версии: без user_version, в orders и users нет created_at, есть заказ
+    conn = sqlite3.connect(db_path)
+    conn.executescript('''
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER UNIQUE, name TEXT,
+                            phone TEXT, email TEXT, language TEXT DEFAULT 'ru', is_admin INTEGER DEFAULT 0);
+        CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, total_amount REAL,
+                             status TEXT DEFAULT 'pending', delivery_address TEXT);
+        INSERT INTO users (telegram_id, name) VALUES (1, 'legacy');
+        INSERT INTO orders (user_id, total_amount) VALUES (1, 10);
+    ''')
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(db_path)
+    try:
+        assert db.get_schema_version() == LATEST
+        assert {'change_events', 'jobs', 'customer_rfm', 'customer_scores', 'item_neighbors'} <= table_names(db)
+        assert db.execute_query('SELECT COUNT(*) FROM orders WHERE created_at IS NULL')[0][0] == 0
+        # Заказ старой базы попал в RFM при первичном заполнении
+        assert db.execute_query('SELECT frequency, monetary FROM customer_rfm WHERE user_id = 1') == [(1, 10.0)]
+    finally:
+        db.pool.close_all()
+
+
+def test_failed_migration_stops_startup(db_path, monkeypatch):
+    def broken(self, cursor):
+        cursor.execute('CREATE TABLE half_done (id INTEGER)')
+        raise sqlite3.OperationalError('boom')
+
+    monkeypatch.setattr(DatabaseManager, '_broken_migration', broken, raising=False)
+    monkeypatch.setattr(DatabaseManager, 'MIGRATIONS',
+                        DatabaseManager.MIGRATIONS + ((LATEST + 1, 'broken', '_broken_migration'),))
+    with pytest.raises(sqlite3.OperationalError):
+        DatabaseManager(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        # Предыдущие миграции зафиксированы, сломанная откатилась целиком
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == LATEST
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    finally:
+        conn.close()
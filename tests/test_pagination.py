@@ -0,0 +1,97 @@
+from database import decode_cursor, encode_cursor
+from keyboards import CALLBACK_DATA_LIMIT, catalog_page_callback
+
+CUSTOMERS = 'SELECT user_id as id, frequency, monetary as total_spent, last_order_at FROM customer_rfm'
+ORDER = (('total_spent', 'DESC'), ('id', 'DESC'))
+
+
+def fill(db, users=45):
+    db.execute_many('INSERT INTO users (telegram_id, name) VALUES (?, ?)',
+                    [(10 ** 6 + i, f'user{i}') for i in range(users)])
+    # Повторяющиеся суммы: порядок внутри одной суммы держится на id
+    db.execute_many('INSERT INTO orders (user_id, total_amount, status) VALUES (?, ?, ?)',
+                    [(user_id, (user_id % 4) * 10, 'cancelled' if user_id % 7 == 0 else 'pending')
+                     for (user_id,) in db.execute_query('SELECT id FROM users WHERE is_admin = 0')])
+
+
+def walk(db, query, direction='next_cursor', cursor=None, limit=10):
+    pages = []
+    while True:
+        result = db.paginate(query, order_by=ORDER, limit=limit, cursor=cursor)
+        pages.append(result['rows'])
+        cursor = result[direction]
+        if not cursor:
+            return pages, result
+
+
+def test_cursor_token_round_trip():
+    token = encode_cursor('n', [12.5, 'Имя', 7])
+    assert decode_cursor(token) == {'d': 'n', 'k': [12.5, 'Имя', 7]}
+    assert decode_cursor('not a cursor') is None
+    assert decode_cursor(None) is None
+
+
+def test_forward_pages_match_full_order(db):
+    fill(db)
+    expected = db.execute_query(CUSTOMERS + ' ORDER BY total_spent DESC, id DESC')
+    pages, last = walk(db, CUSTOMERS)
+    assert [row for page in pages for row in page] == expected
+    assert all(len(page) == 10 for page in pages[:-1])
+    assert last['prev_cursor'] and not last['next_cursor']
+
+
+def test_backward_pages_return_to_start(db):
+    fill(db)
+    forward, last = walk(db, CUSTOMERS)
+    backward, first = walk(db, CUSTOMERS, 'prev_cursor', last['prev_cursor'])
+    assert backward == forward[-2::-1]
+    assert first['prev_cursor'] is None and first['next_cursor']
+
+
+def test_offset_page_matches_cursor_page(db):
+    fill(db)
+    pages, _ = walk(db, CUSTOMERS)
+    assert db.paginate(CUSTOMERS, order_by=ORDER, limit=10, offset=20)['rows'] == pages[2]
+
+
+def test_invalid_cursor_means_first_page(db):
+    fill(db)
+    first = db.paginate(CUSTOMERS, order_by=ORDER, limit=10)
+    assert db.paginate(CUSTOMERS, order_by=ORDER, limit=10, cursor='garbage')['rows'] == first['rows']
+
+
+def subcategory_pages(db, subcategory_id, per_page=3, between_pages=None):
+    pages, after = [], None
+    while True:
+        page = db.get_products_by_subcategory(subcategory_id, per_page, after=after) or []
+        if not page:
+            return pages
+        pages.append([row[1] for row in page])
+        if between_pages:
+            between_pages(page)
+        # Курсор проходит через callback_data кнопки, как в боте
+        token = catalog_page_callback(subcategory_id, page[-1][1], page[-1][0]).split('_', 3)[3]
+        after = tuple(decode_cursor(token)['k'])
+
+
+def test_subcategory_cursor_survives_rename_and_delete(db):
+    subcategory_id = db.execute_query("INSERT INTO subcategories (name) VALUES ('Тест')")
+    names = [f'Товар {chr(ord("А") + i)}' for i in range(8)]
+    db.execute_many('INSERT INTO products (name, price, subcategory_id) VALUES (?, 1, ?)',
+                    [(name, subcategory_id) for name in names])
+    assert [name for page in subcategory_pages(db, subcategory_id) for name in page] == names
+
+    def rename_and_delete_anchor(page):
+        # Последний показанный товар переименовывают в начало списка и удаляют
+        db.execute_query("UPDATE products SET name = 'Ааа' WHERE id = ?", (page[-1][0],))
+        db.execute_query('DELETE FROM products WHERE id = ?', (page[-1][0],))
+
+    pages = subcategory_pages(db, subcategory_id, between_pages=rename_and_delete_anchor)
+    assert [name for page in pages for name in page] == names
+
+
+def test_subcategory_callback_fits_telegram_limit():
+    data = catalog_page_callback(12, 'Очень длинное название товара ' * 3, 123456)
+    assert len(data.encode('utf-8')) <= CALLBACK_DATA_LIMIT
+    name, product_id = decode_cursor(data.split('_', 3)[3])['k']
+    assert product_id == 123456 and ('Очень длинное название товара ' * 3).startswith(name)
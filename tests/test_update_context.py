@@ -0,0 +1,29 @@
+TELEGRAM_ID = 555000111
+
+
+def queries(db):
+    return db.get_query_stats()['total_queries']
+
+
+def test_cart_summary_served_from_context(db):
+    user_id = db.execute_query('INSERT INTO users (telegram_id, name) VALUES (?, ?)', (TELEGRAM_ID, 'buyer'))
+    product_id, price = db.execute_query('SELECT id, price FROM products ORDER BY id LIMIT 1')[0]
+    db.execute_query('INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, 2)', (user_id, product_id))
+
+    with db.update_context(TELEGRAM_ID):
+        before = queries(db)
+        assert db.get_user_by_telegram_id(TELEGRAM_ID)[0][0] == user_id
+        assert db.get_cart_summary(user_id) == (2, 2 * price)
+        assert queries(db) == before
+
+        # Запись в корзину в рамках update сбрасывает сводку
+        db.execute_query('UPDATE cart SET quantity = 3 WHERE user_id = ?', (user_id,))
+        assert db.get_cart_summary(user_id) == (3, 3 * price)
+        before = queries(db)
+        assert db.get_cart_summary(user_id) == (3, 3 * price)
+        assert queries(db) == before
+
+
+def test_cart_summary_without_context(db):
+    user_id = db.execute_query('INSERT INTO users (telegram_id, name) VALUES (?, ?)', (TELEGRAM_ID, 'buyer'))
+    assert db.get_cart_summary(user_id) == (0, 0)
@@ -0,0 +1,69 @@
+import random
+import threading
+import time
+from collections import defaultdict
+
+from update_dispatcher import UpdateDispatcher, chat_key
+
+
+def message(update_id, chat_id):
+    return {'update_id': update_id, 'message': {'chat': {'id': chat_id}, 'from': {'id': chat_id}, 'text': 'x'}}
+
+
+def test_chat_key_uses_callback_message_chat():
+    callback = {'update_id': 5, 'callback_query': {'from': {'id': 1}, 'message': {'chat': {'id': -100}}}}
+    assert chat_key(callback) == -100
+    assert chat_key(message(6, 42)) == 42
+    assert chat_key({'update_id': 7}) == 7
+
+
+def test_updates_of_one_chat_are_handled_in_order():
+    handled = defaultdict(list)
+    lock = threading.Lock()
+
+    def handler(update):
+        time.sleep(random.random() / 1000)
+        with lock:
+            handled[chat_key(update)].append(update['update_id'])
+
+    dispatcher = UpdateDispatcher(handler, workers=4, queue_size=5)
+    dispatcher.start()
+    random.seed(3)
+    submitted = defaultdict(list)
+    for update_id in range(1, 301):
+        chat_id = random.randint(1, 12)
+        submitted[chat_id].append(update_id)
+        assert dispatcher.submit(message(update_id, chat_id))
+    assert dispatcher.shutdown(timeout=10)
+    assert dict(handled) == dict(submitted)
+    assert dispatcher.oldest_unprocessed() is None
+    assert dispatcher.get_stats()['processed'] == 300
+
+
+def test_handler_errors_do_not_stop_the_shard():
+    handled = []
+
+    def handler(update):
+        if update['update_id'] == 2:
+            raise RuntimeError('boom')
+        handled.append(update['update_id'])
+
+    dispatcher = UpdateDispatcher(handler, workers=1, queue_size=10)
+    dispatcher.start()
+    for update_id in (1, 2, 3):
+        dispatcher.submit(message(update_id, 1))
+    assert dispatcher.shutdown(timeout=5)
+    assert handled == [1, 3]
+    assert dispatcher.get_stats()['errors'] == 1
+
+
+def test_timed_out_shutdown_reports_oldest_unprocessed():
+    release = threading.Event()
+    dispatcher = UpdateDispatcher(lambda update: release.wait(5), workers=2, queue_size=10)
+    dispatcher.start()
+    for update_id in (10, 11, 12):
+        dispatcher.submit(message(update_id, 1))
+    assert not dispatcher.shutdown(timeout=0.2)
+    assert dispatcher.oldest_unprocessed() == 10
+    assert not dispatcher.submit(message(13, 2))
+    release.set()
@@ -0,0 +1,147 @@
+"""
+Параллельная обработка Telegram update с сохранением порядка внутри чата
+"""
+
+import logging
+import queue
+import threading
+import time
+
+try:
+    from config import UPDATES_CONFIG
+except Exception:
+    UPDATES_CONFIG = {}
+
+_STOP = object()
+
+
+def chat_key(update):
+    """Ключ шардирования: чат update (для callback — чат сообщения с кнопкой)"""
+    for kind in ('message', 'edited_message', 'channel_post', 'callback_query'):
+        payload = update.get(kind)
+        if not payload:
+            continue
+        chat = (payload.get('message') or {}).get('chat') if kind == 'callback_query' else payload.get('chat')
+        if chat and 'id' in chat:
+            return chat['id']
+        if payload.get('from'):
+            return payload['from']['id']
+    return update.get('update_id', 0)
+
+
+class UpdateDispatcher:
+    """Пул обработчиков update, шардированный по chat_id.
+
+    У каждого потока своя ограниченная очередь, и все update одного чата попадают
+    в одну и ту же очередь — порядок сообщений в чате сохраняется, а медленный
+    обработчик задерживает только свой шард. Если очередь шарда заполнена,
+    submit() блокируется, и поток getUpdates перестает забирать новые update.
+    """
+
+    def __init__(self, handler, workers=None, queue_size=None):
+        self.handler = handler
+        self.workers = workers or UPDATES_CONFIG.get('workers', 8)
+        self.queue_size = queue_size or UPDATES_CONFIG.get('queue_size', 100)
+        self.accepting = False
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._unprocessed = set()
+        self.stats = {'submitted': 0, 'processed': 0, 'errors': 0, 'blocked': 0, 'rejected': 0, 'max_depth': 0}
+
+    def start(self):
+        """Запуск потоков-обработчиков"""
+        self.accepting = True
+        for index, shard in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(shard,), name=f"update-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Обработка update: {self.workers} потоков, очередь {self.queue_size} на поток")
+
+    def submit(self, update, block=True):
+        """Поставить update в очередь его чата.
+
+        False, если диспетчер останавливается или (при block=False) очередь чата заполнена.
+        """
+        shard = self._queues[hash(chat_key(update)) % self.workers]
+        update_id = update.get('update_id')
+        blocked = False
+        while self.accepting:
+            with self._lock:
+                self._unprocessed.add(update_id)
+            try:
+                shard.put(update, block=block, timeout=1 if block else None)
+            except queue.Full:
+                with self._lock:
+                    self._unprocessed.discard(update_id)
+                if not block:
+                    with self._lock:
+                        self.stats['rejected'] += 1
+                    return False
+                if not blocked:
+                    blocked = True
+                    with self._lock:
+                        self.stats['blocked'] += 1
+                    logging.info("Очередь обработки update заполнена, прием приостановлен")
+                continue
+            with self._lock:
+                self.stats['submitted'] += 1
+                self.stats['max_depth'] = max(self.stats['max_depth'], shard.qsize())
+            return True
+        return False
+
+    def _worker(self, shard):
+        while True:
+            update = shard.get()
+            if update is _STOP:
+                shard.task_done()
+                return
+            try:
+                self.handler(update)
+            except Exception as e:
+                with self._lock:
+                    self.stats['errors'] += 1
+                logging.error(f"Ошибка обработки update {update.get('update_id')}: {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self.stats['processed'] += 1
+                    self._unprocessed.discard(update.get('update_id'))
+                shard.task_done()
+
+    def pending(self):
+        """Update в очередях (без учета обрабатываемых прямо сейчас)"""
+        return sum(shard.qsize() for shard in self._queues)
+
+    def oldest_unprocessed(self):
+        """Наименьший update_id из принятых, но еще не обработанных (None — все обработаны)"""
+        with self._lock:
+            return min((update_id for update_id in self._unprocessed if update_id is not None), default=None)
+
+    def shutdown(self, timeout=None):
+        """Прекратить прием и дождаться обработки уже принятых update.
+
+        Возвращает True, если все очереди разобраны за отведенное время.
+        """
+        timeout = UPDATES_CONFIG.get('drain_timeout', 30) if timeout is None else timeout
+        self.accepting = False
+        deadline = time.monotonic() + timeout
+        for shard in self._queues:
+            try:
+                shard.put(_STOP, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        drained = not any(thread.is_alive() for thread in self._threads)
+        if not drained:
+            logging.warning(f"Не обработано update при остановке: {self.pending()}")
+        return drained
+
+    def get_stats(self):
+        """Счетчики и текущая глубина очередей"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['workers'] = self.workers
+        stats['pending'] = self.pending()
+        stats['alive_workers'] = sum(1 for thread in self._threads if thread.is_alive())
+        return stats
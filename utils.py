@@ -170,35 +170,23 @@ def create_stars_display(rating):
 
 def send_telegram_message(bot_token, chat_id, text, reply_markup=None):
     """Универсальная функция отправки сообщений"""
-    import json
-    import urllib.request
-    import urllib.parse
-    
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    data = {
-        'chat_id': chat_id,
-        'text': text,
-        'parse_mode': 'HTML'
-    }
-    
-    if reply_markup:
-        data['reply_markup'] = json.dumps(reply_markup)
-    
-    try:
-        data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-        req = urllib.request.Request(url, data=data_encoded, method='POST')
-        with urllib.request.urlopen(req) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            return result.get('ok', False)
-    except Exception as e:
-        logging.info(f"Ошибка отправки сообщения: {e}")
-        return False
+    from telegram_api import get_telegram_api
+
+    result = get_telegram_api(bot_token).send_message(chat_id, text, reply_markup=reply_markup or None)
+    if 'error' in result:
+        logging.info(f"Ошибка отправки сообщения: {result['error']}")
+    return result.get('ok', False)
 
 def schedule_notification(notification_manager, notification_type, delay_hours=0):
     """Планирование отправки уведомлений"""
     import time
     import threading
     
+    # Постоянная очередь бота переживает перезапуск, поток со sleep — нет
+    if getattr(notification_manager, 'jobs', None) is not None:
+        notification_manager.jobs.enqueue('notification', {'type': notification_type}, delay_hours * 3600)
+        return
+    
     def delayed_notification():
         if delay_hours > 0:
             time.sleep(delay_hours * 3600)  # Конвертируем часы в секунды
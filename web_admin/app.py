@@ -12,8 +12,10 @@ from flask import Flask, render_template, request, redirect, url_for, flash, jso
 # Добавляем путь к модулям бота
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import DatabaseManager
+from database import DatabaseManager, build_search_query, day_range
 from bot_integration import TelegramBotIntegration
+from rate_governor import BULK, outbound_priority
+from broadcasts import STATUS_LABELS, TRANSITIONS, change_broadcast_status, create_broadcast_job, get_broadcast_jobs
 from inventory_management import InventoryManager
 
 
@@ -30,7 +32,7 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-change-in-produc
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH_WEBPANEL = os.path.join(BASE_DIR, 'shop_bot.db')
 db = DatabaseManager(DB_PATH_WEBPANEL)
-telegram_bot = TelegramBotIntegration()
+telegram_bot = TelegramBotIntegration(db)
 
 # Настройки загрузки файлов
 UPLOAD_FOLDER = 'static/uploads'
@@ -88,8 +90,8 @@ def dashboard():
             COALESCE(SUM(total_amount), 0) as revenue_today,
             COUNT(DISTINCT user_id) as customers_today
         FROM orders 
-        WHERE DATE(created_at) = ?
-    ''', (today,))
+        WHERE created_at >= ? AND created_at < ?
+    ''', day_range(today))
     
     # Статистика за вчера
     yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
@@ -98,8 +100,8 @@ def dashboard():
             COUNT(*) as orders_yesterday,
             COALESCE(SUM(total_amount), 0) as revenue_yesterday
         FROM orders 
-        WHERE DATE(created_at) = ?
-    ''', (yesterday,))
+        WHERE created_at >= ? AND created_at < ?
+    ''', day_range(yesterday))
     
     # Общая статистика
     total_stats = db.execute_query('''
@@ -152,39 +154,42 @@ def orders():
     search = request.args.get('search', '')
     
     # Базовый запрос
-    query = '''
-        SELECT o.id, o.total_amount, o.status, o.created_at, u.name, u.telegram_id, u.phone, u.email, o.delivery_address, o.payment_method
-        FROM orders o
-        JOIN users u ON o.user_id = u.id
-        WHERE 1=1
-    '''
+    where = ' WHERE 1=1'
     params = []
     
     # Фильтры
     if status_filter:
-        query += ' AND o.status = ?'
+        where += ' AND o.status = ?'
         params.append(status_filter)
     
     if search:
-        query += ' AND (u.name LIKE ? OR o.id = ?)'
+        where += ' AND (u.name LIKE ? OR o.id = ?)'
         params.extend([f'%{search}%', search])
     
-    query += ' ORDER BY o.created_at DESC'
+    query = '''
+        SELECT o.id, o.total_amount, o.status, o.created_at, u.name, u.telegram_id, u.phone, u.email, o.delivery_address, o.payment_method
+        FROM orders o
+        JOIN users u ON o.user_id = u.id
+    ''' + where
     
-    # Получаем все заказы для подсчета страниц
-    all_orders = db.execute_query(query, params)
-    total_orders = len(all_orders) if all_orders else 0
+    # Количество страниц: дешевый COUNT(*) с кэшированием
+    total_orders = db.count_cached(
+        'SELECT COUNT(*) FROM orders o JOIN users u ON o.user_id = u.id' + where, params
+    )
     total_pages = (total_orders + per_page - 1) // per_page
     
-    # Получаем заказы для текущей страницы
-    offset = (page - 1) * per_page
-    paginated_query = query + f' LIMIT {per_page} OFFSET {offset}'
-    orders_data = db.execute_query(paginated_query, params)
+    # Keyset-пагинация по (created_at, id); OFFSET только при переходе на номер страницы
+    cursor = request.args.get('cursor')
+    result = db.paginate(query, params, order_by=(('created_at', 'DESC'), ('id', 'DESC')),
+                         limit=per_page, cursor=cursor,
+                         offset=0 if cursor else (page - 1) * per_page)
     
     return render_template('orders.html',
-                         orders=orders_data or [],
+                         orders=result['rows'],
                          current_page=page,
                          total_pages=total_pages,
+                         next_cursor=result['next_cursor'],
+                         prev_cursor=result['prev_cursor'],
                          status_filter=status_filter,
                          search=search)
 
@@ -200,9 +205,17 @@ def products():
         per_page = 10
     offset = (page - 1) * per_page
 
+    source = "products p"
     where = "WHERE 1=1"
     params = []
-    if q:
+    order_by = "ORDER BY p.id DESC"
+    if q and db.fts_enabled:
+        # Полнотекстовый поиск FTS5: одно сопоставление, сортировка по релевантности (BM25)
+        source = "products_fts f JOIN products p ON p.id = f.rowid"
+        where += " AND products_fts MATCH ?"
+        params.append(build_search_query(q) or '""')
+        order_by = "ORDER BY f.rank, p.id DESC"
+    elif q:
         where += " AND (p.name LIKE ? OR p.description LIKE ?)"
         pattern = f"%{q}%"
         params.extend([pattern, pattern])
@@ -211,7 +224,7 @@ def products():
         params.append(int(category_filter))
 
     # Total count
-    total_rows = db.execute_query(f"SELECT COUNT(*) FROM products p {where}", tuple(params)) or [(0,)]
+    total_rows = db.execute_query(f"SELECT COUNT(*) FROM {source} {where}", tuple(params)) or [(0,)]
     total = total_rows[0][0] if isinstance(total_rows[0], (list, tuple)) else total_rows[0]
     total_pages = max(1, (total + per_page - 1) // per_page)
 
@@ -221,10 +234,10 @@ def products():
         SELECT p.id, p.name, p.price, p.stock, p.is_active,
                c.name as category_name,
                p.sales_count, p.views, p.image_url
-        FROM products p
+        FROM {source}
         LEFT JOIN categories c ON c.id = p.category_id
         {where}
-        ORDER BY p.id DESC
+        {order_by}
         LIMIT ? OFFSET ?
         """,
         tuple(params + [per_page, offset])
@@ -434,38 +447,46 @@ def customers():
     search = request.args.get('search', '')
     
     # Базовый запрос
-    query = '''
-        SELECT u.id, u.name, u.phone, u.email, u.created_at,
-               COUNT(o.id) as orders_count,
-               COALESCE(SUM(o.total_amount), 0) as total_spent,
-               MAX(o.created_at) as last_order,
-       u.telegram_id
-        FROM users u
-        LEFT JOIN orders o ON u.id = o.user_id AND o.status != 'cancelled'
-        WHERE u.is_admin = 0
-    '''
+    where = ' WHERE u.is_admin = 0'
     params = []
     
     if search:
-        query += ' AND (u.name LIKE ? OR u.phone LIKE ? OR u.email LIKE ?)'
+        where += ' AND (u.name LIKE ? OR u.phone LIKE ? OR u.email LIKE ?)'
         params.extend([f'%{search}%', f'%{search}%', f'%{search}%'])
     
-    query += ' GROUP BY u.id ORDER BY total_spent DESC'
-    
-    # Получаем всех клиентов для подсчета страниц
-    all_customers = db.execute_query(query, params)
-    total_customers = len(all_customers) if all_customers else 0
+    # Количество страниц считаем по users без JOIN/GROUP BY
+    total_customers = db.count_cached('SELECT COUNT(*) FROM users u' + where, params)
     total_pages = (total_customers + per_page - 1) // per_page
     
-    # Получаем клиентов для текущей страницы
-    offset = (page - 1) * per_page
-    paginated_query = query + f' LIMIT {per_page} OFFSET {offset}'
-    customers_data = db.execute_query(paginated_query, params)
+    # Итоги заказов — из customer_rfm (поддерживается триггерами); keyset-пагинация
+    # по индексу customer_rfm(monetary, user_id), поиск сужает клиентов подзапросом
+    query = 'SELECT user_id as id, frequency, monetary as total_spent, last_order_at FROM customer_rfm'
+    if search:
+        query += ' WHERE user_id IN (SELECT u.id FROM users u' + where + ')'
+    cursor = request.args.get('cursor')
+    result = db.paginate(query, params, order_by=(('total_spent', 'DESC'), ('id', 'DESC')),
+                         limit=per_page, cursor=cursor,
+                         offset=0 if cursor else (page - 1) * per_page)
+    
+    # Карточки пользователей — только для клиентов страницы
+    rows = result['rows']
+    users = {}
+    if rows:
+        users = {row[0]: row for row in db.execute_query(f'''
+            SELECT id, name, phone, email, created_at, telegram_id
+            FROM users WHERE id IN ({','.join('?' * len(rows))})
+        ''', tuple(row[0] for row in rows)) or []}
+    customers_page = [
+        (user_id, *users[user_id][1:5], orders_count, total_spent, last_order, users[user_id][5])
+        for user_id, orders_count, total_spent, last_order in rows if user_id in users
+    ]
     
     return render_template('customers.html',
-                         customers=customers_data or [],
+                         customers=customers_page,
                          current_page=page,
                          total_pages=total_pages,
+                         next_cursor=result['next_cursor'],
+                         prev_cursor=result['prev_cursor'],
                          search=search,
                          now=datetime.now())
 
@@ -529,9 +550,9 @@ def analytics_page():
         stats = db.execute_query('''
             SELECT COUNT(*), IFNULL(SUM(total_amount), 0), IFNULL(AVG(total_amount), 0)
             FROM orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+            WHERE created_at >= ? AND created_at < ?
             AND status != 'cancelled'
-        ''', (start_date, end_date))
+        ''', day_range(start_date, end_date))
 
         if stats and stats[0]:
             sales_report = {
@@ -555,8 +576,9 @@ def crm_page():
         from crm import CRMManager
         crm_manager = CRMManager(db)
         
-        segments = crm_manager.segment_customers()
-        at_risk_customers = crm_manager.get_churn_risk_customers()
+        # Итоги сегментов и первые клиенты в зоне риска — из таблицы customer_rfm по индексам
+        segments = crm_manager.get_segment_summary()
+        at_risk_customers = crm_manager.get_churn_risk_customers(limit=50)
         
         return render_template('crm.html',
                              segments=segments,
@@ -588,7 +610,9 @@ def crm_page():
                 segments['loyal'].append((uid, name, orders, spent))
             else:
                 segments['new'].append((uid, name, orders, spent))
-        return render_template('crm.html', segments=segments, at_risk_customers=segments['at_risk'])
+        summary = {name: {'customers': len(customers), 'monetary': sum(c[3] for c in customers)}
+                   for name, customers in segments.items()}
+        return render_template('crm.html', segments=summary, at_risk_customers=[])
 
 @app.route('/scheduled_posts')
 @login_required
@@ -718,6 +742,7 @@ def edit_post(post_id):
 
 @app.route('/send_now_post', methods=['POST'])
 @login_required
+@outbound_priority(BULK)
 def send_now_post():
     post_id = request.form['post_id']
     
@@ -771,34 +796,17 @@ def send_now_post():
                 except Exception:
                     pass
         else:
-            # Отправка пользователям
-            recipients = posts_manager.get_recipients(target_audience)
-            logging.info(f"send_now_post recipients count={len(recipients) if recipients else 0}")
-            for recipient in recipients:
-                try:
-                    telegram_id = recipient[0] if isinstance(recipient, (list, tuple)) else recipient.get('telegram_id')
-                    if image_url and len(message_text) <= 1024:
-                        result = telegram_bot.send_photo(telegram_id, image_url, message_text, keyboard)
-                    elif image_url and len(message_text) > 1024:
-                        # Отправляем картинку без длинной подписи, затем текст
-                        _r1 = telegram_bot.send_photo(telegram_id, image_url, '', None)
-                        result = telegram_bot.send_message(telegram_id, message_text, keyboard)
-                    else:
-                        result = telegram_bot.send_message(telegram_id, message_text, keyboard)
-                    ok = bool(result and isinstance(result, dict) and result.get('ok'))
-                    if ok:
-                        success_count += 1
-                    else:
-                        error_count += 1
-                        try:
-                            err_desc = (result or {}).get('description')
-                            if err_desc:
-                                flash(f'❌ Ошибка отправки: {err_desc}')
-                        except Exception:
-                            pass
-                except Exception as e:
-                    error_count += 1
-                    logging.info(f"Ошибка отправки пользователю: {e}")
+            # Пользователям — заданием рассылки, его отправит бот; прогресс на странице рассылок
+            job_id, total = create_broadcast_job(
+                db, message_text, target_audience, image_url, keyboard,
+                title=title, post_id=post_id, time_period='manual'
+            )
+            if not job_id:
+                flash(f'Неизвестная аудитория: {target_audience}')
+                return redirect(url_for('scheduled_posts'))
+            telegram_bot.trigger_bot_data_reload(['broadcast_jobs'])
+            flash(f'📢 Рассылка #{job_id} поставлена в очередь: получателей {total}')
+            return redirect(url_for('broadcasts'))
         
         # Триггерим перезагрузку данных у бота — чтобы в админ-чат пришло "Данные обновлены"
         try:
@@ -1062,41 +1070,47 @@ def send_broadcast():
     target_audience = request.form['target_audience']
     
     try:
-        # Получаем список получателей
-        if target_audience == 'all':
-            recipients = db.execute_query(
-                'SELECT telegram_id, name, language FROM users WHERE is_admin = 0'
-            )
-        elif target_audience == 'active':
-            recipients = db.execute_query('''
-                SELECT DISTINCT u.telegram_id, u.name, u.language
-                FROM users u
-                JOIN orders o ON u.id = o.user_id
-                WHERE u.is_admin = 0 AND o.created_at >= datetime('now', '-30 days')
-            ''')
-        elif target_audience == 'vip':
-            recipients = db.execute_query('''
-                SELECT DISTINCT u.telegram_id, u.name, u.language
-                FROM users u
-                JOIN orders o ON u.id = o.user_id
-                WHERE u.is_admin = 0
-                GROUP BY u.id
-                HAVING SUM(o.total_amount) >= 500
-            ''')
-        else:
-            recipients = []
-        
-        if recipients:
-            success_count, error_count = telegram_bot.send_broadcast(message, recipients)
-            flash(f'Рассылка завершена! Отправлено: {success_count}, Ошибок: {error_count}')
-        else:
+        job_id, total = create_broadcast_job(db, message, target_audience, title='Рассылка из панели')
+        if not job_id:
             flash('Нет получателей для рассылки')
+            return redirect(url_for('customers'))
+        telegram_bot.trigger_bot_data_reload(['broadcast_jobs'])
+        flash(f'📢 Рассылка #{job_id} поставлена в очередь: получателей {total}')
+        return redirect(url_for('broadcasts'))
             
     except Exception as e:
         flash(f'Ошибка рассылки: {e}')
     
     return redirect(url_for('customers'))
 
+@app.route('/broadcasts')
+@login_required
+def broadcasts():
+    """Задания рассылок: прогресс, пауза, продолжение, отмена"""
+    jobs = get_broadcast_jobs(db)
+    active = any(job[3] in ('pending', 'running') for job in jobs)
+    return render_template('broadcasts.html', jobs=jobs, status_labels=STATUS_LABELS, active=active)
+
+@app.route('/broadcasts/progress')
+@login_required
+def broadcasts_progress():
+    jobs = get_broadcast_jobs(db)
+    return jsonify([
+        {'id': job[0], 'status': job[3], 'status_label': STATUS_LABELS.get(job[3], job[3]),
+         'total': job[4], 'sent': job[5], 'errors': job[6]}
+        for job in jobs
+    ])
+
+@app.route('/broadcasts/<int:job_id>/<action>', methods=['POST'])
+@login_required
+def broadcast_action(job_id, action):
+    if change_broadcast_status(db, job_id, action):
+        telegram_bot.trigger_bot_data_reload(['broadcast_jobs'])
+        flash(f'Рассылка #{job_id}: {STATUS_LABELS[TRANSITIONS[action][1]]}')
+    else:
+        flash(f'Рассылку #{job_id} нельзя изменить в текущем статусе')
+    return redirect(url_for('broadcasts'))
+
 @app.route('/toggle_category_status', methods=['POST'])
 @login_required
 def toggle_category_status():
@@ -1200,25 +1214,45 @@ def reload_bot_data():
 def force_reload_bot():
     """Принудительная перезагрузка всех данных в боте"""
     try:
-        # Создаем специальный флаг для полной перезагрузки
-        force_reload_flag = '../force_reload_flag.txt'
-        with open(force_reload_flag, 'w') as f:
-            f.write(datetime.now().isoformat())
-        
-        # Уведомляем админов
-        reload_message = "🔄 <b>ПРИНУДИТЕЛЬНОЕ ОБНОВЛЕНИЕ</b>\n\n"
-        reload_message += "✅ Все данные перезагружены\n"
-        reload_message += "✅ Кэш очищен\n"
-        reload_message += "✅ Автопосты перезапущены\n\n"
-        reload_message += f"⏰ {datetime.now().strftime('%H:%M:%S')}"
-        
-        telegram_bot.notify_admins(reload_message)
-        flash('Данные в боте обновлены!')
+        # Полная перезагрузка: бот сам уведомит админов после синхронизации
+        if telegram_bot.trigger_bot_data_reload(['all']):
+            flash('Данные в боте обновлены!')
+        else:
+            flash('Бот недоступен: данные применятся при его запуске')
     except Exception as e:
         flash(f'Ошибка обновления данных: {e}')
     
     return redirect(request.referrer or url_for('dashboard'))
 
+@app.route('/query_stats')
+@login_required
+def query_stats():
+    """Статистика SQL-запросов веб-панели и бота, журнал медленных запросов"""
+    limit = request.args.get('limit', 30, type=int)
+    panel_stats = db.get_query_stats(limit=max(1, min(limit, 200)))
+
+    # Статистика процесса бота: /query_stats его HTTP-сервера мониторинга по токену
+    bot_stats = None
+    try:
+        import json
+        from urllib.request import Request, urlopen
+        from config import MONITORING_CONFIG
+        stats_request = Request(os.getenv('BOT_QUERY_STATS_URL', 'http://127.0.0.1:8080/query_stats'),
+                                headers={'X-Stats-Token': MONITORING_CONFIG.get('stats_token') or ''})
+        with urlopen(stats_request, timeout=2) as resp:
+            bot_stats = json.loads(resp.read().decode())
+    except Exception as e:
+        logging.info(f"Статистика запросов бота недоступна: {e}")
+
+    return render_template('query_stats.html', panel_stats=panel_stats, bot_stats=bot_stats)
+
+@app.route('/query_stats/reset', methods=['POST'])
+@login_required
+def reset_query_stats():
+    db.query_stats.reset()
+    flash('Статистика запросов сброшена')
+    return redirect(url_for('query_stats'))
+
 # API endpoints
 @app.route('/api/chart_data')
 @login_required
@@ -1236,11 +1270,11 @@ def chart_data():
                 DATE(created_at) as date,
                 COALESCE(SUM(total_amount), 0) as daily_revenue
             FROM orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+            WHERE created_at >= ? AND created_at < ?
             AND status != 'cancelled'
             GROUP BY DATE(created_at)
             ORDER BY date
-        ''', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+        ''', day_range(start_date, end_date))
         
         labels = [item[0] for item in sales_data] if sales_data else []
         data = [float(item[1]) for item in sales_data] if sales_data else []
@@ -1252,11 +1286,11 @@ def chart_data():
                 DATE(created_at) as date,
                 COUNT(*) as daily_orders
             FROM orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+            WHERE created_at >= ? AND created_at < ?
             AND status != 'cancelled'
             GROUP BY DATE(created_at)
             ORDER BY date
-        ''', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+        ''', day_range(start_date, end_date))
         
         labels = [item[0] for item in orders_data] if orders_data else []
         data = [item[1] for item in orders_data] if orders_data else []
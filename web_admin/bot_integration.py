@@ -5,56 +5,45 @@ import logging
 
 import sys
 import os
-import json
-import urllib.request
-import urllib.parse
 import time
 
 # Добавляем путь к модулям бота
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import BOT_TOKEN, POST_CHANNEL_ID
+from change_feed import notify_change
+from telegram_api import get_telegram_api
+from rate_governor import BULK, outbound_priority
+from file_id_cache import FileIdCache, is_invalid_file_id
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 class TelegramBotIntegration:
-    def __init__(self):
+    def __init__(self, db=None):
         self.token = BOT_TOKEN
-        self.base_url = f"https://api.telegram.org/bot{self.token}"
+        self.api = get_telegram_api(self.token)
         self.channel_id = POST_CHANNEL_ID
+        # С базой повторные отправки того же изображения идут по file_id
+        self.file_ids = FileIdCache(db) if db is not None else None
     
-    def trigger_bot_data_reload(self):
-        """Сигнал боту о необходимости перезагрузки данных"""
+    def trigger_bot_data_reload(self, entities=None):
+        """Сигнал боту об изменении данных.
+
+        Сами изменения бот берет из change_events (их пишут триггеры БД),
+        датаграмма лишь будит его сразу, не дожидаясь проверки data_version.
+        """
         try:
-            # Создаем файл-флаг для бота
-            update_flag_file = os.path.join(BASE_DIR, 'data_update_flag.txt')
-            with open(update_flag_file, 'w') as f:
-                f.write(str(time.time()))
-            return True
+            return notify_change(entities)
         except Exception as e:
-            logging.info(f"Ошибка создания флага обновления: {e}")
+            logging.info(f"Ошибка отправки сигнала обновления: {e}")
             return False
     
     def send_message(self, chat_id, text, reply_markup=None):
         """Отправка сообщения через Telegram API"""
-        url = f"{self.base_url}/sendMessage"
-        data = {
-            'chat_id': chat_id,
-            'text': text,
-            'parse_mode': 'HTML'
-        }
-        
-        if reply_markup:
-            data['reply_markup'] = json.dumps(reply_markup)
-        
-        try:
-            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=data_encoded, method='POST')
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                return result
-        except Exception as e:
-            logging.info(f"Ошибка отправки сообщения: {e}")
+        result = self.api.send_message(chat_id, text, reply_markup=reply_markup or None)
+        if 'error' in result:
+            logging.info(f"Ошибка отправки сообщения: {result['error']}")
             return None
+        return result
     
     def send_to_channel(self, message):
         """Отправка сообщения в канал"""
@@ -65,28 +54,22 @@ class TelegramBotIntegration:
         return self.send_photo(self.channel_id, photo_url, caption, reply_markup)
     
     def send_photo(self, chat_id, photo_url, caption="", reply_markup=None):
-        """Отправка фото"""
-        url = f"https://api.telegram.org/bot{self.token}/sendPhoto"
-        data = {
-            'chat_id': chat_id,
-            'photo': photo_url,
-            'caption': caption,
-            'parse_mode': 'HTML'
-        }
-        
-        if reply_markup:
-            data['reply_markup'] = json.dumps(reply_markup)
-        
-        try:
-            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=data_encoded, method='POST')
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                return result
-        except Exception as e:
-            logging.info(f"Ошибка отправки фото: {e}")
+        """Отправка фото (file_id общий с ботом: ключ — хэш локального файла или URL)"""
+        key = self.file_ids.photo_key(photo_url) if self.file_ids else None
+        file_id = self.file_ids.get(key) if key else None
+        result = self.api.send_photo(chat_id, file_id or photo_url, caption, reply_markup=reply_markup or None)
+        if file_id and is_invalid_file_id(result):
+            self.file_ids.invalidate(key)
+            file_id = None
+            result = self.api.send_photo(chat_id, photo_url, caption, reply_markup=reply_markup or None)
+        if key and not file_id and result.get('ok'):
+            self.file_ids.remember(key, result, str(photo_url))
+        if 'error' in result:
+            logging.info(f"Ошибка отправки фото: {result['error']}")
             return None
+        return result
     
+    @outbound_priority(BULK)
     def send_broadcast(self, message, user_list):
         """Массовая рассылка"""
         success_count = 0
@@ -124,14 +107,10 @@ class TelegramBotIntegration:
     
     def test_connection(self):
         """Тестирование соединения с Telegram"""
-        try:
-            url = f"{self.base_url}/getMe"
-            with urllib.request.urlopen(url) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                return result.get('ok', False)
-        except Exception as e:
-            logging.info(f"Ошибка тестирования соединения: {e}")
-            return False
+        result = self.api.request('getMe')
+        if 'error' in result:
+            logging.info(f"Ошибка тестирования соединения: {result['error']}")
+        return result.get('ok', False)
 
 # Глобальный экземпляр для использования в Flask
 telegram_bot = TelegramBotIntegration()
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+Прием Telegram update через вебхук
+
+Обработчик POST-запроса для HTTP-сервера HealthMonitor: проверяет секретный токен,
+ставит update в очередь диспетчера и сразу отвечает Telegram, не дожидаясь обработки.
+"""
+
+import hmac
+import json
+import logging
+import threading
+from collections import deque
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookReceiver:
+    """Получатель update от Telegram для UpdateDispatcher"""
+
+    def __init__(self, dispatcher, secret_token, dedup_size=1000):
+        self.dispatcher = dispatcher
+        self.secret_token = secret_token or ''
+        # Telegram повторяет доставку, если не получил ответ — повторы отбрасываем
+        self._recent_ids = set()
+        self._recent_order = deque()
+        self._dedup_size = dedup_size
+        self._lock = threading.Lock()
+        self.stats = {'received': 0, 'accepted': 0, 'duplicates': 0, 'rejected': 0, 'unauthorized': 0, 'invalid': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _remember(self, update_id):
+        """True, если update_id еще не встречался"""
+        with self._lock:
+            if update_id in self._recent_ids:
+                return False
+            self._recent_ids.add(update_id)
+            self._recent_order.append(update_id)
+            if len(self._recent_order) > self._dedup_size:
+                self._recent_ids.discard(self._recent_order.popleft())
+            return True
+
+    def _forget(self, update_id):
+        with self._lock:
+            self._recent_ids.discard(update_id)
+
+    def handle(self, headers, body):
+        """Разбор запроса Telegram; возвращает (HTTP-статус, тело ответа)"""
+        self._count('received')
+        token = headers.get(SECRET_HEADER) or ''
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            self._count('unauthorized')
+            return 401, {'ok': False}
+
+        try:
+            update = json.loads(body.decode('utf-8'))
+            update_id = update['update_id']
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self._count('invalid')
+            # Повтор не поможет — подтверждаем, чтобы Telegram не слал его снова
+            return 200, {'ok': False}
+
+        if not self._remember(update_id):
+            self._count('duplicates')
+            return 200, {'ok': True}
+
+        if not self.dispatcher.submit(update, block=False):
+            # Очередь чата заполнена или бот останавливается: Telegram доставит update повторно
+            self._forget(update_id)
+            self._count('rejected')
+            logging.info(f"Вебхук: update {update_id} отклонен, очередь заполнена")
+            return 503, {'ok': False}
+
+        self._count('accepted')
+        return 200, {'ok': True}
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
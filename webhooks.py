@@ -78,24 +78,26 @@ class WebhookManager:
     def confirm_payment(self, order_id, provider):
         """Подтверждение успешной оплаты"""
         try:
-            # Обновляем статус заказа
-            self.db.execute_query(
-                'UPDATE orders SET payment_status = "paid", status = "confirmed" WHERE id = ?',
-                (order_id,)
-            )
-            
-            # Получаем данные заказа
-            order = self.db.execute_query(
-                'SELECT user_id FROM orders WHERE id = ?',
-                (order_id,)
-            )
+            # Статус заказа и очистка корзины фиксируются вместе
+            with self.db.transaction():
+                self.db.execute_query(
+                    'UPDATE orders SET payment_status = "paid", status = "confirmed" WHERE id = ?',
+                    (order_id,)
+                )
+                
+                # Получаем данные заказа
+                order = self.db.execute_query(
+                    'SELECT user_id FROM orders WHERE id = ?',
+                    (order_id,)
+                )
+                
+                if order:
+                    # Очищаем корзину
+                    self.db.clear_cart(order[0][0])
             
             if order:
                 user_id = order[0][0]
                 
-                # Очищаем корзину
-                self.db.clear_cart(user_id)
-                
                 # Уведомляем клиента
                 user = self.db.execute_query(
                     'SELECT telegram_id, name FROM users WHERE id = ?',